@@ -1,12 +1,44 @@
 import os
 # import chromadb # REMOVED for lighter deployment
-from langchain_groq import ChatGroq
-from langchain_core.messages import SystemMessage, HumanMessage
 import logging
-from knowledge_base import get_context, get_context_menu
+import time
+import asyncio
+import contextlib
+from knowledge_base import get_context, get_context_menu, knowledge_version
+from model_health import ModelHealthRegistry, ModelsExhaustedError, is_context_length_error, is_rate_limit_error, response_headers
+from answer_cache import AnswerCache
+from intent_router import IntentRouter
+from local_answers import LocalAnswers
+from agent_tools import context_topics, parse_tool_calls, run_tool_calls, strip_tool_calls, visible_text
+from single_flight import SingleFlight
+from prompt_budget import PromptBuilder, Section
+from retrieval import RetrievalIndex
+from metrics import FALLBACK_HOPS, LLM_ATTEMPT_LATENCY, QUERIES, STAGE_LATENCY, TOOL_CALLS, record_usage
+from text_utils import USER_PLACEHOLDER, mentions_user, normalize_query, personalize
+from llm_backend import LLM_BACKEND, SystemMessage, HumanMessage
 
 logger = logging.getLogger('MAI_Logic')
 
+# Pool HTTP compartido por todos los clientes LLM (keep-alive, sin TLS handshake por llamada)
+LLM_MAX_CONNECTIONS = int(os.getenv('MAI_LLM_MAX_CONNECTIONS', 20))
+LLM_MAX_KEEPALIVE = int(os.getenv('MAI_LLM_MAX_KEEPALIVE', 10))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv('MAI_LLM_KEEPALIVE_EXPIRY', 60.0))
+LLM_TIMEOUT = float(os.getenv('MAI_LLM_TIMEOUT', 30.0))
+LLM_CONNECT_TIMEOUT = float(os.getenv('MAI_LLM_CONNECT_TIMEOUT', 5.0))
+# Si está activo, un acierto de caché hace una única llamada barata para reformular la respuesta
+CACHE_REPHRASE = os.getenv('MAI_CACHE_REPHRASE', '0') == '1'
+# Límites del bucle de herramientas (rondas CONTEXT/SEARCH y tiempo total, llamadas al LLM incluidas)
+TOOL_MAX_ITERATIONS = int(os.getenv('MAI_TOOL_MAX_ITERATIONS', 3))
+TOOL_TIME_BUDGET = float(os.getenv('MAI_TOOL_TIME_BUDGET', 30.0))
+# Hedging (opcional): si un modelo tarda más que su percentil de latencia, se lanza también el siguiente
+# (en streaming se mide el tiempo hasta el primer trozo)
+HEDGE_ENABLED = os.getenv('MAI_HEDGE', '0') == '1'
+HEDGE_PERCENTILE = float(os.getenv('MAI_HEDGE_PERCENTILE', 95))
+HEDGE_DELAY = float(os.getenv('MAI_HEDGE_DELAY', 4.0))          # mientras no haya muestras suficientes
+HEDGE_MIN_DELAY = float(os.getenv('MAI_HEDGE_MIN_DELAY', 1.0))
+# Modo degradado: con todos los modelos limitados se responde desde la base de conocimiento, sin LLM
+LOCAL_ANSWERS = os.getenv('MAI_LOCAL_ANSWERS', '1') != '0'
+
 class AgentLogic:
     # Lista de prioridades para fallback (De mejor a peor/más rápido)
     FALLBACK_MODELS = [
@@ -22,69 +54,382 @@ class AgentLogic:
         if not self.groq_api_key:
             logger.warning("GROQ_API_KEY is missing!")
         
+        # Compartido por todas las llamadas concurrentes a process_query
+        self.model_health = ModelHealthRegistry(self.FALLBACK_MODELS)
+        self.answer_cache = AnswerCache()
+        self.router = IntentRouter()
+        self.local_answers = LocalAnswers(self.router)
+        # Preguntas idénticas simultáneas en el mismo canal comparten una sola ejecución
+        self.single_flight = SingleFlight()
+        
+        # Un cliente por modelo, todos sobre la misma sesión HTTP
+        self._llms = {}
+        self._groq = None
+        self._http_client = None
+        if LLM_BACKEND == 'native':
+            from groq_client import GroqClient
+            self._groq = GroqClient(
+                self.groq_api_key,
+                max_connections=LLM_MAX_CONNECTIONS,
+                keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+                timeout=LLM_TIMEOUT,
+                connect_timeout=LLM_CONNECT_TIMEOUT,
+            )
+        else:
+            # LangChain solo se importa si se usa (es lo que más pesa al arrancar)
+            import httpx
+            self._http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=LLM_MAX_CONNECTIONS,
+                    max_keepalive_connections=LLM_MAX_KEEPALIVE,
+                    keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+                ),
+                timeout=httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+            )
+        
         # REMOVED ChromaDB initialization to save space (4GB -> <500MB)
-        logger.info(f"MAI Logic initialized. Fallback chain size: {len(self.FALLBACK_MODELS)}")
+        # En su lugar: BM25 local sobre la base de conocimiento y los canales aprendidos
+        self.retrieval = RetrievalIndex()
+        logger.info(f"MAI Logic initialized ({LLM_BACKEND} client). Fallback chain size: {len(self.FALLBACK_MODELS)}")
 
     def _get_llm(self, model_name):
-        """Get LLM instance with specific model."""
-        return ChatGroq(temperature=0.7, model_name=model_name, groq_api_key=self.groq_api_key)
-
-    async def _try_invoke_with_fallback(self, messages):
-        """Intenta ejecutar el prompt probando modelos en orden si falla por rate limit."""
+        """Get the cached LLM instance for a model (created on first use)."""
+        llm = self._llms.get(model_name)
+        if llm is None:
+            if self._groq is not None:
+                llm = self._groq.chat(model_name)
+            else:
+                from langchain_groq import ChatGroq
+                llm = ChatGroq(
+                    temperature=0.7,
+                    model_name=model_name,
+                    groq_api_key=self.groq_api_key,
+                    http_async_client=self._http_client,
+                    request_timeout=LLM_TIMEOUT,
+                )
+            self._llms[model_name] = llm
+        return llm
+
+    async def aclose(self):
+        """Cierra el pool HTTP compartido."""
+        self._llms.clear()
+        if self._groq is not None:
+            await self._groq.close()
+        if self._http_client is not None:
+            await self._http_client.aclose()
+        self.retrieval.close()
+
+    async def learn_from_text(self, messages, source):
+        """Añade mensajes (p. ej. de un canal) al índice de recuperación. Devuelve los pasajes nuevos."""
+        return await self.retrieval.learn(messages, source)
+
+    @staticmethod
+    def _messages_for(prompt, model):
+        """Mensajes para un modelo: un PromptBuilder se ajusta a su límite; una lista se usa tal cual."""
+        if not isinstance(prompt, PromptBuilder):
+            return prompt
+        with STAGE_LATENCY.time("prompt_build"):
+            return prompt.messages_for(model)
+
+    @staticmethod
+    def _observe_attempt(model, start, outcome):
+        """Métricas de un intento al LLM; los 429 y prompts demasiado largos cuentan como salto de fallback."""
+        LLM_ATTEMPT_LATENCY.observe(time.monotonic() - start, model, outcome)
+        if outcome in ("rate_limit", "context_length"):
+            FALLBACK_HOPS.inc(1, model, outcome)
+
+    def _record_failure(self, model, start, exc, stream=False):
+        """
+        Registra un intento fallido (log, salud del modelo y métricas).
+        Devuelve True si hay que probar con el siguiente modelo (429, prompt demasiado
+        largo) y False si el error no es de los que se arreglan cambiando de modelo.
+        """
+        where = " (stream)" if stream else ""
+        if is_rate_limit_error(exc):
+            logger.warning(f"⚠️ RATE LIMIT en {model}{where}. Cambiando al siguiente...")
+            self.model_health.record_rate_limit(model, exc)
+            self._observe_attempt(model, start, "rate_limit")
+            return True
+        if is_context_length_error(exc):
+            # El prompt no cabe en este modelo: no es culpa suya, probamos el siguiente
+            logger.warning(f"⚠️ Prompt demasiado largo para {model}{where}. Cambiando al siguiente...")
+            self._observe_attempt(model, start, "context_length")
+            return True
+        logger.error(f"Error crítico en {model}: {exc}")
+        self.model_health.record_failure(model, exc)
+        self._observe_attempt(model, start, "error")
+        return False
+
+    @staticmethod
+    async def _close_stream(stream):
+        """Cierra un stream que ya no se va a leer para liberar su conexión; sus errores dan igual."""
+        if stream is None:
+            return
+        with contextlib.suppress(Exception):
+            await stream.aclose()
+
+    async def _try_invoke_with_fallback(self, prompt):
+        """Intenta ejecutar el prompt probando modelos en orden si falla por rate limit.
+        El orden lo decide el registro de salud (se saltan los modelos en cooldown)."""
+        if HEDGE_ENABLED:
+            return await self._try_invoke_hedged(prompt)
         last_error = None
         
-        for model in self.FALLBACK_MODELS:
+        for model in self.model_health.ordered(self.FALLBACK_MODELS):
+            start = time.monotonic()
             try:
                 # logger.info(f"Intentando generar respuesta con modelo: {model}")
                 llm = self._get_llm(model)
-                response = await llm.ainvoke(messages)
+                response = await llm.ainvoke(self._messages_for(prompt, model))
+                self.model_health.record_success(model, time.monotonic() - start, response_headers(response))
+                self._observe_attempt(model, start, "ok")
+                record_usage(model, response)
                 if response:
                     return response
             except Exception as e:
-                error_str = str(e)
-                if "429" in error_str or "rate_limit" in error_str.lower():
-                    logger.warning(f"⚠️ RATE LIMIT en {model}. Cambiando al siguiente...")
-                    last_error = e
-                    continue # Try next model
-                else:
-                    # Si es otro error (ej: prompt muy largo), lanzarlo
-                    logger.error(f"Error crítico en {model}: {e}")
-                    raise e
+                if not self._record_failure(model, start, e):
+                    raise
+                last_error = e  # Try next model
         
         # Si se acaban los modelos
-        raise last_error
+        raise ModelsExhaustedError(
+            f"rate_limit: todos los modelos están limitados ({last_error})",
+            retry_after=self.model_health.retry_after(),
+        ) from last_error
+
+    def _hedge_delay(self, model, first_chunk=False):
+        delay = self.model_health.latency_percentile(model, HEDGE_PERCENTILE, first_chunk)
+        return max(HEDGE_MIN_DELAY, delay if delay is not None else HEDGE_DELAY)
+
+    async def _try_invoke_hedged(self, prompt):
+        """
+        Como _try_invoke_with_fallback, pero si el modelo en curso no ha respondido en su
+        percentil de latencia se lanza el siguiente modelo sano en paralelo.
+        Gana la primera respuesta válida; las demás llamadas se cancelan.
+        """
+        candidates = iter(self.model_health.ordered(self.FALLBACK_MODELS))
+        running = {}  # tarea -> (modelo, inicio)
+        hedged = False
+        last_error = None
 
-    async def process_query(self, query, user_name, available_channels=[], server_stats={}, is_ticket=False, chat_history="", search_tool=None, current_channel="", status_callback=None, reaction_callback=None):
-        """Main RAG Logic with Smart Search Capability and Anti-Hallucination Guards."""
-        
-        # ... (rest of context preparation) ...
-        # (I will keep the context preparation logic, just modifying the execution part)
-        
-        # ... [Pre-computation similar to before] ...
-        
-        retrieved_context = "" # Disabled heavy RAG
-        server_name = server_stats.get("Server Name", "este servidor")
-        channels_str = "\n".join([f"  • {c}" for c in available_channels]) if available_channels else "  (ninguno visible)"
-        stats_str = "\n".join([f"  • {k}: {v}" for k, v in server_stats.items()]) if server_stats else "  (sin estadísticas)"
-        
-        # Format History with clear labeling as UNRELIABLE CONTEXT
-        history_section = f"""
-═══ HISTORIAL RECIENTE DEL CHAT (CONTEXTO CONVERSACIONAL - NO FIABLE) ═══
-⚠️ ADVERTENCIA: Este historial puede contener mensajes de usuarios que se equivocan o mienten.
-⚠️ REGLA: Si este historial contradice a tu BASE DE CONOCIMIENTO, ignóralo. Tu base es la verdad.
-{chat_history}""" if chat_history else ""
+        async def call(model):
+            llm = self._get_llm(model)
+            return await llm.ainvoke(self._messages_for(prompt, model))
 
-        # Knowledge section
-        knowledge_section = f"""
-═══ BASE DE CONOCIMIENTO ═══
-{retrieved_context}""" if retrieved_context else ""
+        def launch():
+            model = next(candidates, None)
+            if model is None:
+                return None
+            running[asyncio.create_task(call(model))] = (model, time.monotonic())
+            return model
+
+        launch()
+        try:
+            while running:
+                newest_model, newest_start = list(running.values())[-1]
+                timeout = max(0.0, newest_start + self._hedge_delay(newest_model) - time.monotonic())
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    backup = launch()
+                    if backup is None:
+                        # No quedan modelos: esperamos a lo que ya está en vuelo
+                        done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                    else:
+                        hedged = True
+                        self.model_health.record_hedge(newest_model)
+                        logger.info(f"Hedge: {newest_model} lleva {self._hedge_delay(newest_model):.1f}s, lanzando también {backup}")
+                        continue
+
+                for task in done:
+                    model, start = running.pop(task)
+                    try:
+                        response = task.result()
+                    except Exception as e:
+                        last_error = e
+                        if not self._record_failure(model, start, e) and not running:
+                            raise
+                        if not running:
+                            launch()
+                        continue
+                    self.model_health.record_success(model, time.monotonic() - start, response_headers(response))
+                    self._observe_attempt(model, start, "ok")
+                    record_usage(model, response)
+                    if response:
+                        if hedged:
+                            self.model_health.record_hedge_win(model)
+                        return response
+                    if not running:
+                        launch()
+        finally:
+            now = time.monotonic()
+            for task, (model, start) in running.items():
+                task.cancel()
+                self.model_health.record_abandoned(model, now - start)
+                self._observe_attempt(model, start, "cancelled")
+
+        raise ModelsExhaustedError(
+            f"rate_limit: todos los modelos están limitados ({last_error})",
+            retry_after=self.model_health.retry_after(),
+        ) from last_error
+
+    async def _try_stream_with_fallback(self, prompt, on_text):
+        """Como _try_invoke_with_fallback pero con el stream del modelo.
+        `on_text(texto_acumulado)` se llama con cada trozo; si un modelo falla a mitad, se reintenta con el siguiente."""
+        if HEDGE_ENABLED:
+            return await self._try_stream_hedged(prompt, on_text)
+        last_error = None
+
+        for model in self.model_health.ordered(self.FALLBACK_MODELS):
+            start = time.monotonic()
+            full = None
+            stream = None
+            try:
+                stream = self._get_llm(model).astream(self._messages_for(prompt, model))
+                async for chunk in stream:
+                    if full is None:
+                        self.model_health.record_first_chunk(model, time.monotonic() - start)
+                    full = chunk if full is None else full + chunk
+                    await on_text(str(full.content))
+                self.model_health.record_success(model, time.monotonic() - start, response_headers(full))
+                self._observe_attempt(model, start, "ok")
+                record_usage(model, full)
+                if full is not None:
+                    return full
+            except Exception as e:
+                if full is not None:
+                    await on_text("")
+                if not self._record_failure(model, start, e, stream=True):
+                    raise
+                last_error = e
+            finally:
+                # Si on_text falla o nos cancelan a mitad, el stream queda a medias: se cierra aquí
+                await self._close_stream(stream)
+
+        raise ModelsExhaustedError(
+            f"rate_limit: todos los modelos están limitados ({last_error})",
+            retry_after=self.model_health.retry_after(),
+        ) from last_error
+
+    async def _try_stream_hedged(self, prompt, on_text):
+        """
+        Como _try_stream_with_fallback, pero con hedging del tiempo hasta el primer trozo: si el
+        modelo en curso no ha empezado a emitir en su percentil, se lanza también el siguiente.
+        Gana el primero que emite (solo ese llega a `on_text`); los demás se cancelan.
+        """
+        candidates = iter(self.model_health.ordered(self.FALLBACK_MODELS))
+        running = {}  # tarea (primer trozo) -> (modelo, inicio, stream)
+        streams = []  # todos los streams abiertos, para cerrarlos al salir
+        hedged = False
+        last_error = None
+
+        def launch():
+            model = next(candidates, None)
+            if model is None:
+                return None
+            stream = self._get_llm(model).astream(self._messages_for(prompt, model))
+            streams.append(stream)
+            running[asyncio.create_task(anext(stream, None))] = (model, time.monotonic(), stream)
+            return model
+
+        async def abandon():
+            now = time.monotonic()
+            abandoned = list(running.items())
+            running.clear()
+            for task, (model, start, _) in abandoned:
+                task.cancel()
+                self.model_health.record_abandoned(model, now - start, first_chunk=True)
+                self._observe_attempt(model, start, "cancelled")
+            # Un stream no se puede cerrar mientras su anext() sigue en curso: primero se espera la cancelación
+            await asyncio.gather(*(task for task, _ in abandoned), return_exceptions=True)
+            for _, (_, _, stream) in abandoned:
+                await self._close_stream(stream)
+
+        launch()
+        try:
+            while running:
+                newest_model, newest_start, _ = list(running.values())[-1]
+                timeout = max(0.0, newest_start + self._hedge_delay(newest_model, True) - time.monotonic())
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    backup = launch()
+                    if backup is None:
+                        # No quedan modelos: esperamos a lo que ya está en vuelo
+                        done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                    else:
+                        hedged = True
+                        self.model_health.record_hedge(newest_model)
+                        logger.info(f"Hedge (stream): {newest_model} sin primer trozo en {self._hedge_delay(newest_model, True):.1f}s, lanzando también {backup}")
+                        continue
+
+                for task in done:
+                    if task not in running:
+                        continue  # cancelada porque otro modelo de esta misma tanda ya ganó
+                    model, start, stream = running.pop(task)
+                    full = None
+                    try:
+                        full = task.result()
+                        if full is not None:
+                            # Ganador: el resto se cancela y se sigue solo con este stream
+                            self.model_health.record_first_chunk(model, time.monotonic() - start)
+                            await abandon()
+                            await on_text(str(full.content))
+                            async for chunk in stream:
+                                full = full + chunk
+                                await on_text(str(full.content))
+                    except Exception as e:
+                        last_error = e
+                        await self._close_stream(stream)
+                        if full is not None:
+                            await on_text("")
+                        if not self._record_failure(model, start, e, stream=True) and not running:
+                            raise
+                        if not running:
+                            launch()
+                        continue
+                    self.model_health.record_success(model, time.monotonic() - start, response_headers(full))
+                    self._observe_attempt(model, start, "ok")
+                    record_usage(model, full)
+                    if full is not None:
+                        if hedged:
+                            self.model_health.record_hedge_win(model)
+                        return full
+                    if not running:
+                        launch()
+        finally:
+            await abandon()
+            for stream in streams:
+                await self._close_stream(stream)  # el ganador, si on_text falló o nos cancelaron a mitad
+
+        raise ModelsExhaustedError(
+            f"rate_limit: todos los modelos están limitados ({last_error})",
+            retry_after=self.model_health.retry_after(),
+        ) from last_error
+
+    async def _rephrase_cached(self, answer, query):
+        """Reformula una respuesta cacheada con el modelo más barato. Si falla, devuelve la original."""
+        messages = [
+            SystemMessage(content=f"Eres M.A.I. Reescribe la respuesta con otras palabras, mismo contenido, mismo tono y mismos enlaces. Conserva {USER_PLACEHOLDER} tal cual y un posible 'REACT: <emoji>' final. Devuelve SOLO la respuesta."),
+            HumanMessage(content=f"Pregunta: {query}\n\nRespuesta:\n{answer}"),
+        ]
+        try:
+            response = await self._get_llm(self.FALLBACK_MODELS[-1]).ainvoke(messages)
+            return str(response.content) or answer
+        except Exception as e:
+            logger.warning(f"Cache rephrase failed, serving cached answer as is: {e}")
+            return answer
+
+    def _local_answer(self, query, user_name, route):
+        QUERIES.inc(1, "local")
+        return self.local_answers.answer(query, user_name, route.scores, self.model_health.retry_after())
 
-        current_channel_info = f"\n  📍 Canal actual: #{current_channel}" if current_channel else ""
+    def render_system_prefix(self, available_channels, server_stats):
+        """Parte del system prompt que no depende de la consulta (personalidad, reglas, canales)."""
+        channels_str = "\n".join([f"  • {c}" for c in available_channels]) if available_channels else "  (ninguno visible)"
+        stats_str = "\n".join([f"  • {k}: {v}" for k, v in server_stats.items()]) if server_stats else "  (sin estadísticas)"
         
-        system_prompt = f"""## IDENTIDAD Y PERSONALIDAD
+        return f"""## IDENTIDAD Y PERSONALIDAD
 Eres M.A.I. (Meulify Artificial Intelligence), la IA oficial de Meulify.
 Fuiste creada por La Cabra 🐐, el crack legendario que desarrolla todo esto.
-{current_channel_info}
 
 PERSONALIDAD (MUY IMPORTANTE):
 - Eres una chica española de 16 años, enrollada y simpática
@@ -185,111 +530,181 @@ Ejemplos:
 2. Si preguntan por mensajes de un canal → USA SEARCH
 3. NUNCA digas "busqué" o "no encontré" sin haber usado la herramienta
 4. Si necesitas una herramienta → responde SOLO con el comando
+5. Puedes pedir VARIAS herramientas a la vez, una por línea (se ejecutan en paralelo). Ej:
+   CONTEXT: descargas_ios, descargas_android
+   SEARCH: evento @ anuncios
 
 ## FORMATO DE RESPUESTA
 - Responde de forma natural, clara y útil
-- Si necesitas una herramienta, tu respuesta debe ser SOLO el comando
+- Si necesitas herramientas, tu respuesta debe ser SOLO los comandos (uno por línea)
 - NUNCA digas "he buscado" o "según mi info de Meulify" sin haber usado la herramienta
 """
 
-        # Build user message with clear sections
+    async def process_query(self, query, user_name, available_channels=[], server_stats={}, is_ticket=False, chat_history="", search_tool=None, current_channel="", channel_id=None, status_callback=None, reaction_callback=None, stream_callback=None, system_prefix=None):
+        """Main RAG Logic with Smart Search Capability and Anti-Hallucination Guards.
+        Con `stream_callback(texto)` la respuesta se va entregando mientras se genera (sin directivas).
+        Si la misma pregunta ya está en curso en este canal (`channel_id`), se espera a esa respuesta en vez de repetirla."""
+        # Clasificador local: si está claro qué sección necesita, se la damos ya en el primer prompt
+        route = self.router.route(query)
+        words = normalize_query(query)
+
+        async def answer():
+            return await self._answer_query(query, user_name, route, available_channels, server_stats, is_ticket, chat_history, search_tool, current_channel, status_callback, reaction_callback, stream_callback, system_prefix)
+
+        # Los tickets son privados y una pregunta sin contenido ("hola") no identifica nada
+        if is_ticket or not words or channel_id is None:
+            return personalize(await answer(), user_name)
+
+        # Por id de canal: dos guilds con su #general no comparten respuestas (ni menciones <#id>)
+        scope = (tuple(route.topics) if route.confident else (), knowledge_version())
+        key = (words, channel_id, scope)
+        response, leader_name, shared = await self.single_flight.run(key, answer, owner=user_name)
+        if shared and leader_name != user_name and mentions_user(response, leader_name):
+            # La respuesta nombra a quien preguntó primero (p. ej. sacado del historial): no vale para este usuario
+            logger.info(f"Shared answer names {leader_name}, answering {user_name} separately")
+            response, shared = await answer(), False
+        if shared:
+            QUERIES.inc(1, "shared")
+        # Las respuestas salen con el marcador del usuario: el nombre se pone aquí, al contestar
+        return personalize(response, user_name)
+
+    async def _answer_query(self, query, user_name, route, available_channels, server_stats, is_ticket, chat_history, search_tool, current_channel, status_callback, reaction_callback, stream_callback, system_prefix):
+        routed_topics = route.topics if route.confident else None
+
+        # Preguntas frecuentes: si ya la respondimos con la misma base de conocimiento, no hace falta el LLM
+        if not is_ticket:
+            cached = self.answer_cache.get(query, topics=routed_topics)
+            if cached:
+                logger.info(f"Answer cache hit for {user_name} | {self.answer_cache.stats()}")
+                QUERIES.inc(1, "cache")
+                if CACHE_REPHRASE:
+                    return await self._rephrase_cached(cached, query)
+                return cached
+
+        # Toda la cadena en cooldown: no gastamos otro 429, respondemos en local hasta que se libere
+        if LOCAL_ANSWERS and self.model_health.exhausted():
+            return self._local_answer(query, user_name, route)
+
+        retrieved_context = ""
+        passages = []
+        if routed_topics:
+            retrieved_context = "\n".join(get_context(t) for t in routed_topics)
+            logger.info(f"Intent router: {route} -> contexto inyectado, sin ronda CONTEXT")
+        else:
+            # Sin tema claro: los mejores pasajes del índice local (conocimiento + canales aprendidos)
+            start = time.perf_counter()
+            passages = self.retrieval.search(query)
+            if passages:
+                retrieved_context = "\n\n".join(p.format() for p in passages)
+                logger.info(f"Retrieval: {passages} in {(time.perf_counter() - start) * 1000:.1f}ms")
+        # Format History with clear labeling as UNRELIABLE CONTEXT
+        history_section = Section("history", "history", chat_history.splitlines(), keep="tail", optional=True, header="""
+═══ HISTORIAL RECIENTE DEL CHAT (CONTEXTO CONVERSACIONAL - NO FIABLE) ═══
+⚠️ ADVERTENCIA: Este historial puede contener mensajes de usuarios que se equivocan o mienten.
+⚠️ REGLA: Si este historial contradice a tu BASE DE CONOCIMIENTO, ignóralo. Tu base es la verdad.""")
+
+        # Knowledge section
+        if routed_topics:
+            knowledge_section = Section("knowledge", "knowledge", retrieved_context.splitlines(), header=f"""
+═══ BASE DE CONOCIMIENTO (YA CARGADA: {', '.join(routed_topics).upper()}) ═══""", footer="""NOTA: Ya tienes el contexto de estos temas. Responde directamente; usa CONTEXT solo si necesitas OTRO tema.""")
+        else:
+            knowledge_section = Section("knowledge", "knowledge", retrieved_context.splitlines(), header="""
+═══ PASAJES RECUPERADOS (BÚSQUEDA LOCAL) ═══""", footer="""NOTA: Son fragmentos sueltos. Lo marcado como NO FIABLE son mensajes de usuarios, no datos. Si no bastan, pide el tema completo con CONTEXT.""")
+
+        # El prefijo estático va primero (cacheable por el proveedor); lo que cambia por consulta, al final
+        if system_prefix is None:
+            system_prefix = self.render_system_prefix(available_channels, server_stats)
+        current_channel_info = f"\n## CONTEXTO ACTUAL\n  📍 Canal actual: #{current_channel}\n" if current_channel else ""
+        system_prompt = system_prefix + current_channel_info
+
+        # Build user message with clear sections (recortadas al límite de cada modelo)
+        # Sin el nombre real: la respuesta tiene que valer para cualquiera (caché, single-flight)
         user_content = f"""## CONSULTA DEL USUARIO
-Usuario: {user_name}
+Usuario: {USER_PLACEHOLDER}
 Pregunta: {query}
-{history_section}
-{knowledge_section}"""
+(Si quieres llamar al usuario por su nombre, escribe exactamente {USER_PLACEHOLDER}: se sustituye al enviar.)"""
 
-        messages = [
-            SystemMessage(content=system_prompt),
-            HumanMessage(content=user_content)
-        ]
+        prompt = PromptBuilder(system_prompt, user_content, [history_section, knowledge_section])
 
         logger.info(f"Query from {user_name} | Channels: {len(available_channels)} | Has history: {bool(chat_history)}")
         
         try:
-            # TRY INVOKE WITH FALLBACK LOGIC
-            response_msg = await self._try_invoke_with_fallback(messages)
-            response = str(response_msg.content)
-            
-            # ... (rest of search/context processing with _try_invoke_with_fallback instead of direct llm.ainvoke)
-            if "CONTEXT:" in response:
-                try:
-                    context_part = response.split("CONTEXT:", 1)[1].strip()
-                    context_part = context_part.split("\n")[0].strip().lower()
-                    
-                    logger.info(f"Agent requested context: '{context_part}'")
-                    
-                    # Get the requested context
-                    context_data = get_context(context_part)
-                    
-                    # Feed back context
-                    context_feedback = f"""
-═══ CONTEXTO SOLICITADO: {context_part.upper()} ═══
-{context_data}
-
-Ahora responde la pregunta original del usuario: "{query}"
-Usa esta información para dar una respuesta útil y completa.
-"""
-                    messages.append(SystemMessage(content=context_feedback))
-                    
-                    # Final Answer with context
-                    final_response_msg = await self._try_invoke_with_fallback(messages)
-                    return final_response_msg.content
-
-                except Exception as parse_error:
-                    logger.error(f"Context parsing error: {parse_error}")
-                    return response
-
-            # Check if Search is requested
-            if "SEARCH:" in response and search_tool:
+            deadline = time.monotonic() + TOOL_TIME_BUDGET
+            used_topics = list(routed_topics or []) + [p.topic for p in passages if p.trusted]
+            # Los pasajes de canales son como una búsqueda: la respuesta no se cachea
+            used_search = any(not p.trusted for p in passages)
+            response = ""
+            timed_out = False
+
+            # Bucle de herramientas acotado: cada ronda ejecuta en paralelo todas las directivas pedidas
+            async def on_text(text):
+                visible = visible_text(text)
+                if visible is not None:
+                    await stream_callback(personalize(visible, user_name, partial=True))
+
+            for iteration in range(TOOL_MAX_ITERATIONS + 1):
+                if stream_callback:
+                    attempt = self._try_stream_with_fallback(prompt, on_text)
+                else:
+                    attempt = self._try_invoke_with_fallback(prompt)
                 try:
-                    # Parse "SEARCH: query @ channel"
-                    search_part = response.split("SEARCH:", 1)[1].strip()
-                    # Clean any trailing text after the search command
-                    search_part = search_part.split("\n")[0].strip()
-                    
-                    if "@" in search_part:
-                        search_query, target_channel = search_part.rsplit("@", 1)
-                        search_query = search_query.strip()
-                        target_channel = target_channel.strip()
-                    else:
-                        search_query = search_part
-                        target_channel = "ALL"
-
-                    logger.info(f"Agent requested search: '{search_query}' in '{target_channel}'")
-                    
-                    # Perform Search
-                    search_results = await search_tool(search_query, target_channel)
-                    
-                    # IMPROVED post-search prompt with strict anti-hallucination rules
-                    search_feedback = f"""
-═══ RESULTADOS DE BÚSQUEDA ═══
-Canal buscado: {target_channel}
-Consulta: "{search_query}"
-
-{search_results}
-
-═══ INSTRUCCIONES POST-BÚSQUEDA ═══
-1. Si hay mensajes arriba, úsalos para responder la pregunta original
-2. Si dice "No matching messages found", NO INVENTES mensajes - di honestamente que no encontraste información
-3. Responde SOLO basándote en lo que realmente se encontró
+                    # El presupuesto es para toda la consulta: cada ronda solo tiene lo que queda
+                    response_msg = await asyncio.wait_for(attempt, timeout=max(0.0, deadline - time.monotonic()))
+                except asyncio.TimeoutError:
+                    logger.warning(f"Time budget ({TOOL_TIME_BUDGET:.1f}s) exhausted waiting for the LLM in round {iteration + 1}")
+                    timed_out = True
+                    response = strip_tool_calls(response) or "Uf, no he podido encontrar esa información ahora mismo."
+                    break
+                response = str(response_msg.content)
+
+                calls = parse_tool_calls(response, allow_search=search_tool is not None)
+                if not calls:
+                    break
+
+                remaining = deadline - time.monotonic()
+                if iteration == TOOL_MAX_ITERATIONS or remaining <= 0:
+                    # Sin más rondas: nunca mostramos directivas al usuario
+                    logger.warning(f"Tool loop limit reached ({iteration} rounds, {remaining:.1f}s left)")
+                    response = strip_tool_calls(response) or "Uf, no he podido encontrar esa información ahora mismo."
+                    break
+
+                logger.info(f"Tool round {iteration + 1}: {calls}")
+                for call in calls:
+                    TOOL_CALLS.inc(1, call.kind)
+                used_topics.extend(context_topics(calls))
+                used_search = used_search or any(c.kind == "SEARCH" for c in calls)
+                results = await run_tool_calls(calls, search_tool, remaining)
+
+                last_round = iteration + 1 == TOOL_MAX_ITERATIONS or deadline - time.monotonic() <= 0
+                sections = [
+                    Section(call.kind.lower(), "search" if call.kind == "SEARCH" else "knowledge", body.splitlines(), header=header)
+                    for call, (header, body) in zip(calls, results)
+                ]
+                instructions = f"""
+═══ INSTRUCCIONES ═══
+1. Usa la información de arriba para responder la pregunta original
+2. Si una búsqueda dice "No se encontraron mensajes", NO INVENTES mensajes - di honestamente que no encontraste información
+3. Responde SOLO basándote en lo que realmente se encontró; cita los mensajes relevantes si los usas
 4. Si los resultados no responden la pregunta del usuario, admítelo claramente
-5. Cita los mensajes relevantes si los usas
+{"5. YA NO PUEDES USAR MÁS HERRAMIENTAS: responde ahora con lo que tienes." if last_round else "5. Si de verdad te falta algo, puedes pedir más herramientas (una por línea)."}
 
 Ahora responde la pregunta original del usuario: "{query}"
 """
-                    messages.append(SystemMessage(content=search_feedback))
-                    
-                    # Final Answer
-                    final_response_msg = await self._try_invoke_with_fallback(messages)
-                    return final_response_msg.content
-
-                except Exception as parse_error:
-                    logger.error(f"Search parsing error: {parse_error}")
-                    return response
-            
+                prompt.add_round(sections, instructions)
+
+            # Solo se cachean respuestas basadas únicamente en la base de conocimiento y que valgan
+            # para cualquiera: sin el nombre del usuario (p. ej. sacado del historial) ni canales del guild
+            if used_topics and not used_search and not timed_out and not is_ticket and not mentions_user(response, user_name) and "<#" not in response:
+                # Misma clave que en la búsqueda: con ruta clara, los temas del router (aunque luego se usara
+                # alguno más); sin ella, los usados, que get() recupera por la pregunta
+                self.answer_cache.put(query, routed_topics or sorted(set(used_topics)), response)
+            QUERIES.inc(1, "llm")
             return response
             
         except Exception as e:
+            if LOCAL_ANSWERS and isinstance(e, ModelsExhaustedError):
+                logger.warning(f"Fallback chain exhausted, answering locally: {e}")
+                return self._local_answer(query, user_name, route)
             logger.error(f"Error in process_query: {e}")
+            QUERIES.inc(1, "error")
             return f"Lo siento, tuve un problema procesando tu consulta. Por favor, intenta de nuevo."
@@ -0,0 +1,117 @@
+# agent_tools.py
+"""
+Protocolo de herramientas de MAI (CONTEXT / SEARCH).
+Extrae todas las directivas de una respuesta del modelo y las ejecuta en paralelo.
+"""
+import re
+import asyncio
+import logging
+
+from knowledge_base import get_context, resolve_context_name
+
+logger = logging.getLogger('MAI_Tools')
+
+# Una directiva termina en el salto de línea o donde empieza la siguiente. Tras los dos puntos solo
+# espacios/tabuladores: con "CONTEXT:" al final de una línea, la siguiente no es su argumento
+_DIRECTIVE_RE = re.compile(r"\b(CONTEXT|SEARCH):[ \t]*(.*?)[ \t]*(?=\b(?:CONTEXT|SEARCH|REACT):|\n|$)")
+
+
+class ToolCall:
+    __slots__ = ("kind", "argument", "query", "channel")
+
+    def __init__(self, kind, argument, query=None, channel=None):
+        self.kind = kind
+        self.argument = argument
+        self.query = query
+        self.channel = channel
+
+    @property
+    def key(self):
+        return (self.kind, self.argument.lower())
+
+    def __repr__(self):
+        return f"{self.kind}: {self.argument}"
+
+
+def parse_tool_calls(text, allow_search=True):
+    """Todas las directivas del texto, sin duplicados. `CONTEXT: ios, android` cuenta como dos."""
+    calls = {}
+    for kind, argument in _DIRECTIVE_RE.findall(text):
+        if not argument:
+            continue
+        if kind == "CONTEXT":
+            for topic in argument.split(","):
+                topic = topic.strip().lower()
+                if topic:
+                    call = ToolCall("CONTEXT", topic)
+                    calls.setdefault(call.key, call)
+        elif allow_search:
+            if "@" in argument:
+                search_query, target_channel = argument.rsplit("@", 1)
+                search_query, target_channel = search_query.strip(), target_channel.strip()
+            else:
+                search_query, target_channel = argument, "ALL"
+            call = ToolCall("SEARCH", argument, search_query, target_channel.lstrip("#") or "ALL")
+            calls.setdefault(call.key, call)
+    return list(calls.values())
+
+
+def strip_tool_calls(text):
+    """Quita las directivas de herramientas de un texto que se va a mostrar al usuario."""
+    return _DIRECTIVE_RE.sub("", text).strip()
+
+
+async def _run_one(call, search_tool):
+    if call.kind == "CONTEXT":
+        logger.info(f"Agent requested context: '{call.argument}'")
+        return f"═══ CONTEXTO SOLICITADO: {call.argument.upper()} ═══", get_context(call.argument)
+    logger.info(f"Agent requested search: '{call.query}' in '{call.channel}'")
+    search_results = await search_tool(call.query, call.channel)
+    header = f"""═══ RESULTADOS DE BÚSQUEDA ═══
+Canal buscado: {call.channel}
+Consulta: "{call.query}"
+"""
+    return header, search_results
+
+
+async def run_tool_calls(calls, search_tool, timeout):
+    """
+    Ejecuta todas las herramientas a la vez y devuelve un (cabecera, contenido) por llamada.
+    Las que fallan o no acaban a tiempo devuelven un aviso como contenido.
+    """
+    async def guarded(call):
+        try:
+            return await asyncio.wait_for(_run_one(call, search_tool), timeout=max(1.0, timeout))
+        except asyncio.TimeoutError:
+            logger.warning(f"Tool timed out: {call}")
+            return f"═══ {call.kind}: {call.argument} ═══", "AVISO: la herramienta no respondió a tiempo."
+        except Exception as e:
+            logger.error(f"Tool error ({call}): {e}")
+            return f"═══ {call.kind}: {call.argument} ═══", "AVISO: error al ejecutar la herramienta."
+
+    return await asyncio.gather(*(guarded(c) for c in calls))
+
+
+def context_topics(calls):
+    """Nombres canónicos de los temas de conocimiento pedidos."""
+    return [resolve_context_name(c.argument) for c in calls if c.kind == "CONTEXT"]
+
+
+_DIRECTIVE_PREFIXES = ("CONTEXT:", "SEARCH:", "REACT:")
+
+
+def visible_text(text):
+    """
+    Parte de una respuesta en curso que se puede enseñar ya al usuario.
+    None si el modelo está pidiendo herramientas; se corta en REACT: y se
+    retiene el final si podría ser el comienzo de una directiva.
+    """
+    if "CONTEXT:" in text or "SEARCH:" in text:
+        return None
+    text = text.split("REACT:", 1)[0]
+    for prefix in _DIRECTIVE_PREFIXES:
+        for size in range(len(prefix) - 1, 0, -1):
+            if text.endswith(prefix[:size]):
+                text = text[:-size]
+                break
+    return text.replace("meulify.com", "meulify.top").rstrip()
@@ -0,0 +1,99 @@
+# answer_cache.py
+"""
+Caché de respuestas para las preguntas frecuentes.
+La clave es la pregunta normalizada más los temas de conocimiento usados;
+se invalida entera cuando cambia la versión de la base de conocimiento.
+Se guardan plantillas con el marcador del usuario (text_utils.USER_PLACEHOLDER),
+nunca el nombre de quien preguntó: el nombre se pone al servir la respuesta.
+"""
+import os
+import time
+import logging
+from collections import OrderedDict
+
+from knowledge_base import knowledge_version
+from text_utils import normalize_query
+
+logger = logging.getLogger('AnswerCache')
+
+CACHE_SIZE = int(os.getenv('MAI_CACHE_SIZE', 256))
+CACHE_TTL = float(os.getenv('MAI_CACHE_TTL', 6 * 3600))
+# Preguntas con menos palabras útiles ("y en android?") dependen demasiado de la conversación
+CACHE_MIN_TOKENS = int(os.getenv('MAI_CACHE_MIN_TOKENS', 2))
+
+
+class AnswerCache:
+    """LRU con TTL. `get` puede acertar sin saber aún los temas: recuerda qué temas usó cada pregunta."""
+
+    def __init__(self, maxsize=CACHE_SIZE, ttl=CACHE_TTL, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()  # (pregunta, temas) -> (respuesta, guardada_en)
+        self._topics = {}              # pregunta -> temas usados la última vez
+        self._version = knowledge_version()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key_for(query):
+        """Pregunta normalizada, o None si es demasiado corta para cachearla."""
+        normalized = normalize_query(query)
+        return normalized if len(normalized) >= CACHE_MIN_TOKENS else None
+
+    def _check_version(self):
+        version = knowledge_version()
+        if version != self._version:
+            if self._entries:
+                logger.info(f"Knowledge changed, dropping {len(self._entries)} cached answers")
+            self.clear()
+            self._version = version
+
+    def clear(self):
+        self._entries.clear()
+        self._topics.clear()
+
+    def get(self, query, topics=None):
+        """Respuesta cacheada o None. Sin `topics` se usan los de la última vez que se respondió."""
+        normalized = self.key_for(query)
+        if normalized is None:
+            return None
+        self._check_version()
+        if topics is None:
+            topics = self._topics.get(normalized)
+        key = (normalized, tuple(sorted(topics))) if topics is not None else None
+        entry = self._entries.get(key) if key else None
+        if entry is None or self._clock() - entry[1] > self.ttl:
+            if entry is not None:
+                self._evict(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, query, topics, answer):
+        normalized = self.key_for(query)
+        if normalized is None or not answer:
+            return
+        self._check_version()
+        key = (normalized, tuple(sorted(topics)))
+        self._entries[key] = (answer, self._clock())
+        self._entries.move_to_end(key)
+        self._topics[normalized] = key[1]
+        while len(self._entries) > self.maxsize:
+            self._evict(next(iter(self._entries)))
+
+    def _evict(self, key):
+        self._entries.pop(key, None)
+        if self._topics.get(key[0]) == key[1]:
+            del self._topics[key[0]]
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._entries),
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
@@ -0,0 +1,225 @@
+# benchmarks/fake_discord.py
+"""
+Servidor de Discord sintético para los benchmarks: un guild con N canales y
+M mensajes por canal, con la latencia REST que se quiera en channel.history.
+Implementa solo lo que usan los handlers de main.py, pero lo usa de verdad:
+los eventos se registran con @bot.event / @bot.command() igual que con discord.py.
+"""
+import io
+import random
+import asyncio
+import datetime
+import itertools
+from contextlib import asynccontextmanager
+
+from discord.utils import time_snowflake
+
+HISTORY_PAGE = 100
+
+WORDS = (
+    "meulify app playlist cancion spotify importar goats anuncio android ios apk testflight error "
+    "sincronizacion portada album evento concurso musica descarga offline cuenta ajustes bug "
+    "actualizacion beta servidor tutorial letra radio cola aleatorio volumen widget"
+).split()
+
+
+def _to_snowflake(value):
+    if value is None:
+        return None
+    if isinstance(value, datetime.datetime):
+        return time_snowflake(value)
+    return value.id
+
+
+class FakePermissions:
+    def __init__(self, readable=True):
+        self.read_messages = readable
+        self.read_message_history = readable
+
+
+class FakeUser:
+    def __init__(self, id, name, bot=False):
+        self.id = id
+        self.name = name
+        self.bot = bot
+        self.display_name = name
+        self.mention = f"<@{id}>"
+        self.dms = []
+
+    def mentioned_in(self, message):
+        return self.mention in message.content
+
+    async def send(self, content=None, file=None):
+        size = 0
+        if file is not None:
+            file.fp.seek(0, io.SEEK_END)
+            size = file.fp.tell()
+        self.dms.append((content, size))
+
+    def __str__(self):
+        return self.name
+
+
+class FakeMessage:
+    def __init__(self, id, channel, author, content, created_at):
+        self.id = id
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content
+        self.created_at = created_at
+        self.mention_everyone = False
+        self.edits = 0
+        self.reactions = []
+
+    async def reply(self, content):
+        return await self.channel.send(content)
+
+    async def edit(self, content=None):
+        await self.channel.guild.rest_delay()
+        self.content = content
+        self.edits += 1
+        return self
+
+    async def delete(self):
+        await self.channel.guild.rest_delay()
+
+    async def add_reaction(self, emoji):
+        self.reactions.append(emoji)
+
+
+class FakeChannel:
+    def __init__(self, guild, id, name, readable=True):
+        self.guild = guild
+        self.id = id
+        self.name = name
+        self.messages = []  # ordenados por id
+        self._permissions = FakePermissions(readable)
+        self.sent = []
+        self.history_requests = 0
+
+    def permissions_for(self, member):
+        return self._permissions
+
+    @asynccontextmanager
+    async def typing(self):
+        yield
+
+    async def send(self, content):
+        await self.guild.rest_delay()
+        message = self.guild.new_message(self, self.guild.me, content)
+        self.sent.append(message)
+        return message
+
+    def history(self, limit=100, before=None, after=None, oldest_first=None):
+        before_id = _to_snowflake(before)
+        after_id = _to_snowflake(after)
+        if oldest_first is None:
+            oldest_first = after_id is not None
+        guild = self.guild
+
+        async def pages():
+            selected = [m for m in self.messages
+                        if (before_id is None or m.id < before_id) and (after_id is None or m.id > after_id)]
+            if not oldest_first:
+                selected.reverse()
+            if limit is not None:
+                selected = selected[:limit]
+            for i, message in enumerate(selected):
+                if i % HISTORY_PAGE == 0:
+                    # Cada página de 100 mensajes es una petición REST
+                    self.history_requests += 1
+                    await guild.rest_delay()
+                yield message
+        return pages()
+
+
+class FakeGuild:
+    def __init__(self, channels=10, messages=500, days=60, users=50, rest_latency=0.05, seed=1):
+        self.id = 1000
+        self.name = "Meulify Bench"
+        self.rest_latency = rest_latency
+        self.rest_calls = 0
+        self._random = random.Random(seed)
+        self._sequence = itertools.count()
+        self.me = FakeUser(1, "MAI", bot=True)
+        self.users = [FakeUser(100 + i, f"user{i}") for i in range(users)]
+        self.admin = FakeUser(99, "technologiescv")
+        self.text_channels = [FakeChannel(self, 2000 + i, f"canal-{i}") for i in range(channels)]
+        self._populate(messages, days)
+
+    async def rest_delay(self):
+        self.rest_calls += 1
+        if self.rest_latency:
+            await asyncio.sleep(self.rest_latency)
+
+    def new_message(self, channel, author, content, created_at=None):
+        created_at = created_at or datetime.datetime.now(datetime.timezone.utc)
+        # Snowflake creciente y único aunque dos mensajes caigan en el mismo milisegundo
+        message_id = time_snowflake(created_at) + next(self._sequence) % 4096
+        message = FakeMessage(message_id, channel, author, content, created_at)
+        channel.messages.append(message)
+        return message
+
+    def _populate(self, messages, days):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        span = datetime.timedelta(days=days).total_seconds()
+        for channel in self.text_channels:
+            times = sorted(now - datetime.timedelta(seconds=self._random.random() * span) for _ in range(messages))
+            for created_at in times:
+                author = self._random.choice(self.users)
+                text = " ".join(self._random.choice(WORDS) for _ in range(self._random.randint(4, 25)))
+                self.new_message(channel, author, text, created_at)
+            channel.messages.sort(key=lambda m: m.id)
+
+    @property
+    def total_messages(self):
+        return sum(len(c.messages) for c in self.text_channels)
+
+
+class FakeContext:
+    def __init__(self, channel):
+        self.channel = channel
+
+    async def send(self, content):
+        return await self.channel.send(content)
+
+
+class FakeBot:
+    """Lo justo de commands.Bot para registrar y disparar los handlers reales."""
+
+    def __init__(self, guild):
+        self.guild = guild
+        self.guilds = [guild]
+        self.user = guild.me
+        self.latency = 0.05
+        self.events = {}
+        self.commands = {}
+
+    def event(self, coro):
+        self.events[coro.__name__] = coro
+        return coro
+
+    def command(self, *args, **kwargs):
+        def decorator(coro):
+            self.commands[kwargs.get("name", coro.__name__)] = coro
+            return coro
+        return decorator
+
+    async def process_commands(self, message):
+        pass
+
+    def get_channel(self, channel_id):
+        return next((c for c in self.guild.text_channels if c.id == channel_id), None)
+
+    def is_ready(self):
+        return True
+
+    def is_closed(self):
+        return False
+
+    async def dispatch(self, event, *args):
+        handler = self.events.get(event)
+        if handler is not None:
+            await handler(*args)
+
@@ -0,0 +1,118 @@
+# benchmarks/llm_backend_footprint.py
+"""
+Compara los dos clientes LLM (MAI_LLM_BACKEND=langchain / native): tiempo de
+importar agent_logic, RSS tras importar y tras N llamadas, y latencia por
+llamada (normal y en streaming) contra el stub local de benchmarks/llm_stub.py.
+Cada backend se mide en un proceso nuevo para que el arranque sea en frío.
+
+Uso (desde la raíz del repo):
+    python -m benchmarks.llm_backend_footprint --calls 200 --output footprint.json
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import resource
+import statistics
+import subprocess
+
+BACKENDS = ("langchain", "native")
+
+
+def _rss_mb():
+    with open("/proc/self/statm") as f:
+        pages = int(f.read().split()[1])
+    return round(pages * resource.getpagesize() / 2**20, 1)
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def _calls(agent, calls, stream):
+    from llm_backend import HumanMessage
+    llm = agent._get_llm("llama-3.1-8b-instant")
+    messages = [HumanMessage(content="hola")]
+    timings = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        if stream:
+            full = None
+            async for chunk in llm.astream(messages):
+                full = chunk if full is None else full + chunk
+        else:
+            await llm.ainvoke(messages)
+        timings.append((time.perf_counter() - start) * 1000)
+    return {"mean_ms": round(statistics.mean(timings), 2), "p50_ms": round(_percentile(timings, 0.5), 2),
+            "p95_ms": round(_percentile(timings, 0.95), 2)}
+
+
+async def measure(backend, calls):
+    # El stub (y con él aiohttp, que el bot importa de todos modos) va antes de medir
+    from benchmarks.llm_stub import LLMStub
+    stub = await LLMStub(latency=0, jitter=0, token_latency=0).start()
+    os.environ["MAI_LLM_BACKEND"] = backend
+    os.environ["GROQ_API_BASE"] = stub.base_url
+    os.environ.setdefault("GROQ_API_KEY", "bench")
+    rss_start = _rss_mb()
+    modules_start = len(sys.modules)
+
+    start = time.perf_counter()
+    import agent_logic
+    import_seconds = time.perf_counter() - start
+    rss_import = _rss_mb()
+
+    agent = agent_logic.AgentLogic()
+    result = {
+        "backend": backend,
+        "import_seconds": round(import_seconds, 3),
+        "modules_loaded": len(sys.modules) - modules_start,
+        "rss_start_mb": rss_start,
+        "rss_after_import_mb": rss_import,
+        "invoke": await _calls(agent, calls, stream=False),
+        "stream": await _calls(agent, calls, stream=True),
+        "rss_after_calls_mb": _rss_mb(),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "tcp_connections": len(stub.connections),
+    }
+    await agent.aclose()
+    await stub.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=100)
+    parser.add_argument("--output", help="fichero JSON con los resultados")
+    parser.add_argument("--child", choices=BACKENDS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(asyncio.run(measure(args.child, args.calls))))
+        return
+
+    results = {}
+    for backend in BACKENDS:
+        proc = subprocess.run([sys.executable, "-m", "benchmarks.llm_backend_footprint", "--calls", str(args.calls),
+                               "--child", backend], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        if proc.returncode != 0:
+            print(f"{backend}: failed (exit {proc.returncode})", file=sys.stderr)
+            continue
+        r = results[backend] = json.loads(proc.stdout.strip().splitlines()[-1])
+        print(f"{backend:<10} import={r['import_seconds'] * 1000:7.1f}ms  modules={r['modules_loaded']:<5} "
+              f"rss_import={r['rss_after_import_mb']:6.1f}MB  rss_calls={r['rss_after_calls_mb']:6.1f}MB  "
+              f"invoke_p50={r['invoke']['p50_ms']:6.2f}ms  stream_p50={r['stream']['p50_ms']:6.2f}ms", file=sys.stderr)
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# benchmarks/llm_client_overhead.py
+"""
+Mide el coste por llamada de construir un ChatGroq nuevo en cada intento
+frente a reutilizar los clientes cacheados de AgentLogic (pool keep-alive).
+
+Uso (desde la raíz del repo):
+    python -m benchmarks.llm_client_overhead --calls 200
+
+Usa un servidor local compatible con la API de Groq, así que no mide el
+handshake TLS real: en producción la diferencia es todavía mayor.
+"""
+import os
+import time
+import asyncio
+import argparse
+import statistics
+
+from benchmarks.llm_stub import LLMStub
+
+
+async def measure(label, get_llm, messages, calls, connections):
+    connections.clear()
+    timings = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        await get_llm("llama-3.1-8b-instant").ainvoke(messages)
+        timings.append((time.perf_counter() - start) * 1000)
+    print(f"{label:<22} mean={statistics.mean(timings):7.2f}ms  p50={statistics.median(timings):7.2f}ms  "
+          f"p95={sorted(timings)[min(len(timings) - 1, int(len(timings) * 0.95))]:7.2f}ms  tcp_connections={len(connections)}")
+
+
+async def main(calls):
+    stub = await LLMStub(latency=0, jitter=0, token_latency=0).start()
+    connections = stub.connections
+    os.environ["GROQ_API_BASE"] = stub.base_url
+    os.environ.setdefault("GROQ_API_KEY", "bench")
+
+    from langchain_groq import ChatGroq
+    from langchain_core.messages import HumanMessage
+    from agent_logic import AgentLogic
+
+    agent = AgentLogic()
+    messages = [HumanMessage(content="hola")]
+
+    created = []
+
+    def fresh_llm(model):
+        # Comportamiento anterior: un ChatGroq (y un cliente HTTP) nuevo por intento.
+        # Se guardan las referencias para que el GC no cierre clientes a mitad de la medida.
+        llm = ChatGroq(temperature=0.7, model_name=model, groq_api_key=agent.groq_api_key)
+        created.append(llm)
+        return llm
+
+    await measure("new client per call", fresh_llm, messages, calls, connections)
+    await measure("pooled cached client", agent._get_llm, messages, calls, connections)
+
+    await agent.aclose()
+    await stub.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(main(args.calls))
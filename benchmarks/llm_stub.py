@@ -0,0 +1,162 @@
+# benchmarks/llm_stub.py
+"""
+Servidor local compatible con la API de chat de Groq/OpenAI para los benchmarks.
+Inyecta latencia (tiempo hasta el primer token + tiempo por token), 429 con
+las cabeceras de rate limit de Groq y respuestas en streaming (SSE).
+
+Las respuestas imitan el protocolo de MAI: si la pregunta pide buscar
+mensajes y aún no hay resultados, responde con una directiva SEARCH; si no
+hay contexto de conocimiento, pide CONTEXT; en otro caso contesta.
+"""
+import json
+import time
+import random
+import asyncio
+from collections import defaultdict, deque
+
+from aiohttp import web
+
+ANSWER = (
+    "¡Buenas, crack! 🔥 Te cuento: en Meulify puedes hacer eso desde los ajustes de la app, "
+    "y si no te aparece, actualiza a la última beta desde **meulify.top**. Si sigue sin ir, "
+    "abre un ticket y lo miramos con calma. ¡Cualquier cosa me dices! 🐐"
+)
+SEARCH_HINTS = ("busca", "dijo", "dijeron", "mensajes", "hablaron")
+
+
+def _estimate_tokens(text):
+    return max(1, len(text) // 4)
+
+
+class LLMStub:
+    def __init__(self, latency=0.4, jitter=0.2, token_latency=0.005, rate_limit=0.0, rpm=0, seed=1):
+        self.latency = latency            # segundos hasta el primer token
+        self.jitter = jitter              # +- aleatorio sobre la latencia
+        self.token_latency = token_latency
+        self.rate_limit = rate_limit      # probabilidad de responder 429
+        self.rpm = rpm                    # peticiones por minuto y modelo (0 = sin límite)
+        self._random = random.Random(seed)
+        self._windows = defaultdict(deque)
+        self.requests = 0
+        self.rate_limited = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.connections = set()
+        self.port = None
+        self._runner = None
+
+    # --- Comportamiento ---
+
+    def _reply_for(self, messages):
+        text = "\n".join(str(m.get("content", "")) for m in messages)
+        query = next((str(m.get("content", "")) for m in messages if m.get("role") == "user"), "").lower()
+        if "═══ INSTRUCCIONES ═══" in text:
+            return ANSWER
+        if any(hint in query for hint in SEARCH_HINTS):
+            word = next((w for w in query.split() if len(w) > 5 and w not in SEARCH_HINTS), "meulify")
+            return f"SEARCH: {word.strip('?¿.,!')} @ ALL"
+        if "YA CARGADA" not in text and "PASAJES RECUPERADOS" not in text:
+            return "CONTEXT: faq_general"
+        return ANSWER + (" REACT: 🔥" if self._random.random() < 0.3 else "")
+
+    def _limited(self, model):
+        if self.rate_limit and self._random.random() < self.rate_limit:
+            return True
+        if not self.rpm:
+            return False
+        window = self._windows[model]
+        now = time.monotonic()
+        while window and now - window[0] > 60:
+            window.popleft()
+        if len(window) >= self.rpm:
+            return True
+        window.append(now)
+        return False
+
+    def _rate_limit_response(self, model):
+        self.rate_limited += 1
+        retry = round(self._random.uniform(1, 5), 2)
+        body = {"error": {
+            "message": f"Rate limit reached for model `{model}`. Please try again in {retry}s.",
+            "type": "requests", "code": "rate_limit_exceeded",
+        }}
+        headers = {
+            "retry-after": str(int(retry) + 1),
+            "x-ratelimit-remaining-requests": "0",
+            "x-ratelimit-reset-requests": f"{retry}s",
+        }
+        return web.json_response(body, status=429, headers=headers)
+
+    # --- Endpoint ---
+
+    async def _completions(self, request):
+        self.connections.add(id(request.transport))
+        payload = await request.json()
+        model = payload.get("model", "stub")
+        self.requests += 1
+        if self._limited(model):
+            return self._rate_limit_response(model)
+
+        messages = payload.get("messages", [])
+        reply = self._reply_for(messages)
+        prompt_tokens = sum(_estimate_tokens(str(m.get("content", ""))) for m in messages)
+        completion_tokens = _estimate_tokens(reply)
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+
+        await asyncio.sleep(max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter)))
+        if not payload.get("stream"):
+            await asyncio.sleep(self.token_latency * completion_tokens)
+            return web.json_response({
+                "id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+
+        async def send(delta, finish_reason=None, extra=None):
+            chunk = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+            if extra:
+                chunk.update(extra)
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+
+        await send({"role": "assistant", "content": ""})
+        words = reply.split(" ")
+        for i, word in enumerate(words):
+            await asyncio.sleep(self.token_latency)
+            await send({"content": word if i == 0 else " " + word})
+        await send({}, "stop", {"x_groq": {"usage": usage}})
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/openai/v1/chat/completions", self._completions)
+        self._runner = web.AppRunner(app, shutdown_timeout=1.0)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "rate_limited": self.rate_limited,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+        }
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
@@ -0,0 +1,105 @@
+# benchmarks/proxy_stub.py
+"""
+Servidor local que sustituye a Webshare y a los proxies en pruebas de ProxyPool.
+Sirve la lista de proxies (mismo JSON que la API de Webshare) y hace a la vez
+de todos esos proxies: cada uno es un usuario distinto del mismo servidor, con
+su latencia y el estado HTTP que "devolvería Discord" a través de él
+(429/403 de Cloudflare, 502 del proxy...).
+
+Uso (desde la raíz del repo), comprueba qué proxy elige ProxyPool:
+    python -m benchmarks.proxy_stub
+"""
+import sys
+import base64
+import asyncio
+import logging
+
+from aiohttp import web
+
+# nombre -> (latencia en segundos, estado que devuelve el "Discord" de detrás)
+DEFAULT_PROXIES = {
+    "fast": (0.01, 200),
+    "slow": (0.3, 200),
+    "cloudflare_429": (0.0, 429),
+    "banned_403": (0.0, 403),
+    "broken_502": (0.0, 502),
+}
+PROBE_URL = "http://discord.test/api/v10/gateway"
+
+
+class ProxyStub:
+    def __init__(self, proxies=None, token="stub"):
+        self.proxies = dict(DEFAULT_PROXIES if proxies is None else proxies)
+        self.token = token
+        self.list_requests = 0
+        self.probes = {}  # nombre -> peticiones recibidas a través de ese proxy
+        self.port = None
+        self._runner = None
+
+    async def _list(self, request):
+        self.list_requests += 1
+        if request.headers.get("Authorization") != f"Token {self.token}":
+            return web.json_response({"detail": "Invalid token."}, status=401)
+        results = [
+            {"username": name, "password": "pw", "proxy_address": "127.0.0.1", "port": self.port, "valid": True}
+            for name in self.proxies
+        ]
+        return web.json_response({"count": len(results), "results": results})
+
+    async def _proxy(self, request):
+        auth = request.headers.get("Proxy-Authorization", "")
+        try:
+            name = base64.b64decode(auth.split(" ", 1)[1]).decode().split(":", 1)[0]
+        except (IndexError, ValueError):
+            name = None
+        if name not in self.proxies:
+            return web.Response(status=407, text="Proxy Authentication Required")
+        self.probes[name] = self.probes.get(name, 0) + 1
+        latency, status = self.proxies[name]
+        await asyncio.sleep(latency)
+        return web.json_response({"url": "wss://gateway.discord.gg"} if status == 200 else {"message": "blocked"},
+                                 status=status)
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/api/v2/proxy/list/", self._list)
+        app.router.add_route("*", "/{tail:.*}", self._proxy)
+        self._runner = web.AppRunner(app, shutdown_timeout=1.0)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    @property
+    def api_url(self):
+        return f"http://127.0.0.1:{self.port}/api/v2/proxy/list/?mode=direct"
+
+    def pool(self, **kwargs):
+        """ProxyPool apuntando a este stub (lista y sondeo)."""
+        from proxy_manager import ProxyPool
+        return ProxyPool(token=self.token, api_url=self.api_url, probe_url=PROBE_URL,
+                         probe_count=len(self.proxies), **kwargs)
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+async def _check():
+    stub = await ProxyStub().start()
+    pool = stub.pool()
+    try:
+        selected = await pool.best()
+        name = selected.split("//", 1)[1].split(":", 1)[0] if selected else None
+        quarantined = sorted(n for n in stub.proxies if pool.is_quarantined(f"http://{n}:pw@127.0.0.1:{stub.port}"))
+        print(f"selected={name} quarantined={quarantined} probes={stub.probes}")
+        return name == "fast" and quarantined == ["banned_403", "broken_502", "cloudflare_429"]
+    finally:
+        await pool.close()
+        await stub.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(0 if asyncio.run(_check()) else 1)
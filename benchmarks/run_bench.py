@@ -0,0 +1,253 @@
+# benchmarks/run_bench.py
+"""
+Benchmark offline de MAI: un guild sintético (benchmarks/fake_discord.py) y un
+servidor local compatible con Groq (benchmarks/llm_stub.py) conducen el código
+real de main.py (on_message, la cola de menciones, !export e index_channel).
+
+Escenarios:
+  mentions  menciones concurrentes (FAQ, búsquedas en el historial, charla)
+  export    !export days:N del administrador
+  index     index_channel sobre varios canales
+
+Cada escenario corre en su propio proceso para que el pico de RSS sea suyo.
+Uso (desde la raíz del repo):
+    python -m benchmarks.run_bench --channels 20 --messages 1000 --mentions 100 --output bench.json
+    python -m benchmarks.run_bench --scenarios mentions --llm-latency 0.8 --rate-limit 0.1
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import resource
+import tempfile
+import subprocess
+
+SCENARIOS = ("mentions", "export", "index")
+
+QUERIES = (
+    "como importo mis playlists de {topic}",
+    "busca lo que dijeron de {topic}",
+    "no me funciona {topic} en android, que hago",
+    "cuando sale la nueva beta con {topic}",
+    "quien hablo de {topic} la semana pasada, busca mensajes",
+    "que es meulify goats y como entro con {topic}",
+    "hola mai, que tal? {topic}",
+)
+TOPICS = ("spotify", "testflight", "sincronizacion", "widget", "portada", "descarga", "actualizacion", "concurso")
+
+
+def _peak_rss_mb():
+    # En Linux ru_maxrss va en KiB
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _configure_env(args, workdir):
+    """Variables que tiene que ver main.py antes de importarse."""
+    os.environ["GROQ_API_KEY"] = "bench"
+    os.environ["MAI_ARCHIVE_PATH"] = os.path.join(workdir, "archive.db")
+    os.environ["MAI_RETRIEVAL_PATH"] = os.path.join(workdir, "retrieval.idx")
+    os.environ["MAI_INDEX_CHECKPOINTS"] = os.path.join(workdir, "index_jobs.json")
+    os.environ["MAI_STREAM_REPLIES"] = "1" if args.stream else "0"
+    os.environ["MAI_WORKERS"] = str(args.workers)
+    os.environ["MAI_QUEUE_SIZE"] = str(max(args.mentions, 1))
+
+
+async def _wait_tasks(*names):
+    """Espera a las tareas de fondo cuyo coroutine se llama como alguno de `names` (p. ej. los backfills)."""
+    tasks = [t for t in asyncio.all_tasks() if t.get_coro().__name__ in names]
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# --- Escenarios (proceso hijo) ---
+
+async def _mentions(args, main, bot, guild):
+    rng = random.Random(args.seed)
+    channels = guild.text_channels
+    start = time.perf_counter()
+    for i in range(args.mentions):
+        user = guild.users[i % len(guild.users)]
+        query = rng.choice(QUERIES).format(topic=rng.choice(TOPICS))
+        message = guild.new_message(rng.choice(channels), user, f"{guild.me.mention} {query}")
+        await bot.dispatch("on_message", message)
+        if args.arrival_rate:
+            await asyncio.sleep(rng.expovariate(args.arrival_rate))
+    await bot.mention_scheduler._queue.join()
+    elapsed = time.perf_counter() - start
+    scheduler = bot.mention_scheduler.stats()
+    return {"elapsed": elapsed, "processed": scheduler["processed"], "scheduler": scheduler}
+
+
+async def _export(args, main, bot, guild):
+    channel = guild.text_channels[0]
+    message = guild.new_message(channel, guild.admin, f"{guild.me.mention} !export days:{args.export_days}")
+    rest_before = guild.rest_calls
+    start = time.perf_counter()
+    await bot.dispatch("on_message", message)
+    elapsed = time.perf_counter() - start
+    return {
+        "elapsed": elapsed,
+        "processed": 1,
+        "rest_calls": guild.rest_calls - rest_before,
+        "files": len([d for d in guild.admin.dms if d[1]]),
+        "bytes": sum(size for _, size in guild.admin.dms),
+        "status": channel.sent[-1].content if channel.sent else None,
+    }
+
+
+async def _index(args, main, bot, guild):
+    from benchmarks.fake_discord import FakeContext
+    channels = guild.text_channels[:args.index_channels]
+    ctx = FakeContext(guild.text_channels[0])
+    start = time.perf_counter()
+    for channel in channels:
+        await bot.commands["index_channel"](ctx, channel.id)
+    await asyncio.gather(*main.index_jobs._tasks.values(), return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    jobs = [main.index_jobs._jobs[c.id] for c in channels]
+    read = sum(j.read for j in jobs)
+    return {
+        "elapsed": elapsed,
+        "processed": len(jobs),
+        "messages_read": read,
+        "passages_indexed": sum(j.indexed for j in jobs),
+        "messages_per_second": round(read / elapsed, 1) if elapsed else None,
+        "states": sorted({j.state for j in jobs}),
+    }
+
+
+async def run_scenario(name, args):
+    workdir = tempfile.mkdtemp(prefix="mai-bench-")
+    _configure_env(args, workdir)
+
+    from benchmarks.llm_stub import LLMStub
+    from benchmarks.fake_discord import FakeGuild, FakeBot
+
+    stub = await LLMStub(latency=args.llm_latency, jitter=args.llm_jitter, token_latency=args.token_latency,
+                         rate_limit=args.rate_limit, rpm=args.rpm, seed=args.seed).start()
+    os.environ["GROQ_API_BASE"] = stub.base_url
+
+    import main
+    from metrics import STAGE_LATENCY, LLM_ATTEMPT_LATENCY, QUERIES as QUERY_COUNTER
+    logging.getLogger().setLevel(args.log_level)
+
+    guild = FakeGuild(channels=args.channels, messages=args.messages, days=args.days,
+                      users=args.users, rest_latency=args.rest_latency, seed=args.seed)
+    bot = FakeBot(guild)
+    main.setup_bot_events(bot)
+
+    setup_start = time.perf_counter()
+    await bot.dispatch("on_ready")
+    await _wait_tasks("backfill", "sync_guild")
+    setup = time.perf_counter() - setup_start
+    rss_before = _peak_rss_mb()
+    stub_before = stub.stats()
+
+    result = await {"mentions": _mentions, "export": _export, "index": _index}[name](args, main, bot, guild)
+
+    stub_after = stub.stats()
+    llm = {k: stub_after[k] - stub_before[k] for k in stub_after}
+    processed = max(result["processed"], 1)
+    report = {
+        "scenario": name,
+        "guild": {"channels": args.channels, "messages": guild.total_messages, "rest_latency": args.rest_latency},
+        "setup_seconds": round(setup, 3),
+        "elapsed_seconds": round(result.pop("elapsed"), 3),
+        "throughput_per_second": None,
+        "stages": STAGE_LATENCY.summary(),
+        "llm_attempts": LLM_ATTEMPT_LATENCY.summary(),
+        "llm": dict(llm,
+                    calls_per_query=round(llm["requests"] / processed, 2),
+                    tokens_per_query=round((llm["prompt_tokens"] + llm["completion_tokens"]) / processed, 1)),
+        "queries": {source: QUERY_COUNTER.value(source) for source in ("cache", "shared", "llm", "local", "error")},
+        "peak_rss_mb": _peak_rss_mb(),
+        "rss_before_scenario_mb": rss_before,
+    }
+    if report["elapsed_seconds"]:
+        report["throughput_per_second"] = round(result["processed"] / report["elapsed_seconds"], 2)
+    report.update(result)
+
+    await bot.mention_scheduler.close()
+    await main.index_jobs.close()
+    await main.agent.aclose()
+    if main.archive:
+        await main.archive.close()
+    await stub.close()
+    return report
+
+
+# --- Proceso padre ---
+
+def _print_summary(report):
+    print(f"\n== {report['scenario']} ==  {report['elapsed_seconds']}s  "
+          f"throughput={report['throughput_per_second']}/s  peak_rss={report['peak_rss_mb']}MB", file=sys.stderr)
+    llm = report["llm"]
+    print(f"   llm: {llm['requests']} calls ({llm['calls_per_query']}/query, {llm['rate_limited']} x 429), "
+          f"{llm['tokens_per_query']} tokens/query", file=sys.stderr)
+    for stage, s in sorted(report["stages"].items()):
+        fmt = lambda v: f"{v * 1000:8.1f}ms" if v is not None else "       -"
+        print(f"   {stage:<14} n={s['count']:<5} p50={fmt(s['p50'])} p95={fmt(s['p95'])} p99={fmt(s['p99'])}",
+              file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="lista separada por comas")
+    parser.add_argument("--channels", type=int, default=10)
+    parser.add_argument("--messages", type=int, default=500, help="mensajes por canal")
+    parser.add_argument("--days", type=int, default=60, help="antigüedad máxima de los mensajes")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--rest-latency", type=float, default=0.05, help="segundos por petición REST a Discord")
+    parser.add_argument("--mentions", type=int, default=50)
+    parser.add_argument("--arrival-rate", type=float, default=0.0, help="menciones/s (0 = todas de golpe)")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--stream", action="store_true", help="respuestas progresivas (MAI_STREAM_REPLIES)")
+    parser.add_argument("--llm-latency", type=float, default=0.4, help="segundos hasta el primer token")
+    parser.add_argument("--llm-jitter", type=float, default=0.2)
+    parser.add_argument("--token-latency", type=float, default=0.005)
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="probabilidad de 429 por petición")
+    parser.add_argument("--rpm", type=int, default=0, help="límite de peticiones/minuto por modelo")
+    parser.add_argument("--export-days", type=int, default=30)
+    parser.add_argument("--index-channels", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--output", help="fichero JSON con los resultados")
+    parser.add_argument("--child", choices=SCENARIOS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(asyncio.run(run_scenario(args.child, args))))
+        return
+
+    child_args = [a for a in sys.argv[1:]]
+    if "--output" in child_args:
+        i = child_args.index("--output")
+        del child_args[i:i + 2]
+    results = {"started_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "args": vars(args), "scenarios": {}}
+    for name in [s.strip() for s in args.scenarios.split(",") if s.strip()]:
+        if name not in SCENARIOS:
+            parser.error(f"escenario desconocido: {name}")
+        proc = subprocess.run([sys.executable, "-m", "benchmarks.run_bench", *child_args, "--child", name],
+                              stdout=subprocess.PIPE, text=True)
+        if proc.returncode != 0:
+            print(f"Scenario {name} failed (exit {proc.returncode})", file=sys.stderr)
+            results["scenarios"][name] = {"error": proc.returncode}
+            continue
+        report = json.loads(proc.stdout.strip().splitlines()[-1])
+        results["scenarios"][name] = report
+        _print_summary(report)
+
+    text = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# channel_search.py
+"""
+Búsqueda concurrente en el historial REST de varios canales.
+Se usa como fallback de SEARCH para los canales que no están en el índice.
+"""
+import os
+import asyncio
+import logging
+
+from message_index import MessageRecord
+from text_utils import fold_accents, tokenize
+
+logger = logging.getLogger('ChannelSearch')
+
+# Discord agrupa GET /channels/{id}/messages por canal, así que varios canales
+# en paralelo no comparten bucket; el límite protege el rate limit global.
+SEARCH_CONCURRENCY = int(os.getenv('MAI_SEARCH_CONCURRENCY', 8))
+SEARCH_TIMEOUT = float(os.getenv('MAI_SEARCH_TIMEOUT', 4.0))
+
+
+def _match_quality(query, query_tokens, content):
+    """2 = todas las palabras completas, 1 = solo coincidencia parcial, 0 = nada."""
+    if query == "*" or not query.strip():
+        return 2
+    if fold_accents(query) not in fold_accents(content):
+        return 0
+    return 2 if set(query_tokens) <= set(tokenize(content)) else 1
+
+
+async def search_channels(channels, query, limit=25, history_limit=50, concurrency=None, timeout=None):
+    """
+    Lee el historial de los canales en paralelo (con límite de concurrencia).
+    Corta en cuanto hay `limit` coincidencias buenas o se agota el tiempo,
+    devolviendo lo encontrado hasta ese momento.
+    """
+    if not channels:
+        return []
+    concurrency = concurrency or SEARCH_CONCURRENCY
+    timeout = timeout or SEARCH_TIMEOUT
+    query_tokens = tokenize(query)
+    semaphore = asyncio.Semaphore(concurrency)
+    hits = []  # (calidad, MessageRecord)
+    enough = asyncio.Event()
+
+    async def scan(channel):
+        async with semaphore:
+            if enough.is_set():
+                return
+            async for msg in channel.history(limit=history_limit):
+                if msg.author.bot:
+                    continue
+                quality = _match_quality(query, query_tokens, msg.content)
+                if quality:
+                    hits.append((quality, MessageRecord.from_message(msg)))
+                    if sum(1 for q, _ in hits if q == 2) >= limit:
+                        enough.set()
+                        return
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    tasks = {asyncio.create_task(scan(c)) for c in channels}
+    enough_waiter = asyncio.create_task(enough.wait())
+    pending = set(tasks)
+    try:
+        while pending and not enough.is_set():
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                logger.info(f"Search deadline reached: {len(pending)}/{len(tasks)} channels unfinished")
+                break
+            done, pending = await asyncio.wait(pending | {enough_waiter}, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            pending.discard(enough_waiter)
+            for task in done:
+                if task is not enough_waiter and not task.cancelled() and task.exception():
+                    logger.debug(f"Channel scan failed: {task.exception()}")
+    finally:
+        enough_waiter.cancel()
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, enough_waiter, return_exceptions=True)
+
+    hits.sort(key=lambda h: (h[0], h[1].id), reverse=True)
+    return [record for _, record in hits[:limit]]
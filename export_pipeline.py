@@ -0,0 +1,236 @@
+# export_pipeline.py
+"""
+Exportación en streaming para !export.
+Cada canal se vuelca a un fichero temporal (spooled), la compresión ZIP se
+hace en un hilo aparte y el resultado se parte en trozos que caben en el
+límite de subida de Discord.
+"""
+import os
+import asyncio
+import concurrent.futures
+import logging
+import struct
+import tempfile
+import time
+import zipfile
+import zlib
+
+logger = logging.getLogger('Export')
+
+EXPORT_PART_BYTES = int(os.getenv('MAI_EXPORT_PART_BYTES', 8 * 1024 * 1024))
+EXPORT_CONCURRENCY = int(os.getenv('MAI_EXPORT_CONCURRENCY', 4))
+SPOOL_BYTES = 1024 * 1024
+PROGRESS_INTERVAL = 2.0
+
+# Registros del formato ZIP (cabecera local, entrada del directorio central y fin de directorio).
+# Sin ZIP64: cada parte cabe de sobra en 4 GiB y en 65535 entradas
+_LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+_CENTRAL_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+_END_RECORD = struct.Struct("<IHHHHIIH")
+_ZIP_VERSION = 20
+_MADE_BY = (3 << 8) | _ZIP_VERSION  # Unix, como zipfile
+_UTF8_NAMES = 0x800
+_FILE_ATTRS = 0o644 << 16
+_MAX_ENTRIES = 0xFFFF
+
+
+def _dos_datetime():
+    t = time.localtime()
+    return ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday, (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+
+
+class ZipPartWriter:
+    """
+    Escribe entradas en ZIPs independientes sin superar `part_bytes` cada uno. No es thread-safe.
+    Cada entrada se comprime una sola vez antes de elegir la parte: su tamaño final se conoce de
+    antemano y nunca hay que deshacer lo escrito, por eso el ZIP se escribe a mano y no con zipfile.
+    """
+
+    def __init__(self, part_bytes=EXPORT_PART_BYTES):
+        self.part_bytes = part_bytes
+        self.segment_bytes = min(4 * 1024 * 1024, int(part_bytes * 0.9))
+        self.parts = []
+        self._fp = None
+        self._entries = []  # entradas del directorio central de la parte abierta
+        self._central = 0   # bytes que ocupará el directorio central al cerrar la parte
+
+    def _open_part(self):
+        self._close_part()
+        self._fp = tempfile.TemporaryFile()
+        self._entries = []
+        self._central = _END_RECORD.size
+
+    def _close_part(self):
+        if self._fp is None:
+            return
+        offset = self._fp.tell()
+        for entry in self._entries:
+            self._fp.write(entry)
+        count = len(self._entries)
+        self._fp.write(_END_RECORD.pack(0x06054B50, 0, 0, count, count, self._central - _END_RECORD.size, offset, 0))
+        self._fp.seek(0)
+        self.parts.append(self._fp)
+        self._fp = None
+        self._entries = []
+
+    def _write_entry(self, name, data):
+        encoded = name.encode("utf-8")
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        payload = compressor.compress(data) + compressor.flush()
+        method = zipfile.ZIP_DEFLATED
+        if len(payload) >= len(data):
+            payload, method = data, zipfile.ZIP_STORED  # no compensa comprimir
+        size = _LOCAL_HEADER.size + len(encoded) + len(payload)
+        central = _CENTRAL_HEADER.size + len(encoded)
+        if self._fp is None or (self._entries and (
+                self._fp.tell() + size + self._central + central > self.part_bytes
+                or len(self._entries) >= _MAX_ENTRIES)):
+            self._open_part()
+
+        offset = self._fp.tell()
+        crc = zlib.crc32(data)
+        dos_date, dos_time = _dos_datetime()
+        self._fp.write(_LOCAL_HEADER.pack(0x04034B50, _ZIP_VERSION, _UTF8_NAMES, method, dos_time, dos_date,
+                                          crc, len(payload), len(data), len(encoded), 0))
+        self._fp.write(encoded)
+        self._fp.write(payload)
+        self._entries.append(_CENTRAL_HEADER.pack(0x02014B50, _MADE_BY, _ZIP_VERSION, _UTF8_NAMES, method, dos_time,
+                                                  dos_date, crc, len(payload), len(data), len(encoded), 0, 0, 0, 0,
+                                                  _FILE_ATTRS, offset) + encoded)
+        self._central += central
+
+    def add_file(self, name, fp, size):
+        """Añade un fichero de texto; si es muy grande se trocea por líneas en varias entradas."""
+        fp.seek(0)
+        if size <= self.segment_bytes:
+            self._write_entry(f"{name}.txt", fp.read())
+            return
+        segment = 1
+        while True:
+            data = fp.read(self.segment_bytes)
+            if not data:
+                break
+            data += fp.readline()
+            self._write_entry(f"{name}_{segment:03d}.txt", data)
+            segment += 1
+
+    def add_text(self, name, text):
+        self._write_entry(name, text.encode("utf-8"))
+
+    def finish(self):
+        self._close_part()
+        return self.parts
+
+    def close(self):
+        """Descarta la exportación (tras un error): cierra la parte abierta y las ya terminadas."""
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+        for fp in self.parts:
+            fp.close()
+        self.parts = []
+
+
+class ExportResult:
+    def __init__(self, parts, total_messages, channels):
+        self.parts = parts
+        self.total_messages = total_messages
+        self.channels = channels
+
+    def close(self):
+        for fp in self.parts:
+            fp.close()
+
+
+async def _dump_channel(channel, since, archive):
+    """Vuelca los mensajes del canal a un fichero temporal. Devuelve (fichero, tamaño, nº mensajes)."""
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES)
+    count = 0
+    try:
+        if archive and archive.covers(channel.id, since):
+            for line in await archive.export_lines(channel.id, since):
+                spool.write(line.encode("utf-8") + b"\n")
+                count += 1
+        else:
+            async for msg in channel.history(after=since, limit=None, oldest_first=True):
+                timestamp = msg.created_at.strftime('%Y-%m-%d %H:%M:%S')
+                spool.write(f"[{timestamp}] {msg.author.name}: {msg.content}\n".encode("utf-8"))
+                count += 1
+    except BaseException:
+        # Si falla (o se cancela) a medias, el fichero temporal no se devuelve: se cierra aquí
+        spool.close()
+        raise
+    return spool, spool.tell(), count
+
+
+async def export_guild(guild, since, archive=None, progress=None, part_bytes=EXPORT_PART_BYTES, channels=None):
+    """
+    Exporta los canales legibles del servidor desde `since` (o solo `channels`, si se pasan).
+    `progress(done, total, messages)` se llama como mucho cada PROGRESS_INTERVAL segundos.
+    """
+    if channels is None:
+        channels = []
+        for channel in guild.text_channels:
+            perms = channel.permissions_for(guild.me)
+            if perms.read_messages and perms.read_message_history:
+                channels.append(channel)
+    channels = list(channels)
+
+    loop = asyncio.get_running_loop()
+    writer = ZipPartWriter(part_bytes)
+    # Un único hilo: el ZIP se escribe en orden, pero fuera del event loop
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="export-zip")
+    semaphore = asyncio.Semaphore(EXPORT_CONCURRENCY)
+    state = {"done": 0, "messages": 0, "last_report": time.monotonic()}
+    writes = []
+    spools = []
+
+    async def report(force=False):
+        now = time.monotonic()
+        if progress and (force or now - state["last_report"] >= PROGRESS_INTERVAL):
+            state["last_report"] = now
+            try:
+                await progress(state["done"], len(channels), state["messages"])
+            except Exception as e:
+                logger.debug(f"Progress update failed: {e}")
+
+    async def run(channel):
+        async with semaphore:
+            try:
+                spool, size, count = await _dump_channel(channel, since, archive)
+            except Exception as e:
+                writes.append(loop.run_in_executor(executor, writer.add_text, f"ERRORS/{channel.name}_error.txt", str(e)))
+            else:
+                state["messages"] += count
+                if count:
+                    spools.append(spool)
+
+                    def add(spool=spool, size=size, name=channel.name):
+                        try:
+                            writer.add_file(name, spool, size)
+                        finally:
+                            spool.close()
+                    writes.append(loop.run_in_executor(executor, add))
+                else:
+                    spool.close()
+            state["done"] += 1
+            await report()
+
+    try:
+        await asyncio.gather(*(run(c) for c in channels))
+        await asyncio.gather(*writes)
+        parts = await loop.run_in_executor(executor, writer.finish)
+    except BaseException:
+        # Error o cancelación: se anulan las escrituras en cola, se espera a la que esté en curso
+        # (usa el mismo fichero) y se cierran las partes y los volcados que no llegaron al ZIP
+        for write in writes:
+            write.cancel()
+        executor.shutdown(wait=True, cancel_futures=True)
+        writer.close()
+        for spool in spools:
+            spool.close()
+        raise
+    executor.shutdown(wait=True)
+    await report(force=True)
+    logger.info(f"Export of {guild.name}: {len(channels)} channels, {state['messages']} messages, {len(parts)} part(s)")
+    return ExportResult(parts, state["messages"], len(channels))
@@ -0,0 +1,200 @@
+# groq_client.py
+"""
+Cliente mínimo y asíncrono para la API de chat de Groq (compatible con OpenAI).
+Alternativa a langchain_groq (MAI_LLM_BACKEND=native): una sola sesión aiohttp
+con keep-alive, streaming SSE y las cabeceras de rate limit de cada respuesta.
+Solo implementa lo que usa AgentLogic: `ainvoke`, `astream` y mensajes con `.content`.
+"""
+import os
+import json
+import logging
+
+import aiohttp
+
+logger = logging.getLogger('GroqClient')
+
+# Mismo nombre de variable que el SDK de Groq (así el stub de los benchmarks vale para los dos)
+GROQ_API_BASE = os.getenv('GROQ_API_BASE', "https://api.groq.com")
+CHAT_COMPLETIONS_PATH = "/openai/v1/chat/completions"
+RATE_LIMIT_HEADERS = (
+    "retry-after",
+    "x-ratelimit-limit-requests", "x-ratelimit-remaining-requests", "x-ratelimit-reset-requests",
+    "x-ratelimit-limit-tokens", "x-ratelimit-remaining-tokens", "x-ratelimit-reset-tokens",
+)
+# `type` de los mensajes (igual que en LangChain) -> `role` de la API
+ROLES = {"system": "system", "human": "user", "ai": "assistant"}
+
+
+class _Message:
+    __slots__ = ("content",)
+    type = None
+
+    def __init__(self, content=""):
+        self.content = content
+
+    def __repr__(self):
+        return f"{type(self).__name__}(content={self.content!r})"
+
+
+class SystemMessage(_Message):
+    __slots__ = ()
+    type = "system"
+
+
+class HumanMessage(_Message):
+    __slots__ = ()
+    type = "human"
+
+
+class AIMessage(_Message):
+    """Respuesta (o trozo de stream) del modelo. Los trozos se acumulan con `+`."""
+    __slots__ = ("usage_metadata", "response_metadata")
+    type = "ai"
+
+    def __init__(self, content="", usage_metadata=None, response_metadata=None):
+        super().__init__(content)
+        self.usage_metadata = usage_metadata
+        self.response_metadata = response_metadata or {}
+
+    def __add__(self, other):
+        return AIMessage(
+            self.content + other.content,
+            other.usage_metadata or self.usage_metadata,
+            {**self.response_metadata, **other.response_metadata},
+        )
+
+
+class GroqAPIError(Exception):
+    """Error HTTP de la API. `status_code` y `headers` los leen model_health y el fallback."""
+
+    def __init__(self, message, status_code=None, headers=None, body=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.body = body
+
+
+def rate_limit_info(headers):
+    """Cabeceras de rate limit de una respuesta, con las claves en minúsculas."""
+    return {name: headers[name] for name in RATE_LIMIT_HEADERS if name in headers}
+
+
+def _usage(data):
+    """`usage` de OpenAI (o `x_groq.usage` en streaming) con los nombres de LangChain."""
+    usage = data.get("usage") or (data.get("x_groq") or {}).get("usage")
+    if not usage:
+        return None
+    return {
+        "input_tokens": usage.get("prompt_tokens", 0),
+        "output_tokens": usage.get("completion_tokens", 0),
+        "total_tokens": usage.get("total_tokens", 0),
+    }
+
+
+def _serialize(message):
+    if isinstance(message, dict):
+        return message
+    return {"role": ROLES.get(message.type, message.type), "content": message.content}
+
+
+async def _raise_for_status(response):
+    if response.status < 400:
+        return
+    text = await response.text()
+    try:
+        error = json.loads(text).get("error") or {}
+    except (ValueError, AttributeError):
+        error = {"message": text[:500]}
+    raise GroqAPIError(
+        f"Error code: {response.status} - {error.get('code') or error.get('type')}: {error.get('message')}",
+        status_code=response.status,
+        headers=rate_limit_info(response.headers),
+        body=error,
+    )
+
+
+class ChatModel:
+    """Lo que AgentLogic espera de un cliente por modelo (la parte de ChatGroq que usamos)."""
+    __slots__ = ("client", "model")
+
+    def __init__(self, client, model):
+        self.client = client
+        self.model = model
+
+    async def ainvoke(self, messages):
+        return await self.client.complete(self.model, messages)
+
+    def astream(self, messages):
+        return self.client.stream(self.model, messages)
+
+
+class GroqClient:
+    def __init__(self, api_key, base_url=GROQ_API_BASE, temperature=0.7, max_connections=20,
+                 keepalive_expiry=60.0, timeout=30.0, connect_timeout=5.0):
+        self.api_key = api_key
+        self.url = base_url.rstrip("/") + CHAT_COMPLETIONS_PATH
+        self.temperature = temperature
+        self.max_connections = max_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.timeout = aiohttp.ClientTimeout(total=timeout, sock_connect=connect_timeout)
+        self._session = None
+
+    def _get_session(self):
+        # Se crea dentro del loop que la va a usar (no al importar ni en __init__)
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=self.keepalive_expiry),
+                timeout=self.timeout,
+                headers={"Authorization": f"Bearer {self.api_key}"},
+            )
+        return self._session
+
+    def chat(self, model):
+        return ChatModel(self, model)
+
+    def _payload(self, model, messages, stream):
+        return {
+            "model": model,
+            "messages": [_serialize(m) for m in messages],
+            "temperature": self.temperature,
+            "stream": stream,
+        }
+
+    async def complete(self, model, messages):
+        async with self._get_session().post(self.url, json=self._payload(model, messages, False)) as response:
+            await _raise_for_status(response)
+            data = await response.json()
+        choice = data["choices"][0]
+        return AIMessage(
+            choice["message"].get("content") or "",
+            _usage(data),
+            {"model_name": data.get("model", model), "finish_reason": choice.get("finish_reason"),
+             "headers": rate_limit_info(response.headers)},
+        )
+
+    async def stream(self, model, messages):
+        """Trozos AIMessage según llegan (SSE). El último trae el uso de tokens."""
+        async with self._get_session().post(self.url, json=self._payload(model, messages, True)) as response:
+            await _raise_for_status(response)
+            headers = rate_limit_info(response.headers)
+            async for raw in response.content:
+                line = raw.strip()
+                if not line.startswith(b"data:"):
+                    continue
+                data = line[5:].strip()
+                if data == b"[DONE]":
+                    break
+                chunk = json.loads(data)
+                if "error" in chunk:
+                    error = chunk["error"] or {}
+                    raise GroqAPIError(f"Stream error - {error.get('code') or error.get('type')}: {error.get('message')}",
+                                       status_code=error.get("status_code"), headers=headers, body=error)
+                choice = (chunk.get("choices") or [{}])[0]
+                metadata = {"model_name": chunk.get("model", model), "headers": headers}
+                if choice.get("finish_reason"):
+                    metadata["finish_reason"] = choice["finish_reason"]
+                yield AIMessage((choice.get("delta") or {}).get("content") or "", _usage(chunk), metadata)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
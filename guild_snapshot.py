@@ -0,0 +1,75 @@
+# guild_snapshot.py
+"""
+Foto cacheada de lo que MAI puede ver en cada servidor.
+Evita recorrer `permissions_for` en todos los canales en cada mención: el
+conjunto de canales legibles, la lista ya renderizada y el prefijo estático
+del system prompt se recalculan solo cuando cambian canales, roles o permisos.
+"""
+import logging
+
+from knowledge_base import knowledge_version
+
+logger = logging.getLogger('GuildSnapshot')
+
+
+class GuildSnapshot:
+    __slots__ = ("guild_id", "readable", "history_readable", "by_name", "channel_lines",
+                 "server_stats", "_prompt", "_prompt_version")
+
+    def __init__(self, guild):
+        me = guild.me
+        readable = []
+        history_readable = []
+        for channel in guild.text_channels:
+            perms = channel.permissions_for(me)
+            if perms.read_messages:
+                readable.append(channel)
+                if perms.read_message_history:
+                    history_readable.append(channel)
+        self.guild_id = guild.id
+        self.readable = tuple(readable)
+        self.history_readable = tuple(history_readable)
+        self.by_name = {}  # nombre en minúsculas -> canales que se llaman así (puede haber varios)
+        for channel in readable:
+            self.by_name.setdefault(channel.name.lower(), []).append(channel)
+        self.channel_lines = tuple(f"{c.name} (<#{c.id}>)" for c in readable)
+        self.server_stats = {"Server": guild.name}
+        self._prompt = None
+        self._prompt_version = None
+
+    def search_scope(self, target_channel="ALL"):
+        """Canales legibles para un SEARCH (todos, o todos los que se llaman así)."""
+        if target_channel == "ALL":
+            return list(self.readable)
+        return list(self.by_name.get(target_channel.lower(), ()))
+
+    def prompt_prefix(self, render):
+        """
+        Prefijo estático del system prompt, renderizado con `render(canales, stats)`.
+        Es idéntico byte a byte entre llamadas mientras no cambie el servidor ni la
+        base de conocimiento, así que el proveedor puede reutilizar su caché de prompt.
+        """
+        version = knowledge_version()
+        if self._prompt is None or self._prompt_version != version:
+            self._prompt = render(self.channel_lines, self.server_stats)
+            self._prompt_version = version
+        return self._prompt
+
+
+class GuildSnapshots:
+    """Registro de fotos por servidor; se construyen al primer uso tras invalidarlas."""
+
+    def __init__(self):
+        self._snapshots = {}
+        self.builds = 0
+
+    def get(self, guild):
+        snapshot = self._snapshots.get(guild.id)
+        if snapshot is None:
+            snapshot = self._snapshots[guild.id] = GuildSnapshot(guild)
+            self.builds += 1
+            logger.debug(f"Snapshot built for {guild.name}: {len(snapshot.readable)} readable channels")
+        return snapshot
+
+    def invalidate(self, guild_id):
+        self._snapshots.pop(guild_id, None)
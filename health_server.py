@@ -0,0 +1,87 @@
+# health_server.py
+"""
+Servidor HTTP de salud y métricas, en el mismo event loop que el bot.
+  /         -> "MAI is alive!" (compatibilidad con el health check de Koyeb/Render)
+  /healthz  -> estado del gateway, retraso del loop y modelos (503 si algo va mal)
+  /metrics  -> métricas en formato Prometheus
+"""
+import os
+import logging
+
+from aiohttp import web
+
+from metrics import REGISTRY, STAGE_LATENCY, Gauge
+from loop_watchdog import LoopWatchdog
+
+logger = logging.getLogger('HealthServer')
+
+HEALTH_PORT = int(os.environ.get("PORT", 8000))
+# Por encima de este retraso del loop, /healthz responde 503
+LOOP_LAG_UNHEALTHY = float(os.getenv('MAI_LOOP_LAG_UNHEALTHY', 2.0))
+
+
+class HealthServer:
+    def __init__(self, get_bot, agent, scheduler_stats=None, watchdog=None, port=HEALTH_PORT):
+        self.get_bot = get_bot                  # el bot cambia entre reintentos de conexión
+        self.agent = agent
+        self.scheduler_stats = scheduler_stats  # callable opcional -> dict
+        self.port = port
+        self.watchdog = watchdog or LoopWatchdog()
+        self._runner = None
+        REGISTRY.register(Gauge("mai_event_loop_lag_seconds", "Último retraso medido del event loop", lambda: self.watchdog.lag))
+        REGISTRY.register(Gauge("mai_gateway_latency_seconds", "Latencia del heartbeat del gateway", self._gateway_latency))
+        REGISTRY.register(Gauge("mai_gateway_connected", "1 si el gateway está conectado y listo", lambda: 1 if self._gateway_ready() else 0))
+        REGISTRY.register(Gauge("mai_model_available", "1 si el modelo no está en cooldown", self._models_available, label="model"))
+
+    def _gateway_ready(self):
+        bot = self.get_bot()
+        return bool(bot is not None and bot.is_ready() and not bot.is_closed())
+
+    def _gateway_latency(self):
+        bot = self.get_bot()
+        latency = getattr(bot, "latency", None) if bot is not None else None
+        return latency if latency is not None and latency == latency and latency != float("inf") else None
+
+    def _models_available(self):
+        return {model: 1 if state["available"] else 0 for model, state in self.agent.model_health.snapshot().items()}
+
+    async def _root(self, request):
+        return web.Response(text="MAI is alive!")
+
+    async def _healthz(self, request):
+        ready = self._gateway_ready()
+        lag = self.watchdog.lag
+        models_exhausted = self.agent.model_health.exhausted()
+        healthy = ready and lag < LOOP_LAG_UNHEALTHY
+        body = {
+            "status": "ok" if healthy else "degraded",
+            "gateway": {"ready": ready, "latency": self._gateway_latency()},
+            "loop_lag": round(lag, 4),
+            "loop_lag_max": round(self.watchdog.max_lag, 4),
+            "loop_blocks": self.watchdog.snapshot(),
+            "models_exhausted": models_exhausted,
+            "retry_after": round(self.agent.model_health.retry_after(), 1) if models_exhausted else 0,
+            "stages": STAGE_LATENCY.summary(),
+        }
+        if self.scheduler_stats:
+            body["queue"] = self.scheduler_stats()
+        return web.json_response(body, status=200 if healthy else 503)
+
+    async def _metrics(self, request):
+        return web.Response(text=REGISTRY.render(), content_type="text/plain", charset="utf-8")
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/", self._root)
+        app.router.add_get("/healthz", self._healthz)
+        app.router.add_get("/metrics", self._metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "0.0.0.0", self.port).start()
+        self.watchdog.start()
+        logger.info(f"Health server listening on :{self.port}")
+
+    async def close(self):
+        self.watchdog.stop()
+        if self._runner is not None:
+            await self._runner.cleanup()
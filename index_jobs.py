@@ -0,0 +1,206 @@
+# index_jobs.py
+"""
+Trabajos en segundo plano para indexar canales en el almacén de recuperación.
+Cada canal guarda un checkpoint (último mensaje indexado) en disco, así que un
+reinicio continúa donde se quedó. Varios canales se leen a la vez, pero todas
+las peticiones de historial comparten un mismo presupuesto (token bucket).
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+
+import discord
+
+logger = logging.getLogger('IndexJobs')
+
+CHECKPOINT_PATH = os.getenv('MAI_INDEX_CHECKPOINTS', 'mai_index_jobs.json')
+JOB_CONCURRENCY = int(os.getenv('MAI_INDEX_JOB_CONCURRENCY', 3))
+# Peticiones de historial por segundo entre todos los trabajos (cada página son 100 mensajes)
+REQUEST_RATE = float(os.getenv('MAI_INDEX_REQUEST_RATE', 2.0))
+REQUEST_BURST = int(os.getenv('MAI_INDEX_REQUEST_BURST', 4))
+BATCH_SIZE = int(os.getenv('MAI_INDEX_BATCH', 200))
+HISTORY_PAGE = 100
+MIN_MESSAGE_LENGTH = 10
+
+
+class TokenBucket:
+    """Limitador global: `rate` tokens por segundo con ráfagas de hasta `burst`."""
+
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self._tokens = float(burst)
+        self._updated = clock()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = self._clock()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class IndexJob:
+    __slots__ = ("channel_id", "name", "state", "read", "indexed", "started_at", "finished_at", "error")
+
+    def __init__(self, channel_id, name):
+        self.channel_id = channel_id
+        self.name = name
+        self.state = "queued"
+        self.read = 0
+        self.indexed = 0
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+
+    @property
+    def elapsed(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    @property
+    def rate(self):
+        return self.read / self.elapsed if self.elapsed > 0 else 0.0
+
+
+class IndexJobManager:
+    def __init__(self, learn, path=CHECKPOINT_PATH, concurrency=JOB_CONCURRENCY,
+                 rate=REQUEST_RATE, burst=REQUEST_BURST, batch_size=BATCH_SIZE):
+        self.learn = learn  # async learn(mensajes, fuente) -> pasajes nuevos
+        self.path = path
+        self.batch_size = batch_size
+        self.bucket = TokenBucket(rate, burst)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._jobs = {}   # channel_id -> IndexJob (el último de cada canal)
+        self._tasks = {}  # channel_id -> asyncio.Task
+        self._checkpoints = self._load()
+        self._save_lock = asyncio.Lock()
+
+    # --- Checkpoints ---
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return {int(k): v for k, v in json.load(f).items()}
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.error(f"Could not read index checkpoints ({self.path}): {e}")
+            return {}
+
+    def _write(self, data):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.path)
+
+    async def _save(self):
+        async with self._save_lock:
+            data = {str(k): dict(v) for k, v in self._checkpoints.items()}
+            await asyncio.to_thread(self._write, data)
+
+    # --- Trabajos ---
+
+    def submit(self, channel):
+        """Encola un canal (si ya se está indexando, no hace nada). Devuelve su IndexJob."""
+        task = self._tasks.get(channel.id)
+        if task is not None and not task.done():
+            return self._jobs[channel.id]
+        job = self._jobs[channel.id] = IndexJob(channel.id, channel.name)
+        self._tasks[channel.id] = asyncio.create_task(self._run(channel, job))
+        return job
+
+    def resume(self, bot):
+        """Reanuda los canales que se quedaron a medias antes de un reinicio."""
+        resumed = 0
+        for channel_id, checkpoint in self._checkpoints.items():
+            if checkpoint.get("complete"):
+                continue
+            channel = bot.get_channel(channel_id)
+            if channel is None:
+                continue
+            self.submit(channel)
+            resumed += 1
+        if resumed:
+            logger.info(f"Resuming {resumed} interrupted index jobs")
+        return resumed
+
+    async def _run(self, channel, job):
+        async with self._semaphore:
+            job.state = "running"
+            job.started_at = time.monotonic()
+            checkpoint = self._checkpoints.setdefault(channel.id, {"name": channel.name, "last_message_id": None, "indexed": 0})
+            checkpoint["complete"] = False
+            checkpoint["name"] = channel.name
+            after = discord.Object(id=checkpoint["last_message_id"]) if checkpoint["last_message_id"] else None
+            batch = []
+            last_id = checkpoint["last_message_id"]
+            source = f"channel_{channel.name}"
+
+            async def flush():
+                nonlocal batch
+                if batch:
+                    await self.learn(batch, source)
+                    job.indexed += len(batch)
+                    checkpoint["indexed"] = checkpoint.get("indexed", 0) + len(batch)
+                    batch = []
+                # El checkpoint solo avanza cuando lo anterior ya está guardado en el almacén
+                checkpoint["last_message_id"] = last_id
+                await self._save()
+
+            try:
+                await self.bucket.acquire()
+                async for msg in channel.history(limit=None, after=after, oldest_first=True):
+                    job.read += 1
+                    last_id = msg.id
+                    if not msg.author.bot and len(msg.content) > MIN_MESSAGE_LENGTH:
+                        batch.append(f"User: {msg.content}")
+                    if job.read % HISTORY_PAGE == 0:
+                        # Cada página de historial es una petición a la API
+                        await self.bucket.acquire()
+                    if len(batch) >= self.batch_size:
+                        await flush()
+                await flush()
+                checkpoint["complete"] = True
+                await self._save()
+                job.state = "done"
+            except asyncio.CancelledError:
+                job.state = "cancelled"
+                raise
+            except Exception as e:
+                job.state = "failed"
+                job.error = str(e)
+                logger.error(f"Index job for #{channel.name} failed: {e}")
+            finally:
+                job.finished_at = time.monotonic()
+                logger.info(f"Index job #{channel.name}: {job.state}, {job.read} read, {job.indexed} indexed, {job.rate:.0f} msg/s")
+
+    def status(self):
+        """Texto para el comando de estado."""
+        if not self._jobs:
+            return "No hay trabajos de indexado."
+        lines = []
+        for job in sorted(self._jobs.values(), key=lambda j: j.started_at or float("inf")):
+            line = f"• #{job.name}: **{job.state}** · {job.read} leídos · {job.indexed} indexados · {job.rate:.0f} msg/s"
+            if job.error:
+                line += f" · error: {job.error}"
+            lines.append(line)
+        running = [j for j in self._jobs.values() if j.state == "running"]
+        total_rate = sum(j.rate for j in running)
+        lines.append(f"En curso: {len(running)} · {total_rate:.0f} msg/s en total")
+        return "\n".join(lines)
+
+    async def close(self):
+        tasks = [t for t in self._tasks.values() if not t.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,104 @@
+# intent_router.py
+"""
+Clasificador local de intención sobre la base de conocimiento.
+Puntúa las secciones de la base de conocimiento con BM25 (más los alias de
+get_context) para inyectar el contexto correcto en el primer prompt y
+ahorrarnos la ronda "CONTEXT: <tema>" con el LLM.
+"""
+import os
+import math
+import logging
+from collections import Counter
+
+from knowledge_base import current_knowledge
+from text_utils import normalize_query, stems
+
+logger = logging.getLogger('IntentRouter')
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Un alias o nombre de sección en la pregunta ("android", "goats") pesa como varias palabras
+ALIAS_BOOST = float(os.getenv('MAI_ROUTER_ALIAS_BOOST', 4.0))
+MIN_SCORE = float(os.getenv('MAI_ROUTER_MIN_SCORE', 3.0))
+MIN_CONFIDENCE = float(os.getenv('MAI_ROUTER_MIN_CONFIDENCE', 0.35))
+# Una segunda sección se inyecta también si puntúa al menos esta fracción de la primera
+SECOND_TOPIC_RATIO = 0.75
+
+
+class Route:
+    __slots__ = ("topics", "confidence", "scores")
+
+    def __init__(self, topics, confidence, scores):
+        self.topics = topics
+        self.confidence = confidence
+        self.scores = scores
+
+    @property
+    def confident(self):
+        return bool(self.topics) and self.confidence >= MIN_CONFIDENCE
+
+    def __repr__(self):
+        return f"Route(topics={self.topics}, confidence={self.confidence:.2f})"
+
+
+class IntentRouter:
+    """Índice BM25 de las secciones; se reconstruye solo si cambia la base de conocimiento."""
+
+    def __init__(self):
+        self._version = None
+        self._docs = {}
+        self._df = Counter()
+        self._avgdl = 1.0
+        self._alias_targets = {}
+
+    def _ensure_index(self):
+        knowledge = current_knowledge()
+        if knowledge.version == self._version:
+            return
+        # Tokens y alias ya vienen precalculados en la foto de la base de conocimiento
+        self._docs = {}
+        self._df = Counter()
+        for name, tokens in knowledge.stems.items():
+            tf = Counter(tokens)
+            self._docs[name] = (tf, len(tokens))
+            self._df.update(tf.keys())
+        self._avgdl = sum(length for _, length in self._docs.values()) / max(1, len(self._docs))
+        self._alias_targets = knowledge.keywords
+        self._version = knowledge.version
+
+    def _bm25(self, query_tokens, name):
+        tf, length = self._docs[name]
+        n = len(self._docs)
+        score = 0.0
+        for token in query_tokens:
+            freq = tf.get(token)
+            if not freq:
+                continue
+            idf = math.log(1 + (n - self._df[token] + 0.5) / (self._df[token] + 0.5))
+            score += idf * freq * (BM25_K1 + 1) / (freq + BM25_K1 * (1 - BM25_B + BM25_B * length / self._avgdl))
+        return score
+
+    def scores(self, query):
+        """Puntuación de cada sección para la pregunta, de mayor a menor."""
+        self._ensure_index()
+        words = normalize_query(query)
+        if not words:
+            return []
+        scores = {name: self._bm25(stems(words), name) for name in self._docs}
+        for token in words:
+            target = self._alias_targets.get(token)
+            if target:
+                scores[target] += ALIAS_BOOST
+        return sorted(((n, s) for n, s in scores.items() if s > 0), key=lambda x: x[1], reverse=True)
+
+    def route(self, query):
+        ranked = self.scores(query)
+        if not ranked or ranked[0][1] < MIN_SCORE:
+            return Route([], 0.0, ranked)
+        best = ranked[0][1]
+        topics = [ranked[0][0]]
+        if len(ranked) > 1 and ranked[1][1] >= best * SECOND_TOPIC_RATIO:
+            topics.append(ranked[1][0])
+        runner_up = ranked[len(topics)][1] if len(ranked) > len(topics) else 0.0
+        confidence = 1.0 - runner_up / best
+        return Route(topics, confidence, ranked)
@@ -2,193 +2,164 @@
 """
 Sistema de conocimiento expandible para MAI.
 El agente decide cuándo necesita cargar contexto adicional.
-"""
 
-# Contextos disponibles que el agente puede solicitar
-AVAILABLE_CONTEXTS = [
-    "meulify", "mai", "features", "goats", "cabra", "redes", 
-    "descargas_ios", "descargas_android", "pc_smarttv", 
-    "troubleshooting", "faq_general", "privacy", "tutoriales", "meuliwind"
-]
-
-# Base de conocimiento (solo se carga cuando el agente lo pide)
-KNOWLEDGE_DATA = {
-    "meulify": """
-🎵 MEULIFY - Reproductor de Música
-• App de música gratuita creada por la comunidad para la comunidad.
-• Desarrollador principal: La Cabra 🐐.
-• Estado: Beta (iOS TestFlight / Android Alpha y APK).
-• Web oficial: meulify.top
-• Financiación: Donaciones voluntarias (Ko-fi) y un anuncio diario opcional.
-""",
-
-    "mai": """
-🤖 M.A.I. (Meulify Artificial Intelligence)
-• Soy la IA oficial de Meulify, creada por La Cabra 🐐.
-• Mi misión es ayudar a la comunidad, recomendar música y resolver dudas.
-• IMPORTANTE: A veces me equivoco. Si la información no está en mi base de datos, debo decir "NO SÉ LA RESPUESTA".
-• No debo inventar pasos ni tutoriales.
-""",
-
-    "features": """
-✨ FUNCIONALIDADES Y USO
-• **Modo Offline**: No se puede descargar música directamente. Debes tener tus MP3 y usar "Importar archivos locales".
-• **Importar de Spotify**: Opción "Importar" en el feed. A veces falla si no encuentra la canción en YouTube.
-• **Límite Playlist**: 1000 canciones máximo.
-• **Portadas Animadas**: Posible, pero gasta más batería. Tutorial en #faqs.
-• **Cambiar Imagen Playlist**: Usa URL de imagen (ej: imgbb) en configuración de playlist.
-• **Historial**: Haz clic en la canción para que se registre.
-• **Sincronización**: Automática cada 5 min. Forzar con botón verde en ajustes (primero dispositivo origen, luego destino).
-• **Eliminar Canción**: Desliza a la izquierda sobre la canción en la lista.
-• **Compartir Playlist**: No hay link nativo. Usa la misma cuenta para compartir biblioteca.
-""",
-
-    "goats": """
-🐐 GOATS (Moneda Virtual)
-• Sirven para saltar el anuncio diario o comprar cosméticos.
-• Se consiguen viendo anuncios o donando.
-• Todo el contenido esencial es GRATIS. Los Goats son opcionales.
-""",
-
-    "cabra": """
-🐐 LA CABRA
-• El creador y desarrollador único de Meulify.
-• Una leyenda, un máquina, un dios.
-• Hay que tenerle paciencia porque tiene vida (universidad, etc.) y hace esto por amor al arte.
-""",
-
-    "redes": """
-📱 REDES SOCIALES
-• Web: meulify.top
-• TikTok: @meulify
-• Instagram: meulify.top
-• Ko-fi (Donaciones): ko-fi.com/meulify
-""",
-
-    "descargas_ios": """
-🍎 INSTALACIÓN iOS (iPhone)
-• **App Store (Oficial)**: ¡Sí! Está disponible. Busca "Meulify" en la App Store y descárgala normal.
-• **Betas / Alphas (TestFlight)**: Si quieres probar funciones nuevas antes que nadie, usa TestFlight.
-    - *¿Cómo entrar?*: Busca el enlace directo que envía La Cabra 🐐 en canales como `#anuncios` o `#alphas`.
-    - *Nota*: No hace falta formulario.
-• **Error Login**: Si falla al entrar, prueba a registrarte con correo/contraseña dentro de la app.
-• **Fallos Comunes**:
-    - *Música se para/corta*: Bug gestión de memoria iOS. Se intenta arreglar en cada versión.
-    - *Sin controles bloqueo*: Bug de betas iOS.
-    - *Batería*: Portadas animadas consumen más (especialmente iPhone 16).
-    - *Isla Dinámica*: A veces falla visualmente.
-""",
-
-    "descargas_android": """
-🤖 INSTALACIÓN ANDROID
-• **Descarga**: Google Play Store, Galaxy Store o APK en Discord (#alphas).
-• **Versión Alpha**: Pide rol "beta tester" en #roles -> canal #alphas.
-• **Error "Conflicto de paquetes"**: Tienes una versión vieja (ej: Play Store) y quieres instalar Alpha. --> DESINSTALA LA VIEJA PRIMERO.
-• **Play Protect**: Si bloquea, desactívalo o dale a "Instalar de todas formas".
-• **Android Auto**: No soportado aún.
-""",
-
-    "pc_smarttv": """
-💻 PC / TV / OTROS
-• **PC (Windows/Mac)**: NO hay versión nativa.
-    - *Solución*: Usa emulador Android (BlueStacks, LDPlayer) o Waydroid (Linux).
-    - *Web*: No existe versión web.
-• **Chromebook**: Funciona mal (pantalla negra, crasheos). Borrar caché ayuda temporalmente.
-• **Smart TV**: No nativa. Samsung Dex funciona.
-• **CarPlay / Android Auto**: No soportado.
-""",
-
-    "troubleshooting": """
-🛠️ SOLUCIÓN DE ERRORES (TROUBLESHOOTING)
-• **Música se para al salir/bloquear**:
-    - *Android*: Quita restricción batería y activa "Notificación segundo plano" en ajustes Meulify.
-    - *iOS*: Bug conocido de TestFlight. Espera update.
-• **Pantalla Blanca/Negra o No Carga**:
-    - Borrar caché y datos de la app.
-    - Reinstalar última versión.
-    - *Chromebook*: Error muy común, difícil solución definitiva.
-• **Login Error / Captcha**:
-    - Caída servidores (Cloudflare).
-    - Cambia WiFi/Datos.
-    - Revisa correo.
-    - "Invalid login credentials": Desinstala versión vieja e instala la nueva de cero.
-• **Artista Desconocido**: Bug visual. Borra y re-añade canción.
-• **Buscador no va**: Cambia pestaña Música<->Video o instala última Alpha.
-• **Importar Playlist Falla**:
-    - Límite excedido (>1000 canciones).
-    - Canciones no encontradas en YouTube.
-• **Escucho Video/Intro en vez de Canción**:
-    - La app usa base de datos de YouTube. A veces pilla el videoclip.
-    - Solución: Usar "Mods" para asignar link correcto.
-• **Anuncio repetido**: Es cada 24h POR DISPOSITIVO.
-""",
-
-    "privacy": """
-🔒 PRIVACIDAD Y DATOS
-• **¿Segura?**: Sí, no se venden datos. Proyecto personal.
-• **Perder Playlists al borrar**:
-    - **SÍ PUEDES PERDERLAS**.
-    - La cuenta (login) *ya no* guarda playlists en el servidor automáticamente (para no saturar).
-    - **SOLUCIÓN OBLIGATORIA**: Vincula **Google Drive** en ajustes para backup.
-    - Canciones descargadas (MP3): Se pierden si borras la app (son archivos locales).
-""",
-
-    "tutoriales": """
-📚 **TUTORIALES**
-• **Portadas Animadas**: No inventes pasos. Link tutorial: [Buscar en canal youtube de meulify si existe, por ahora di que miren en #faqs]
-    - *Nota interna*: Instrucción del usuario "NO EXPLIQUES NADA. NO INVENTES". Remitir a #faqs o canal específico.
-""",
-
-    "meuliwind": """
-🌪️ MEULIWIND (Rewind)
-• Resumen anual de estadísticas.
-• Sale a final/principio de año.
-• Ver en Feed -> Meuliwind -> Free anual.
-""",
-    
-    "faq_general": """
-❓ OTRAS PREGUNTAS
-• **¿Código Abierto?**: Cerrado (No hay confirmación de open source).
-• **¿Cuándo sale oficial?**: Depende de bugs. "Coming soon".
-• **¿Donar falla?**: Botones nativos a veces fallan. Usa la web oficial o Ko-fi.
+El contenido vive en knowledge/ (manifest.json + un fichero por sección), así que
+arreglar una FAQ no requiere redesplegar: se vigila el mtime de los ficheros y,
+si cambian, se recarga y se sustituye la foto entera de una vez. Al cargar se
+precalcula todo lo que antes se rehacía en cada llamada (alias, el blob "all",
+tokens y recuento de tokens por sección).
 """
-}
+import os
+import json
+import time
+import hashlib
+import logging
+
+from prompt_budget import estimate_tokens
+from text_utils import stems, tokenize
+
+logger = logging.getLogger('KnowledgeBase')
+
+KNOWLEDGE_DIR = os.getenv('MAI_KNOWLEDGE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), "knowledge"))
+MANIFEST_NAME = "manifest.json"
+# Cada cuánto (como mucho) se mira si han cambiado los ficheros
+KNOWLEDGE_CHECK_INTERVAL = float(os.getenv('MAI_KNOWLEDGE_CHECK_INTERVAL', 5.0))
+
+
+class KnowledgeSnapshot:
+    """Una versión cargada de la base de conocimiento. No se modifica: se sustituye entera."""
+    __slots__ = ("version", "digest", "contexts", "sections", "aliases", "keywords",
+                 "all_text", "menu", "tokens", "stems", "token_counts")
+
+    def __init__(self, version, sections, aliases):
+        self.version = version
+        self.contexts = tuple(sections)
+        self.sections = dict(sections)
+        # Alias explícitos (solo los que apuntan a una sección que existe) + los propios nombres
+        self.aliases = {name: name for name in self.sections}
+        self.aliases.update({a.lower(): t for a, t in aliases.items() if t in self.sections})
+        # Palabras que delatan una sección en una pregunta: nombre, sus partes y los alias
+        keywords = {}
+        for name in self.sections:
+            keywords.setdefault(name, name)
+            for part in name.split("_"):
+                keywords.setdefault(part, name)
+        keywords.update(self.aliases)
+        self.keywords = keywords
+        self.all_text = "\n".join(self.sections.values())
+        self.menu = ", ".join(self.contexts)
+        self.tokens = {name: tokenize(name.replace("_", " ") + " " + text) for name, text in self.sections.items()}
+        self.stems = {name: stems(tokens) for name, tokens in self.tokens.items()}
+        self.token_counts = {name: estimate_tokens(text) for name, text in self.sections.items()}
+        digest = hashlib.sha1()
+        for name in self.contexts:
+            digest.update(name.encode("utf-8"))
+            digest.update(self.sections[name].encode("utf-8"))
+        digest.update(json.dumps(sorted(self.aliases.items())).encode("utf-8"))
+        self.digest = digest.hexdigest()
+
+
+class KnowledgeStore:
+    def __init__(self, path=KNOWLEDGE_DIR, check_interval=KNOWLEDGE_CHECK_INTERVAL, clock=time.monotonic):
+        self.path = path
+        self.check_interval = check_interval
+        self._clock = clock
+        self._mtimes = None
+        self._checked_at = None
+        self.reloads = 0
+        # Sin conocimiento el bot no sirve: si falla la primera carga, que se note al arrancar
+        self._snapshot = self._load(1)
+
+    def _file_mtimes(self, names):
+        files = [MANIFEST_NAME] + [f"{name}.md" for name in names]
+        return {f: os.stat(os.path.join(self.path, f)).st_mtime_ns for f in files}
+
+    def _load(self, version):
+        start = time.perf_counter()
+        with open(os.path.join(self.path, MANIFEST_NAME), encoding="utf-8") as f:
+            manifest = json.load(f)
+        names = [name.lower() for name in manifest["sections"]]
+        before = self._file_mtimes(names)
+        sections = {}
+        for name in names:
+            with open(os.path.join(self.path, f"{name}.md"), encoding="utf-8") as f:
+                sections[name] = f.read()
+        mtimes = self._file_mtimes(names)
+        if mtimes != before:
+            raise ValueError("knowledge files changed while loading")
+        self._mtimes = mtimes
+        self._checked_at = self._clock()
+        snapshot = KnowledgeSnapshot(version, sections, manifest.get("aliases", {}))
+        logger.info(f"Knowledge v{version} loaded: {len(sections)} sections, "
+                    f"{sum(snapshot.token_counts.values())} tokens in {(time.perf_counter() - start) * 1000:.1f}ms")
+        return snapshot
+
+    def _changed(self):
+        try:
+            return self._file_mtimes(self._snapshot.contexts) != self._mtimes
+        except OSError:
+            # Un fichero a medio reemplazar (o borrado): se verá en la siguiente comprobación
+            return True
+
+    def current(self):
+        """La foto vigente; cada `check_interval` segundos mira si hay que recargar."""
+        now = self._clock()
+        if now - self._checked_at >= self.check_interval:
+            self._checked_at = now
+            if self._changed():
+                self.reload()
+        return self._snapshot
+
+    def reload(self):
+        """Recarga desde disco. Si algo falla se sigue con la versión anterior."""
+        old = self._snapshot
+        try:
+            snapshot = self._load(old.version + 1)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.error(f"Knowledge reload failed, keeping v{old.version}: {e}")
+            return False
+        if snapshot.digest == old.digest:
+            # Solo han cambiado las fechas (p. ej. un `touch`): las cachés siguen valiendo
+            return False
+        self._snapshot = snapshot
+        self.reloads += 1
+        return True
+
+
+STORE = KnowledgeStore()
+
+
+def current_knowledge() -> KnowledgeSnapshot:
+    return STORE.current()
+
+
+def resolve_context_name(context_name: str) -> str:
+    """Nombre canónico de un contexto (resuelve alias como "ios" -> "descargas_ios")."""
+    context_name = context_name.lower().strip()
+    return current_knowledge().aliases.get(context_name, context_name)
+
 
 def get_context(context_name: str) -> str:
     """
     Devuelve el contexto solicitado por el agente.
     """
+    knowledge = current_knowledge()
     context_name = context_name.lower().strip()
-    
-    # Alias para facilitar la búsqueda del agente
-    aliases = {
-        "ios": "descargas_ios",
-        "iphone": "descargas_ios",
-        "android": "descargas_android",
-        "apk": "descargas_android",
-        "pc": "pc_smarttv",
-        "windows": "pc_smarttv",
-        "mac": "pc_smarttv",
-        "tv": "pc_smarttv",
-        "bugs": "troubleshooting",
-        "errores": "troubleshooting",
-        "fallos": "troubleshooting",
-        "privacidad": "privacy",
-        "datos": "privacy",
-        "backup": "privacy",
-        "drive": "privacy"
-    }
-    
-    target = aliases.get(context_name, context_name)
-    
-    if target in KNOWLEDGE_DATA:
-        return KNOWLEDGE_DATA[target]
+    target = knowledge.aliases.get(context_name, context_name)
+
+    if target in knowledge.sections:
+        return knowledge.sections[target]
     elif target == "all":
-        return "\\n".join(KNOWLEDGE_DATA.values())
-    
-    return f"Contexto '{context_name}' no encontrado. Disponibles: {', '.join(AVAILABLE_CONTEXTS)}"
+        return knowledge.all_text
+
+    return f"Contexto '{context_name}' no encontrado. Disponibles: {knowledge.menu}"
 
 
 def get_context_menu() -> str:
     """Devuelve la lista de contextos disponibles para el prompt."""
-    return ", ".join(AVAILABLE_CONTEXTS)
+    return current_knowledge().menu
+
+
+def knowledge_version() -> int:
+    """Versión de la base de conocimiento (sube en cada recarga con cambios): clave para invalidar cachés."""
+    return current_knowledge().version
@@ -0,0 +1,15 @@
+# llm_backend.py
+"""
+Cliente LLM en uso, según MAI_LLM_BACKEND:
+  langchain (por defecto) -> langchain_groq.ChatGroq sobre un pool httpx
+  native                  -> groq_client.GroqClient (aiohttp, sin importar LangChain)
+Los dos exponen `ainvoke`/`astream` y respuestas con `.content` y `usage_metadata`.
+"""
+import os
+
+LLM_BACKEND = os.getenv('MAI_LLM_BACKEND', 'langchain').lower()
+
+if LLM_BACKEND == 'native':
+    from groq_client import SystemMessage, HumanMessage
+else:
+    from langchain_core.messages import SystemMessage, HumanMessage
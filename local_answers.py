@@ -0,0 +1,82 @@
+# local_answers.py
+"""
+Modo degradado: respuestas sin LLM mientras toda la cadena de modelos está limitada.
+Se elige la sección de la base de conocimiento que mejor encaja con la pregunta (el mismo
+BM25 + alias del IntentRouter) y se contesta con una plantilla ya renderizada con
+la voz de MAI, más un aviso corto de que es una respuesta automática.
+Como las del LLM, salen con el marcador del usuario (text_utils.USER_PLACEHOLDER)
+para que se puedan compartir; el nombre lo pone AgentLogic al contestar.
+"""
+import os
+import zlib
+import logging
+
+from knowledge_base import current_knowledge
+from text_utils import USER_PLACEHOLDER
+
+logger = logging.getLogger('LocalAnswers')
+
+# Algo más permisivo que el router (3.0): sin LLM, mejor una sección probable que ninguna
+LOCAL_MIN_SCORE = float(os.getenv('MAI_LOCAL_MIN_SCORE', 2.5))
+LOCAL_MAX_CHARS = int(os.getenv('MAI_LOCAL_MAX_CHARS', 1500))
+
+INTROS = (
+    "¡Buenas, {user}! 🔥 Esto es lo que tengo sobre eso:",
+    "Ey {user}, te paso lo que sé de esto 👇",
+    "¡{user}, crack! Mira, esto te puede servir 😊",
+)
+NO_MATCH = (
+    "Uf {user}, ahora mismo estoy a tope 🥵 y sin mi cerebro completo no sé contestarte a eso. "
+    "Vuelve a mencionarme en un ratito o, si es algo serio, abre un ticket y te ayudan. "
+    "Mientras, puedo contarte cosas de: {topics}."
+)
+NOTICE = "-# ⚠️ Respuesta automática: mis modelos están saturados ahora mismo.{retry} Si necesitas más detalle, vuelve a preguntarme en un rato."
+
+
+def _clean(text):
+    """Quita las notas internas (van dirigidas al modelo, no al usuario) y recorta a un mensaje."""
+    lines = [line for line in text.strip().splitlines() if "nota interna" not in line.lower()]
+    body = ""
+    for line in lines:
+        if len(body) + len(line) + 1 > LOCAL_MAX_CHARS:
+            break
+        body += line + "\n"
+    return body.rstrip()
+
+
+class LocalAnswers:
+    def __init__(self, router):
+        self.router = router
+        self._version = None
+        self._templates = {}
+        self._no_match = None
+        self.served = 0
+
+    def _ensure_templates(self):
+        knowledge = current_knowledge()
+        if knowledge.version == self._version:
+            return
+        templates = {}
+        for name, text in knowledge.sections.items():
+            # La misma sección siempre con la misma entradilla (estable entre reinicios)
+            intro = INTROS[zlib.crc32(name.encode("utf-8")) % len(INTROS)]
+            templates[name] = intro.replace("{user}", USER_PLACEHOLDER) + "\n" + _clean(text)
+        self._templates = templates
+        self._no_match = NO_MATCH.replace("{user}", USER_PLACEHOLDER).replace("{topics}", ", ".join(sorted(templates)))
+        self._version = knowledge.version
+
+    def best_topic(self, query, ranked=None):
+        """Sección que mejor encaja (o None). `ranked` son las puntuaciones ya calculadas por el router."""
+        ranked = ranked if ranked is not None else self.router.scores(query)
+        if not ranked or ranked[0][1] < LOCAL_MIN_SCORE:
+            return None
+        return ranked[0][0]
+
+    def answer(self, query, user_name, ranked=None, retry_after=None):
+        self._ensure_templates()
+        topic = self.best_topic(query, ranked)
+        text = self._templates.get(topic, self._no_match)
+        retry = f" Deberían volver en ~{retry_after:.0f}s." if retry_after else ""
+        self.served += 1
+        logger.info(f"Local answer for {user_name}: {topic or 'no match'}")
+        return text + "\n\n" + NOTICE.replace("{retry}", retry)
@@ -0,0 +1,234 @@
+# loop_watchdog.py
+"""
+Vigilancia del event loop (todo el bot corre en un solo hilo: si algo lo
+bloquea, se retrasan los heartbeats y Discord acaba desconectando).
+
+LoopWatchdog: una tarea del loop "late" cada `interval` segundos y un hilo
+aparte comprueba el latido. Si el loop lleva más de `threshold` segundos sin
+latir, el hilo guarda la pila de lo que se está ejecutando en el loop
+(sys._current_frames); al volver el latido se apunta cuánto duró el bloqueo.
+Se guardan los últimos bloqueos y los peores.
+
+SamplingProfiler: muestreo opcional de la pila del loop, que se enciende y
+apaga en caliente (!mai_profile) y se vuelca en formato "folded" (flamegraph.pl,
+speedscope).
+"""
+import os
+import sys
+import time
+import heapq
+import asyncio
+import logging
+import datetime
+import itertools
+import threading
+import traceback
+from collections import Counter, deque
+
+from metrics import LOOP_BLOCKS
+
+logger = logging.getLogger('LoopWatchdog')
+
+LOOP_LAG_INTERVAL = float(os.getenv('MAI_LOOP_LAG_INTERVAL', 0.1))
+# A partir de cuántos segundos sin latir se considera que algo bloquea el loop
+LOOP_BLOCK_THRESHOLD = float(os.getenv('MAI_LOOP_BLOCK_THRESHOLD', 0.25))
+LOOP_BLOCK_KEEP = int(os.getenv('MAI_LOOP_BLOCK_KEEP', 20))
+STACK_DEPTH = 25
+PROFILER_INTERVAL = float(os.getenv('MAI_PROFILER_INTERVAL', 0.005))
+# El profiler se para solo pasado este tiempo (por si nadie lo apaga)
+PROFILER_MAX_SECONDS = float(os.getenv('MAI_PROFILER_MAX_SECONDS', 600))
+
+
+class BlockEvent:
+    __slots__ = ("started_at", "duration", "stack")
+
+    def __init__(self, started_at, stack):
+        self.started_at = started_at  # datetime (UTC)
+        self.duration = None          # None mientras sigue bloqueado
+        self.stack = stack            # líneas de traceback.format_stack, la última es la más interna
+
+    @property
+    def location(self):
+        return self.stack[-1].strip().splitlines()[0] if self.stack else "?"
+
+    def format(self):
+        duration = f"{self.duration:.2f}s" if self.duration is not None else "en curso"
+        return f"[{self.started_at:%Y-%m-%d %H:%M:%S}] {duration}\n" + "".join(self.stack)
+
+    def to_dict(self):
+        return {
+            "started_at": self.started_at.isoformat(),
+            "duration": round(self.duration, 3) if self.duration is not None else None,
+            "location": self.location,
+        }
+
+
+class LoopWatchdog:
+    def __init__(self, interval=LOOP_LAG_INTERVAL, threshold=LOOP_BLOCK_THRESHOLD, keep=LOOP_BLOCK_KEEP):
+        self.interval = interval
+        self.threshold = threshold
+        self.keep = keep
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.blocks = 0
+        self.recent = deque(maxlen=keep)
+        self._worst = []             # heap (duración, secuencia, evento) con los `keep` peores
+        self._seq = itertools.count()
+        self._current = None         # bloqueo capturado por el hilo y aún sin cerrar
+        self._lock = threading.Lock()
+        self._beat_at = None
+        self._loop_thread = None
+        self._task = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        """Se llama desde el loop a vigilar."""
+        if self._task is not None and not self._task.done():
+            return
+        self._loop_thread = threading.get_ident()
+        self._beat_at = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._beat())
+        self._thread = threading.Thread(target=self._watch, name="mai-loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def _beat(self):
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.lag = max(0.0, now - start - self.interval)
+            self.max_lag = max(self.max_lag, self.lag)
+            self._beat_at = now
+            with self._lock:
+                event, self._current = self._current, None
+            # Si el hilo capturó justo cuando el loop volvía, el retraso real no llega al umbral
+            if event is not None and self.lag >= self.threshold:
+                event.duration = self.lag
+                self._record(event)
+
+    def _watch(self):
+        check = min(self.interval, self.threshold) / 2
+        while not self._stop.wait(check):
+            overdue = time.monotonic() - self._beat_at - self.interval
+            if overdue < self.threshold or self._current is not None:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            stack = traceback.format_stack(frame)[-STACK_DEPTH:]
+            del frame
+            started_at = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=overdue)
+            event = BlockEvent(started_at, stack)
+            with self._lock:
+                self._current = event
+            logger.warning(f"Event loop blocked for {overdue:.2f}s+ at: {event.location}")
+
+    def _record(self, event):
+        self.blocks += 1
+        LOOP_BLOCKS.inc()
+        self.recent.append(event)
+        entry = (event.duration, next(self._seq), event)
+        if len(self._worst) < self.keep:
+            heapq.heappush(self._worst, entry)
+        else:
+            heapq.heappushpop(self._worst, entry)
+        logger.warning(f"Event loop was blocked {event.duration:.2f}s at: {event.location}")
+
+    def worst(self, n=None):
+        events = [e for _, _, e in sorted(self._worst, key=lambda x: x[0], reverse=True)]
+        return events[:n] if n else events
+
+    def snapshot(self, n=5):
+        return {
+            "blocks": self.blocks,
+            "blocked_now": self._current.to_dict() if self._current is not None else None,
+            "worst": [e.to_dict() for e in self.worst(n)],
+        }
+
+    def report(self, n=5):
+        """Texto con los peores bloqueos y sus pilas (para !mai_profile blocks)."""
+        lines = [f"Bloqueos del event loop > {self.threshold:.2f}s: {self.blocks} "
+                 f"(retraso máximo {self.max_lag:.2f}s)"]
+        for i, event in enumerate(self.worst(n), 1):
+            lines.append(f"\n#{i} {event.format()}")
+        return "\n".join(lines)
+
+    def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+
+
+def _folded_stack(frame):
+    """Pila en formato folded: de la raíz a la hoja, separada por ';' (la hoja con número de línea)."""
+    parts = []
+    leaf = True
+    while frame is not None:
+        code = frame.f_code
+        name = f"{os.path.basename(code.co_filename)}:{code.co_name}"
+        parts.append(f"{name}:{frame.f_lineno}" if leaf else name)
+        leaf = False
+        frame = frame.f_back
+    return ";".join(reversed(parts))
+
+
+class SamplingProfiler:
+    def __init__(self, interval=PROFILER_INTERVAL, max_seconds=PROFILER_MAX_SECONDS):
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.samples = 0
+        self.started_at = None
+        self.stopped_at = None
+        self._stacks = Counter()
+        self._target = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Empieza a muestrear el hilo desde el que se llama (el del event loop)."""
+        if self.running:
+            return False
+        self._target = threading.get_ident()
+        self._stacks = Counter()
+        self.samples = 0
+        self.started_at = time.monotonic()
+        self.stopped_at = None
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, name="mai-profiler", daemon=True)
+        self._thread.start()
+        logger.info(f"Sampling profiler started ({self.interval * 1000:.0f}ms interval)")
+        return True
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            if time.monotonic() - self.started_at > self.max_seconds:
+                logger.warning(f"Sampling profiler stopped after {self.max_seconds:.0f}s")
+                break
+            frame = sys._current_frames().get(self._target)
+            if frame is None:
+                break
+            self._stacks[_folded_stack(frame)] += 1
+            self.samples += 1
+            del frame
+        self.stopped_at = time.monotonic()
+
+    def stop(self):
+        """Para el muestreo y devuelve el volcado folded ("pila cuenta" por línea)."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        logger.info(f"Sampling profiler stopped: {self.samples} samples, {len(self._stacks)} stacks")
+        return "\n".join(f"{stack} {count}" for stack, count in self._stacks.most_common()) + "\n"
+
+    def status(self):
+        if self.started_at is None:
+            return "Profiler apagado."
+        elapsed = (self.stopped_at or time.monotonic()) - self.started_at
+        state = "encendido" if self.running else "parado"
+        return f"Profiler {state}: {self.samples} muestras en {elapsed:.0f}s, {len(self._stacks)} pilas distintas."
@@ -3,13 +3,25 @@ from discord.ext import commands
 import os
 from dotenv import load_dotenv
 import logging
-from proxy_manager import get_webshare_proxy_sync
+from proxy_manager import ProxyPool
 import asyncio
+import aiohttp
 from agent_logic import AgentLogic
+from message_index import MessageIndex
+from recent_messages import RecentMessages
+from guild_snapshot import GuildSnapshots
+from channel_search import search_channels
+from message_archive import MessageArchive, ARCHIVE_ENABLED
+from export_pipeline import export_guild
+from stream_reply import StreamingReply, STREAM_REPLIES, split_message
+from mention_scheduler import MentionScheduler
+from index_jobs import IndexJobManager
+from health_server import HealthServer
+from loop_watchdog import LoopWatchdog, SamplingProfiler
+from metrics import STAGE_LATENCY
 from discord import app_commands
 import datetime
 import io
-import zipfile
 
 
 # Setup Logging
@@ -28,167 +40,280 @@ intents.members = True
 # Bot global variable (will be initialized in a function)
 bot = None
 agent = AgentLogic()
+message_index = MessageIndex()
+recent_messages = RecentMessages()
+guild_snapshots = GuildSnapshots()
+index_jobs = IndexJobManager(agent.learn_from_text)
+archive = MessageArchive() if ARCHIVE_ENABLED else None
+watchdog = LoopWatchdog()
+profiler = SamplingProfiler()
 
-# --- KOYEB/RENDER HEALTH CHECK FIX ---
-from http.server import HTTPServer, BaseHTTPRequestHandler
-import threading
-
-class SimpleHandler(BaseHTTPRequestHandler):
-    def do_GET(self):
-        self.send_response(200)
-        self.end_headers()
-        self.wfile.write(b"MAI is alive!")
-
-def run_server():
-    port = int(os.environ.get("PORT", 8000))
-    server = HTTPServer(('0.0.0.0', port), SimpleHandler)
-    server.serve_forever()
-
-# Start web server in background
-threading.Thread(target=run_server, daemon=True).start()
-# -------------------------------------
+# --- KOYEB/RENDER HEALTH CHECK ---
+# /, /healthz y /metrics se sirven desde el mismo event loop que el bot (ver start_bot)
 
 def setup_bot_events(bot_instance):
     @bot_instance.event
     async def on_ready():
         logger.info(f'Logged in as {bot_instance.user} (ID: {bot_instance.user.id})')
         logger.info('MAI is ready to serve.')
+        scheduler.start()
+        index_jobs.resume(bot_instance)
+        if archive:
+            archive.mark_resumed()  # on_ready también llega tras reconectar con una sesión nueva
+        for guild in bot_instance.guilds:
+            if archive:
+                asyncio.create_task(sync_guild(guild))
+            else:
+                asyncio.create_task(message_index.backfill(guild))
+
+    async def sync_guild(guild):
+        # El archivo cubre los canales legibles: el índice en memoria solo se rellena
+        # con los que no haya podido sincronizar (así no se pide cada historial dos veces)
+        failed = await archive.backfill(guild)
+        if failed:
+            await message_index.backfill(guild, channels=failed)
+
+    @bot_instance.event
+    async def on_disconnect():
+        if archive:
+            archive.mark_disconnected()
+
+    @bot_instance.event
+    async def on_resumed():
+        # Volver a sincronizar el delta perdido mientras estábamos desconectados
+        if archive:
+            archive.mark_resumed()
+            for guild in bot_instance.guilds:
+                asyncio.create_task(sync_guild(guild))
+
+    @bot_instance.event
+    async def on_message_edit(before, after):
+        message_index.update(after)
+        recent_messages.update(after)
+        if archive:
+            archive.update(after)
+
+    @bot_instance.event
+    async def on_raw_message_delete(payload):
+        message_index.remove(payload.guild_id, payload.message_id)
+        recent_messages.remove(payload.channel_id, payload.message_id)
+        if archive:
+            archive.remove(payload.message_id)
+
+    @bot_instance.event
+    async def on_raw_bulk_message_delete(payload):
+        for message_id in payload.message_ids:
+            message_index.remove(payload.guild_id, message_id)
+            recent_messages.remove(payload.channel_id, message_id)
+            if archive:
+                archive.remove(message_id)
+
+    @bot_instance.event
+    async def on_guild_channel_delete(channel):
+        message_index.drop_channel(channel.guild.id, channel.id)
+        recent_messages.drop_channel(channel.id)
+        guild_snapshots.invalidate(channel.guild.id)
+
+    # La foto de canales legibles solo cambia con canales, roles o permisos de MAI
+    @bot_instance.event
+    async def on_guild_channel_create(channel):
+        guild_snapshots.invalidate(channel.guild.id)
+
+    @bot_instance.event
+    async def on_guild_channel_update(before, after):
+        guild_snapshots.invalidate(after.guild.id)
+
+    @bot_instance.event
+    async def on_guild_role_create(role):
+        guild_snapshots.invalidate(role.guild.id)
+
+    @bot_instance.event
+    async def on_guild_role_update(before, after):
+        guild_snapshots.invalidate(after.guild.id)
+
+    @bot_instance.event
+    async def on_guild_role_delete(role):
+        guild_snapshots.invalidate(role.guild.id)
+
+    @bot_instance.event
+    async def on_member_update(before, after):
+        if after.id == bot_instance.user.id and before.roles != after.roles:
+            guild_snapshots.invalidate(after.guild.id)
+
+    @bot_instance.event
+    async def on_guild_update(before, after):
+        guild_snapshots.invalidate(after.id)
+
+    @bot_instance.event
+    async def on_guild_remove(guild):
+        guild_snapshots.invalidate(guild.id)
+
+    # --- ADMIN COMMAND: !export ---
+    async def handle_export(message):
+        if message.author.name != "technologiescv":
+            await message.reply("⛔ No tienes permisos para usar este comando.")
+            return
+
+        # Parse days
+        days = 7
+        try:
+            import re
+            match = re.search(r'days:(\d+)', message.content)
+            if match:
+                days = int(match.group(1))
+        except:
+            pass
+
+        status_msg = await message.reply(f"⏳ **Exportando logs de los últimos {days} días...**")
+
+        try:
+            # Run export logic (streaming, compresión fuera del event loop)
+            cutoff_date = datetime.datetime.now() - datetime.timedelta(days=days)
+
+            async def export_progress(done, total, count):
+                await status_msg.edit(content=f"⏳ **Exportando logs de los últimos {days} días...** {done}/{total} canales · {count} mensajes")
+
+            snapshot = guild_snapshots.get(message.guild)
+            result = await export_guild(message.guild, cutoff_date, archive=archive, progress=export_progress, channels=snapshot.history_readable)
+            try:
+                if result.total_messages == 0:
+                    await message.author.send(f"⚠️ No se encontraron mensajes.")
+                    await status_msg.edit(content=f"⚠️ Proceso terminado. No había mensajes.")
+                else:
+                    base_name = f"chat_logs_{message.guild.name}_{datetime.datetime.now().strftime('%Y%m%d')}"
+                    total_parts = len(result.parts)
+                    for i, part in enumerate(result.parts, 1):
+                        if total_parts == 1:
+                            file_obj = discord.File(part, filename=f"{base_name}.zip")
+                            await message.author.send(content=f"✅ **Exportación completada**", file=file_obj)
+                        else:
+                            file_obj = discord.File(part, filename=f"{base_name}_part{i}.zip")
+                            await message.author.send(content=f"✅ **Exportación completada** (parte {i}/{total_parts})", file=file_obj)
+                    await status_msg.edit(content=f"✅ **Exportación enviada a tus MD.** ({result.total_messages} mensajes)")
+            finally:
+                result.close()
+        except Exception as e:
+            logger.error(f"Export failed: {e}")
+            await message.reply(f"❌ Error: {e}")
+
+    async def handle_mention(message):
+        with STAGE_LATENCY.time("mention"):
+            await _handle_mention(message)
+
+    async def _handle_mention(message):
+        async with message.channel.typing():
+            logger.info(f"MAI mentioned by {message.author} in {message.channel}")
+
+            # Historial reciente desde el buffer del gateway (sin REST salvo en frío)
+            with STAGE_LATENCY.time("history"):
+                recent_history = await recent_messages.context_for(message)
+            chat_context = "\n".join([f"[{m.created_at.strftime('%Y-%m-%d %H:%M')}] {m.author_name}: {m.content}" for m in recent_history])
+            is_ticket_context = 'ticket' in message.channel.name.lower()
+            current_channel_name = message.channel.name
+            snapshot = guild_snapshots.get(message.guild)
+
+            # Search Functionality
+            async def search_memory(query, target_channel="ALL"):
+                with STAGE_LATENCY.time("search"):
+                    return await _search_memory(query, target_channel)
+
+            async def _search_memory(query, target_channel):
+                is_current_channel = target_channel.lower() == current_channel_name.lower()
+                if is_current_channel and (query == "*" or not query.strip()):
+                    if chat_context: return f"[Historial reciente #{current_channel_name}]\n{chat_context}"
+                    else: return f"AVISO: #{current_channel_name} está vacío."
+
+                search_scope = snapshot.search_scope(target_channel)
+
+                # 1) Archivo SQLite (ranking bm25), 2) índice en memoria, 3) REST
+                results = []
+                missing = [c.id for c in search_scope]
+                if archive:
+                    archived, missing = await archive.search(query, missing, limit=25)
+                    results = [r.format() for r in archived]
+                if missing and len(results) < 25:
+                    indexed, missing = message_index.guild(message.guild.id).search(query, missing, limit=25 - len(results))
+                    results.extend(r.format() for r in indexed)
+
+                # Fallback REST (concurrente) solo para canales que aún no están indexados
+                pending_channels = [c for c in search_scope if c.id in missing]
+                if pending_channels and len(results) < 25:
+                    fetched = await search_channels(pending_channels, query, limit=25 - len(results))
+                    results.extend(r.format() for r in fetched)
+                return "\n".join(results) if results else "No se encontraron mensajes."
+
+            # Agent call
+            status_m = None
+            async def show_s(text):
+                nonlocal status_m
+                if status_m: await status_m.edit(content=text)
+                else: status_m = await message.channel.send(text)
+
+            async def add_r(emoji): await message.add_reaction(emoji)
+
+            # Respuesta progresiva: se publica en cuanto hay texto y se va editando
+            stream = StreamingReply(message) if STREAM_REPLIES else None
+
+            response = await agent.process_query(
+                query=message.content.replace(f'<@{bot_instance.user.id}>', '').strip(),
+                user_name=message.author.name,
+                available_channels=snapshot.channel_lines,
+                server_stats=snapshot.server_stats,
+                is_ticket=is_ticket_context,
+                chat_history=chat_context,
+                search_tool=search_memory,
+                current_channel=current_channel_name,
+                channel_id=message.channel.id,
+                status_callback=show_s,
+                reaction_callback=add_r,
+                stream_callback=stream.update if stream else None,
+                system_prefix=snapshot.prompt_prefix(agent.render_system_prefix)
+            )
+
+            if status_m: await status_m.delete()
+
+            if "REACT:" in response:
+                try:
+                    parts = response.rsplit("REACT:", 1)
+                    response = parts[0].strip()
+                    emoji = parts[1].strip().split()[0]
+                    await add_r(emoji)
+                except: pass
+
+            response = response.replace("meulify.com", "meulify.top")
+            with STAGE_LATENCY.time("reply"):
+                if stream:
+                    await stream.finish(response + "\n\n-# *Respuesta generada por IA.*")
+                else:
+                    await message.reply(response + "\n\n-# *Respuesta generada por IA.*")
+
+    # Cola acotada con workers fijos: los tickets van primero y una petición por usuario
+    scheduler = MentionScheduler(handle_mention)
+    bot_instance.mention_scheduler = scheduler
 
     @bot_instance.event
     async def on_message(message):
+        message_index.ingest(message)
+        recent_messages.ingest(message)
+        if archive:
+            archive.ingest(message)
         if message.author == bot_instance.user:
             return
 
         # Check if bot is mentioned
         if bot_instance.user.mentioned_in(message) and not message.mention_everyone:
-            async with message.channel.typing():
-                logger.info(f"MAI mentioned by {message.author} in {message.channel}")
-
-                # --- ADMIN COMMAND: !export ---
-                if "!export" in message.content:
-                    if message.author.name != "technologiescv":
-                        await message.reply("⛔ No tienes permisos para usar este comando.")
-                        return
-
-                    # Parse days
-                    days = 7
-                    try:
-                        import re
-                        match = re.search(r'days:(\d+)', message.content)
-                        if match:
-                            days = int(match.group(1))
-                    except:
-                        pass
-
-                    status_msg = await message.reply(f"⏳ **Exportando logs de los últimos {days} días...**")
-                    
-                    try:
-                        # Run export logic
-                        cutoff_date = datetime.datetime.now() - datetime.timedelta(days=days)
-                        zip_buffer = io.BytesIO()
-                        start_time = datetime.datetime.now()
-                        channels_processed = 0
-                        total_messages = 0
-
-                        with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
-                            for channel in message.guild.text_channels:
-                                if not channel.permissions_for(message.guild.me).read_messages: continue
-                                if not channel.permissions_for(message.guild.me).read_message_history: continue
-
-                                channels_processed += 1
-                                messages_data = []
-                                try:
-                                    async for msg in channel.history(after=cutoff_date, limit=None, oldest_first=True):
-                                        timestamp = msg.created_at.strftime('%Y-%m-%d %H:%M:%S')
-                                        content = f"[{timestamp}] {msg.author.name}: {msg.content}"
-                                        messages_data.append(content)
-                                        total_messages += 1
-
-                                    if messages_data:
-                                        zip_file.writestr(f"{channel.name}.txt", "\n".join(messages_data))
-                                except Exception as e:
-                                    zip_file.writestr(f"ERRORS/{channel.name}_error.txt", str(e))
-
-                        zip_buffer.seek(0)
-                        if total_messages == 0:
-                            await message.author.send(f"⚠️ No se encontraron mensajes.")
-                            await status_msg.edit(content=f"⚠️ Proceso terminado. No había mensajes.")
-                        else:
-                            filename = f"chat_logs_{message.guild.name}_{datetime.datetime.now().strftime('%Y%m%d')}.zip"
-                            file_obj = discord.File(zip_buffer, filename=filename)
-                            await message.author.send(content=f"✅ **Exportación completada**", file=file_obj)
-                            await status_msg.edit(content=f"✅ **Exportación enviada a tus MD.**")
-                    except Exception as e:
-                        logger.error(f"Export failed: {e}")
-                        await message.reply(f"❌ Error: {e}")
-                    return
-
-                # Fetch recent history
-                recent_history = [msg async for msg in message.channel.history(limit=5)]
-                recent_history.reverse()
-                recent_history = [m for m in recent_history if m.id != message.id]
-                chat_context = "\n".join([f"[{m.created_at.strftime('%Y-%m-%d %H:%M')}] {m.author.name}: {m.content}" for m in recent_history])
-                is_ticket_context = 'ticket' in message.channel.name.lower()
-                current_channel_name = message.channel.name
-
-                # Search Functionality
-                async def search_memory(query, target_channel="ALL"):
-                    results = []
-                    is_current_channel = target_channel.lower() == current_channel_name.lower()
-                    if is_current_channel and (query == "*" or not query.strip()):
-                        if chat_context: return f"[Historial reciente #{current_channel_name}]\n{chat_context}"
-                        else: return f"AVISO: #{current_channel_name} está vacío."
-                    
-                    search_scope = message.guild.text_channels if target_channel == "ALL" else [c for c in message.guild.text_channels if c.name.lower() == target_channel.lower()]
-                    
-                    for channel in search_scope:
-                        if not channel.permissions_for(message.guild.me).read_messages: continue
-                        try:
-                            async for msg in channel.history(limit=50):
-                                if query == "*" or (query.lower() in msg.content.lower()):
-                                    if not msg.author.bot:
-                                        results.append(f"[{msg.created_at.strftime('%Y-%m-%d %H:%M')}] [{msg.channel.name}] {msg.author.name}: {msg.content}")
-                                if len(results) >= 25: break
-                        except: pass
-                    return "\n".join(results) if results else "No se encontraron mensajes."
-
-                # Agent call
-                # Prepare channel list and stats
-                channel_names = [f"{c.name} (<#{c.id}>)" for c in message.guild.text_channels if c.permissions_for(message.guild.me).read_messages]
-                
-                status_m = None
-                async def show_s(text):
-                    nonlocal status_m
-                    if status_m: await status_m.edit(content=text)
-                    else: status_m = await message.channel.send(text)
-                
-                async def add_r(emoji): await message.add_reaction(emoji)
-
-                response = await agent.process_query(
-                    query=message.content.replace(f'<@{bot_instance.user.id}>', '').strip(),
-                    user_name=message.author.name,
-                    available_channels=channel_names,
-                    server_stats={"Server": message.guild.name},
-                    is_ticket=is_ticket_context,
-                    chat_history=chat_context,
-                    search_tool=search_memory,
-                    current_channel=current_channel_name,
-                    status_callback=show_s,
-                    reaction_callback=add_r
-                )
-                
-                if status_m: await status_m.delete()
-                
-                if "REACT:" in response:
-                    try:
-                        parts = response.rsplit("REACT:", 1)
-                        response = parts[0].strip()
-                        emoji = parts[1].strip().split()[0]
-                        await add_r(emoji)
-                    except: pass
-                
-                response = response.replace("meulify.com", "meulify.top")
-                await message.reply(response + "\n\n-# *Respuesta generada por IA.*")
+            if "!export" in message.content:
+                async with message.channel.typing():
+                    logger.info(f"MAI mentioned by {message.author} in {message.channel}")
+                    await handle_export(message)
+                return
+
+            is_ticket_context = 'ticket' in message.channel.name.lower()
+            status = scheduler.submit(message, priority=0 if is_ticket_context else 1)
+            if status == "busy":
+                await message.reply("🥵 Uf, ahora mismo estoy a tope de preguntas. Dame un minutillo y vuelve a mencionarme, porfa.")
+            elif status == "duplicate":
+                await message.reply("⏳ Tranqui, sigo con tu pregunta anterior. ¡Ahora te respondo!")
 
         await bot_instance.process_commands(message)
 
@@ -199,16 +324,41 @@ def setup_bot_events(bot_instance):
         if not channel:
             await ctx.send("Channel not found.")
             return
-        await ctx.send(f"Indexing {channel.name}...")
-        messages = []
-        async for msg in channel.history(limit=500):
-            if not msg.author.bot and len(msg.content) > 10:
-                messages.append(f"User: {msg.content}")
-        if messages:
-            agent.learn_from_text(messages, source=f"channel_{channel.name}")
-            await ctx.send(f"Indexed {len(messages)} messages.")
+        # Se indexa en segundo plano (todo el historial, con checkpoint por canal)
+        job = index_jobs.submit(channel)
+        await ctx.send(f"Indexing {channel.name} in the background ({job.state}). Use `!mai_index_status` to follow it.")
+
+    @bot_instance.command()
+    @commands.has_permissions(administrator=True)
+    async def index_status(ctx):
+        for chunk in split_message(index_jobs.status()):
+            await ctx.send(chunk)
+
+    @bot_instance.command()
+    @commands.has_permissions(administrator=True)
+    async def profile(ctx, action: str = "status"):
+        # !mai_profile start|stop|status|blocks
+        action = action.lower()
+        if action == "start":
+            started = profiler.start()
+            await ctx.send("🔬 Profiler encendido. Usa `!mai_profile stop` para descargar el resultado." if started else profiler.status())
+        elif action == "stop":
+            if profiler.started_at is None:
+                await ctx.send(profiler.status())
+                return
+            dump = profiler.stop()
+            filename = f"mai_profile_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.folded"
+            await ctx.send(content=profiler.status(), file=discord.File(io.BytesIO(dump.encode("utf-8")), filename=filename))
+        elif action == "blocks":
+            report = watchdog.report()
+            await ctx.send(content=f"🐢 {watchdog.blocks} bloqueos del event loop", file=discord.File(io.BytesIO(report.encode("utf-8")), filename="mai_loop_blocks.txt"))
         else:
-            await ctx.send("No valid messages found.")
+            await ctx.send(f"{profiler.status()}\n🐢 Bloqueos del loop: {watchdog.blocks} (retraso máximo {watchdog.max_lag:.2f}s)")
+
+async def close_scheduler(bot_instance):
+    scheduler = getattr(bot_instance, "mention_scheduler", None)
+    if scheduler is not None:
+        await scheduler.close()
 
 async def start_bot():
     global bot
@@ -218,29 +368,55 @@ async def start_bot():
 
     max_retries = 5
     retry_delay = 5
+    proxy_pool = ProxyPool()
+    health = HealthServer(
+        get_bot=lambda: bot,
+        agent=agent,
+        scheduler_stats=lambda: bot.mention_scheduler.stats() if bot is not None and hasattr(bot, "mention_scheduler") else None,
+        watchdog=watchdog,
+    )
+    await health.start()
 
-    for attempt in range(max_retries):
-        try:
-            proxy_url = get_webshare_proxy_sync()
-            logger.info(f"Starting bot (Attempt {attempt+1}/{max_retries}, Proxy: {'Enabled' if proxy_url else 'Disabled'})...")
-            
-            # Re-initialize bot with fresh proxy if it's the second attempt or more
-            # (First attempt also initializes it)
-            bot = commands.Bot(command_prefix='!mai_', intents=intents, proxy=proxy_url)
-            
-            # Setup events and commands for the new bot instance
-            setup_bot_events(bot)
-            
-            await bot.start(TOKEN)
-            break # Success!
-        except (aiohttp.ClientError, discord.HTTPException, asyncio.TimeoutError) as e:
-            logger.error(f"Connection error (Attempt {attempt+1}): {e}")
-            if attempt < max_retries - 1:
-                wait_time = retry_delay * (attempt + 1)
-                logger.info(f"Retrying in {wait_time}s...")
-                await asyncio.sleep(wait_time)
-            else:
-                logger.critical("Max retries reached. Could not connect to Discord.")
+    try:
+        for attempt in range(max_retries):
+            proxy_url = None
+            try:
+                proxy_url = await proxy_pool.best()
+                logger.info(f"Starting bot (Attempt {attempt+1}/{max_retries}, Proxy: {'Enabled' if proxy_url else 'Disabled'})...")
+                
+                # Re-initialize bot with fresh proxy if it's the second attempt or more
+                # (First attempt also initializes it)
+                bot = commands.Bot(command_prefix='!mai_', intents=intents, proxy=proxy_url)
+                
+                # Setup events and commands for the new bot instance
+                setup_bot_events(bot)
+                
+                await bot.start(TOKEN)
+                break # Success!
+            except (aiohttp.ClientError, discord.HTTPException, asyncio.TimeoutError) as e:
+                logger.error(f"Connection error (Attempt {attempt+1}): {e}")
+                # Si fallaba a través de un proxy, ese no se vuelve a usar en un rato
+                proxy_pool.quarantine(proxy_url)
+                if bot is not None and not bot.is_closed():
+                    await bot.close()
+                # Los workers de este intento tienen referencias al bot cerrado
+                await close_scheduler(bot)
+                if attempt < max_retries - 1:
+                    wait_time = retry_delay * (attempt + 1)
+                    logger.info(f"Retrying in {wait_time}s...")
+                    await asyncio.sleep(wait_time)
+                else:
+                    logger.critical("Max retries reached. Could not connect to Discord.")
+    finally:
+        await close_scheduler(bot)
+        if profiler.running:
+            profiler.stop()
+        await health.close()
+        await proxy_pool.close()
+        await index_jobs.close()
+        await agent.aclose()
+        if archive:
+            await archive.close()
 
 if __name__ == '__main__':
     try:
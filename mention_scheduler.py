@@ -0,0 +1,83 @@
+# mention_scheduler.py
+"""
+Cola de menciones con prioridad y backpressure.
+Un número fijo de workers atiende las menciones; los tickets van primero,
+cada usuario tiene como mucho una petición en curso y, si la cola está
+llena, se responde enseguida que estamos ocupados en vez de acumular trabajo.
+"""
+import os
+import asyncio
+import itertools
+import logging
+
+logger = logging.getLogger('MentionScheduler')
+
+WORKERS = int(os.getenv('MAI_WORKERS', 4))
+QUEUE_SIZE = int(os.getenv('MAI_QUEUE_SIZE', 50))
+
+
+class MentionScheduler:
+    def __init__(self, handler, workers=WORKERS, maxsize=QUEUE_SIZE):
+        self.handler = handler
+        self.workers = workers
+        self._queue = asyncio.PriorityQueue(maxsize=maxsize)
+        self._seq = itertools.count()  # FIFO dentro de la misma prioridad
+        self._users = set()            # usuarios con una petición en cola o en curso
+        self._tasks = []
+        self.processed = 0
+        self.rejected_busy = 0
+        self.rejected_duplicate = 0
+
+    def start(self):
+        """Arranca los workers (idempotente: on_ready puede dispararse varias veces)."""
+        self._tasks = [t for t in self._tasks if not t.done()]
+        for i in range(len(self._tasks), self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(i)))
+
+    def submit(self, message, priority=1):
+        """Encola una mención. Devuelve "queued", "duplicate" o "busy" (0 = más prioritario)."""
+        user_id = message.author.id
+        if user_id in self._users:
+            self.rejected_duplicate += 1
+            return "duplicate"
+        try:
+            self._queue.put_nowait((priority, next(self._seq), message))
+        except asyncio.QueueFull:
+            self.rejected_busy += 1
+            logger.warning(f"Mention queue full ({self._queue.qsize()}), shedding request from {message.author}")
+            return "busy"
+        self._users.add(user_id)
+        return "queued"
+
+    async def _worker(self, number):
+        while True:
+            priority, _, message = await self._queue.get()
+            try:
+                await self.handler(message)
+            except Exception as e:
+                logger.error(f"Worker {number} failed handling mention from {message.author}: {e}")
+            finally:
+                self._users.discard(message.author.id)
+                self.processed += 1
+                self._queue.task_done()
+
+    async def close(self):
+        """Para los workers y descarta lo que quede en cola (p. ej. antes de reintentar con otro bot)."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        while not self._queue.empty():
+            self._queue.get_nowait()
+            self._queue.task_done()
+        self._users.clear()
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize(),
+            "in_flight": len(self._users) - self._queue.qsize(),
+            "workers": self.workers,
+            "processed": self.processed,
+            "rejected_busy": self.rejected_busy,
+            "rejected_duplicate": self.rejected_duplicate,
+        }
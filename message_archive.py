@@ -0,0 +1,316 @@
+# message_archive.py
+"""
+Archivo persistente de mensajes del servidor en SQLite (FTS5).
+Guarda un high-water mark por canal para que, tras un reinicio, solo se
+descargue el delta. Sirve búsquedas ordenadas por relevancia (bm25) y las
+exportaciones de !export sin paginar la API de Discord.
+"""
+import os
+import asyncio
+import datetime
+import logging
+import sqlite3
+import threading
+import time
+
+import discord
+
+from message_index import MessageRecord
+from text_utils import tokenize
+
+logger = logging.getLogger('MessageArchive')
+
+ARCHIVE_PATH = os.getenv('MAI_ARCHIVE_PATH', 'mai_archive.db')
+ARCHIVE_ENABLED = os.getenv('MAI_ARCHIVE', '1') != '0'
+BACKFILL_DAYS = int(os.getenv('MAI_ARCHIVE_BACKFILL_DAYS', 30))
+BACKFILL_CONCURRENCY = int(os.getenv('MAI_ARCHIVE_CONCURRENCY', 4))
+FLUSH_INTERVAL = float(os.getenv('MAI_ARCHIVE_FLUSH_SECONDS', 1.0))
+FLUSH_BATCH = int(os.getenv('MAI_ARCHIVE_FLUSH_BATCH', 200))
+# Un corte del gateway más corto que esto no saca los canales de las búsquedas mientras se recupera el hueco
+RESYNC_GRACE = float(os.getenv('MAI_ARCHIVE_RESYNC_GRACE', 300))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    guild_id INTEGER NOT NULL,
+    channel_id INTEGER NOT NULL,
+    channel_name TEXT NOT NULL,
+    author_name TEXT NOT NULL,
+    author_bot INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    content TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_channel ON messages(channel_id, id);
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    content, content='messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_au AFTER UPDATE ON messages BEGIN
+    INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+END;
+CREATE TABLE IF NOT EXISTS watermarks (
+    channel_id INTEGER PRIMARY KEY,
+    guild_id INTEGER NOT NULL,
+    last_message_id INTEGER NOT NULL,
+    complete_since REAL NOT NULL
+);
+"""
+
+_UPSERT_SQL = """
+INSERT INTO messages (id, guild_id, channel_id, channel_name, author_name, author_bot, created_at, content)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(id) DO UPDATE SET content = excluded.content, channel_name = excluded.channel_name
+"""
+
+
+def _row(message):
+    return (
+        message.id, message.guild.id, message.channel.id, getattr(message.channel, "name", ""),
+        message.author.name, int(message.author.bot), message.created_at.timestamp(), message.content or "",
+    )
+
+
+def _record(row):
+    id, channel_id, channel_name, author_name, author_bot, created_at, content = row
+    created = datetime.datetime.fromtimestamp(created_at, tz=datetime.timezone.utc)
+    return MessageRecord(id, channel_id, channel_name, author_name, bool(author_bot), created, content)
+
+
+def _fts_query(query):
+    """Convierte la consulta en una expresión FTS5 segura (prefijos, AND implícito)."""
+    tokens = tokenize(query)
+    return " ".join(f'"{t}"*' for t in tokens) if tokens else None
+
+
+class MessageArchive:
+    """Archivo SQLite con ingesta en lotes. Todo acceso a la BD ocurre en un hilo aparte."""
+
+    def __init__(self, path=ARCHIVE_PATH):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+            self._watermarks = {
+                row[0]: (row[1], row[2])
+                for row in self._conn.execute("SELECT channel_id, last_message_id, complete_since FROM watermarks")
+            }
+        self._pending = []      # operaciones de ingesta en vivo pendientes de escribir
+        self._synced = set()    # canales al día en esta sesión del gateway
+        self._stale = set()     # estaban al día antes de un corte breve; falta recuperar el hueco
+        self._disconnected_at = None
+        self._flusher = None
+        self._wake = None
+
+    # ---------- Escritura ----------
+
+    def _write(self, ops, watermark_updates=()):
+        with self._lock, self._conn:
+            for op, payload in ops:
+                if op == "upsert":
+                    self._conn.execute(_UPSERT_SQL, payload)
+                else:
+                    self._conn.execute("DELETE FROM messages WHERE id = ?", (payload,))
+            for channel_id, guild_id, last_id, complete_since in watermark_updates:
+                self._conn.execute(
+                    "INSERT INTO watermarks (channel_id, guild_id, last_message_id, complete_since) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(channel_id) DO UPDATE SET last_message_id = MAX(last_message_id, excluded.last_message_id)",
+                    (channel_id, guild_id, last_id, complete_since),
+                )
+
+    def _advance(self, channel_id, guild_id, last_id, complete_since=None):
+        """Devuelve la actualización de watermark (y actualiza la caché en memoria)."""
+        previous = self._watermarks.get(channel_id)
+        since = previous[1] if previous else complete_since
+        last_id = max(last_id, previous[0]) if previous else last_id
+        self._watermarks[channel_id] = (last_id, since)
+        return (channel_id, guild_id, last_id, since)
+
+    def _ensure_flusher(self):
+        if self._flusher is None or self._flusher.done():
+            self._wake = asyncio.Event()
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    def _enqueue(self, op, payload):
+        self._pending.append((op, payload))
+        self._ensure_flusher()
+        if len(self._pending) >= FLUSH_BATCH:
+            self._wake.set()
+
+    def ingest(self, message):
+        if message.guild is None:
+            return
+        self._enqueue("upsert", _row(message))
+
+    def update(self, message):
+        if message.guild is None:
+            return
+        self._enqueue("upsert", _row(message))
+
+    def remove(self, message_id):
+        self._enqueue("delete", message_id)
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Escribe en una sola transacción todo lo recibido por el gateway."""
+        if not self._pending:
+            return
+        ops, self._pending = self._pending, []
+        # Solo avanzamos el watermark en canales sincronizados (sin huecos en esta sesión)
+        latest = {}
+        for op, payload in ops:
+            if op == "upsert" and payload[2] in self._synced:
+                latest[payload[2]] = (payload[1], max(payload[0], latest.get(payload[2], (0, 0))[1]))
+        updates = [self._advance(cid, gid, last_id) for cid, (gid, last_id) in latest.items()]
+        try:
+            await asyncio.to_thread(self._write, ops, updates)
+        except Exception as e:
+            logger.error(f"Archive flush failed ({len(ops)} ops): {e}")
+
+    def mark_disconnected(self):
+        """
+        Tras perder la sesión del gateway puede haber huecos. Los canales al día pasan a
+        pendientes: su watermark deja de avanzar hasta que backfill_channel recupera el hueco
+        (solo el delta desde el watermark), pero mientras tanto se siguen buscando.
+        """
+        if self._disconnected_at is None:
+            self._disconnected_at = time.monotonic()
+        self._stale |= self._synced
+        self._synced.clear()
+
+    def mark_resumed(self):
+        """Vuelve la sesión. Si el corte pasó de RESYNC_GRACE, el hueco puede ser grande y los
+        canales pendientes no se buscan hasta que terminen de sincronizar."""
+        if self._disconnected_at is not None and time.monotonic() - self._disconnected_at > RESYNC_GRACE:
+            self._stale.clear()
+        self._disconnected_at = None
+
+    # ---------- Backfill ----------
+
+    async def backfill_channel(self, channel):
+        """Descarga solo los mensajes posteriores al high-water mark del canal."""
+        watermark = self._watermarks.get(channel.id)
+        if watermark:
+            after = discord.Object(id=watermark[0])
+            complete_since = watermark[1]
+        else:
+            after = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=BACKFILL_DAYS)
+            complete_since = after.timestamp()
+
+        batch = []
+        total = 0
+        async for msg in channel.history(after=after, limit=None, oldest_first=True):
+            batch.append(("upsert", _row(msg)))
+            if len(batch) >= 500:
+                update = self._advance(channel.id, channel.guild.id, batch[-1][1][0], complete_since)
+                await asyncio.to_thread(self._write, batch, [update])
+                total += len(batch)
+                batch = []
+        last_id = batch[-1][1][0] if batch else (watermark[0] if watermark else 0)
+        update = self._advance(channel.id, channel.guild.id, last_id, complete_since)
+        await asyncio.to_thread(self._write, batch, [update])
+        self._synced.add(channel.id)
+        self._stale.discard(channel.id)
+        return total + len(batch)
+
+    async def backfill(self, guild):
+        """Sincroniza los canales legibles del servidor. Devuelve los canales que fallaron."""
+        semaphore = asyncio.Semaphore(BACKFILL_CONCURRENCY)
+        counts = {}
+        failed = []
+
+        async def run(channel):
+            async with semaphore:
+                try:
+                    counts[channel.id] = await self.backfill_channel(channel)
+                except Exception as e:
+                    failed.append(channel)
+                    logger.warning(f"Archive backfill failed for #{channel.name}: {e}")
+
+        channels = []
+        for channel in guild.text_channels:
+            perms = channel.permissions_for(guild.me)
+            if perms.read_messages and perms.read_message_history:
+                channels.append(channel)
+        await asyncio.gather(*(run(c) for c in channels))
+        logger.info(f"Archive synced for {guild.name}: {len(counts)} channels, {sum(counts.values())} new messages")
+        return failed
+
+    # ---------- Lectura ----------
+
+    def is_archived(self, channel_id):
+        """True si el canal está al día en esta sesión (un watermark de otra ejecución no basta:
+        lo publicado con el bot apagado no está hasta que termina el backfill del delta).
+        Tras un corte breve del gateway el canal sigue contando mientras se recupera el hueco."""
+        return channel_id in self._synced or channel_id in self._stale
+
+    def covers(self, channel_id, since):
+        """True si el archivo tiene el canal completo desde `since` (datetime) hasta ahora."""
+        watermark = self._watermarks.get(channel_id)
+        return bool(watermark) and channel_id in self._synced and watermark[1] <= since.timestamp()
+
+    def _search(self, query, channel_ids, limit):
+        marks = ",".join("?" * len(channel_ids))
+        columns = "m.id, m.channel_id, m.channel_name, m.author_name, m.author_bot, m.created_at, m.content"
+        with self._lock:
+            if query == "*" or not query.strip():
+                rows = self._conn.execute(
+                    f"SELECT {columns} FROM messages m WHERE m.channel_id IN ({marks}) AND m.author_bot = 0 "
+                    f"ORDER BY m.id DESC LIMIT ?", (*channel_ids, limit),
+                ).fetchall()
+            else:
+                rows = self._conn.execute(
+                    f"SELECT {columns} FROM messages_fts f JOIN messages m ON m.id = f.rowid "
+                    f"WHERE messages_fts MATCH ? AND m.channel_id IN ({marks}) AND m.author_bot = 0 "
+                    f"ORDER BY bm25(messages_fts), m.id DESC LIMIT ?", (_fts_query(query), *channel_ids, limit),
+                ).fetchall()
+        return [_record(r) for r in rows]
+
+    async def search(self, query, channel_ids, limit=25):
+        """Búsqueda ordenada por relevancia. Devuelve (registros, canales_no_archivados)."""
+        archived = [c for c in channel_ids if self.is_archived(c)]
+        missing = [c for c in channel_ids if not self.is_archived(c)]
+        if not archived or (query != "*" and query.strip() and _fts_query(query) is None):
+            return [], channel_ids
+        await self.flush()
+        records = await asyncio.to_thread(self._search, query, archived, limit)
+        return records, missing
+
+    def _export(self, channel_id, since_ts):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT created_at, author_name, content FROM messages WHERE channel_id = ? AND created_at > ? ORDER BY id",
+                (channel_id, since_ts),
+            ).fetchall()
+        return [
+            f"[{datetime.datetime.fromtimestamp(ts, tz=datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S')}] {author}: {content}"
+            for ts, author, content in rows
+        ]
+
+    async def export_lines(self, channel_id, since):
+        """Líneas de exportación del canal desde `since`, en el mismo formato que !export."""
+        await self.flush()
+        return await asyncio.to_thread(self._export, channel_id, since.timestamp())
+
+    async def close(self):
+        if self._flusher:
+            self._flusher.cancel()
+        await self.flush()
+        with self._lock:
+            self._conn.close()
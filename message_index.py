@@ -0,0 +1,248 @@
+# message_index.py
+"""
+Índice en memoria de los mensajes de cada servidor.
+Se alimenta de los eventos del gateway (on_message / edit / delete) y de un
+backfill inicial, para que SEARCH no tenga que pedir channel.history por REST.
+"""
+import os
+import logging
+from collections import OrderedDict, deque
+
+from text_utils import fold_accents, tokenize
+
+logger = logging.getLogger('MessageIndex')
+
+
+class MessageRecord:
+    """Copia compacta de un mensaje (sin referencias a discord.Message)."""
+    __slots__ = ("id", "channel_id", "channel_name", "author_name", "author_bot", "created_at", "content", "folded")
+
+    def __init__(self, id, channel_id, channel_name, author_name, author_bot, created_at, content):
+        self.id = id
+        self.channel_id = channel_id
+        self.channel_name = channel_name
+        self.author_name = author_name
+        self.author_bot = author_bot
+        self.created_at = created_at
+        self.content = content
+        self.folded = fold_accents(content)  # sin tildes ni mayúsculas, para comparar en las búsquedas
+
+    @classmethod
+    def from_message(cls, message):
+        return cls(
+            message.id,
+            message.channel.id,
+            getattr(message.channel, "name", ""),
+            message.author.name,
+            message.author.bot,
+            message.created_at,
+            message.content or "",
+        )
+
+    def format(self):
+        """Formato usado en los resultados de SEARCH."""
+        return f"[{self.created_at.strftime('%Y-%m-%d %H:%M')}] [{self.channel_name}] {self.author_name}: {self.content}"
+
+
+class GuildMessageIndex:
+    """Índice invertido de tokens para un servidor, con retención acotada por canal y LRU de canales."""
+
+    def __init__(self, per_channel_limit, max_channels):
+        self.per_channel_limit = per_channel_limit
+        self.max_channels = max_channels
+        self._channels = OrderedDict()  # channel_id -> deque[message_id] (orden LRU)
+        self._messages = {}             # message_id -> MessageRecord
+        self._postings = {}             # token -> set[message_id]
+        self._indexed = set()           # canales con backfill completo
+
+    def __len__(self):
+        return len(self._messages)
+
+    def is_indexed(self, channel_id):
+        return channel_id in self._indexed
+
+    def _index_tokens(self, record):
+        for token in set(tokenize(record.content)):
+            self._postings.setdefault(token, set()).add(record.id)
+
+    def _unindex_tokens(self, record):
+        for token in set(tokenize(record.content)):
+            ids = self._postings.get(token)
+            if ids is not None:
+                ids.discard(record.id)
+                if not ids:
+                    del self._postings[token]
+
+    def _touch_channel(self, channel_id):
+        ids = self._channels.get(channel_id)
+        if ids is None:
+            ids = self._channels[channel_id] = deque()
+            while len(self._channels) > self.max_channels:
+                old_channel, _ = next(iter(self._channels.items()))
+                self.drop_channel(old_channel)
+                logger.debug(f"Evicted channel {old_channel} from message index (LRU)")
+        else:
+            self._channels.move_to_end(channel_id)
+        return ids
+
+    def _trim(self, ids):
+        while len(ids) > self.per_channel_limit:
+            old = self._messages.pop(ids.popleft(), None)
+            if old is not None:
+                self._unindex_tokens(old)
+
+    def add(self, record):
+        """Añade un mensaje nuevo (o lo actualiza si ya existía)."""
+        if record.id in self._messages:
+            self.update(record)
+            return
+        ids = self._touch_channel(record.channel_id)
+        ids.append(record.id)
+        self._messages[record.id] = record
+        self._index_tokens(record)
+        self._trim(ids)
+
+    def update(self, record):
+        """Reindexa un mensaje editado. Si no lo teníamos, se ignora."""
+        old = self._messages.get(record.id)
+        if old is None:
+            return
+        self._unindex_tokens(old)
+        self._messages[record.id] = record
+        self._index_tokens(record)
+
+    def remove(self, message_id):
+        record = self._messages.pop(message_id, None)
+        if record is None:
+            return
+        self._unindex_tokens(record)
+        ids = self._channels.get(record.channel_id)
+        if ids is not None:
+            try:
+                ids.remove(message_id)
+            except ValueError:
+                pass
+
+    def drop_channel(self, channel_id):
+        ids = self._channels.pop(channel_id, None) or ()
+        for message_id in ids:
+            record = self._messages.pop(message_id, None)
+            if record is not None:
+                self._unindex_tokens(record)
+        self._indexed.discard(channel_id)
+
+    def load_channel(self, channel_id, records):
+        """Fusiona un backfill con lo que ya llegó por el gateway y marca el canal como indexado."""
+        ids = self._touch_channel(channel_id)
+        live = [self._messages.pop(i) for i in ids if i in self._messages]
+        for record in live:
+            self._unindex_tokens(record)
+        merged = {r.id: r for r in records}
+        merged.update({r.id: r for r in live})  # la copia del gateway puede estar editada
+        ids.clear()
+        for message_id in sorted(merged)[-self.per_channel_limit:]:
+            record = merged[message_id]
+            ids.append(message_id)
+            self._messages[message_id] = record
+            self._index_tokens(record)
+        self._indexed.add(channel_id)
+
+    def _token_ids(self, token):
+        """Mensajes con el token; si no está tal cual (palabra parcial, "instal" -> "instalar"),
+        se unen los de todos los tokens del vocabulario que lo contienen."""
+        ids = self._postings.get(token)
+        if ids is not None:
+            return set(ids)
+        matches = set()
+        for key, key_ids in self._postings.items():
+            if token in key:
+                matches |= key_ids
+        return matches
+
+    def search(self, query, channel_ids, limit=25, include_bots=False):
+        """Busca en los canales indexados. Devuelve (registros, canales_sin_indexar)."""
+        scope = set(channel_ids)
+        missing = [c for c in channel_ids if c not in self._indexed]
+        searchable = scope - set(missing)
+
+        if query == "*" or not query.strip():
+            candidates = (self._messages[i] for c in searchable for i in self._channels.get(c, ()))
+        else:
+            needle = fold_accents(query)
+            ids = None
+            for token in set(tokenize(query)):
+                matches = self._token_ids(token)
+                ids = matches if ids is None else ids & matches
+                if not ids:
+                    break
+            if ids is None:
+                # Sin palabras (solo signos): comparación directa con el texto ya normalizado
+                candidates = (self._messages[i] for c in searchable for i in self._channels.get(c, ()))
+            else:
+                candidates = (self._messages[i] for i in ids)
+            candidates = (r for r in candidates if needle in r.folded)
+
+        results = [
+            r for r in candidates
+            if r.channel_id in searchable and (include_bots or not r.author_bot)
+        ]
+        results.sort(key=lambda r: r.id, reverse=True)
+        return results[:limit], missing
+
+
+class MessageIndex:
+    """Registro de índices por servidor."""
+
+    def __init__(self, per_channel_limit=None, max_channels=None, backfill_limit=None):
+        self.per_channel_limit = per_channel_limit or int(os.getenv('MAI_INDEX_PER_CHANNEL', 500))
+        self.max_channels = max_channels or int(os.getenv('MAI_INDEX_MAX_CHANNELS', 200))
+        self.backfill_limit = backfill_limit or int(os.getenv('MAI_INDEX_BACKFILL', 100))
+        self._guilds = {}
+
+    def guild(self, guild_id):
+        index = self._guilds.get(guild_id)
+        if index is None:
+            index = self._guilds[guild_id] = GuildMessageIndex(self.per_channel_limit, self.max_channels)
+        return index
+
+    def ingest(self, message):
+        if message.guild is None:
+            return
+        self.guild(message.guild.id).add(MessageRecord.from_message(message))
+
+    def update(self, message):
+        if message.guild is None:
+            return
+        self.guild(message.guild.id).update(MessageRecord.from_message(message))
+
+    def remove(self, guild_id, message_id):
+        if guild_id in self._guilds:
+            self._guilds[guild_id].remove(message_id)
+
+    def drop_channel(self, guild_id, channel_id):
+        if guild_id in self._guilds:
+            self._guilds[guild_id].drop_channel(channel_id)
+
+    async def backfill_channel(self, channel):
+        index = self.guild(channel.guild.id)
+        records = [MessageRecord.from_message(m) async for m in channel.history(limit=self.backfill_limit)]
+        index.load_channel(channel.id, records)
+        return len(records)
+
+    async def backfill(self, guild, channels=None):
+        """Rellena una vez los canales legibles (o solo `channels`) que aún no estén indexados."""
+        index = self.guild(guild.id)
+        total = 0
+        filled = 0
+        for channel in guild.text_channels if channels is None else channels:
+            if index.is_indexed(channel.id):
+                continue
+            perms = channel.permissions_for(guild.me)
+            if not perms.read_messages or not perms.read_message_history:
+                continue
+            try:
+                total += await self.backfill_channel(channel)
+                filled += 1
+            except Exception as e:
+                logger.warning(f"Backfill failed for #{channel.name}: {e}")
+        logger.info(f"Message index backfilled for {guild.name}: {filled} channels, {total} messages")
@@ -0,0 +1,186 @@
+# metrics.py
+"""
+Métricas en memoria con salida en formato Prometheus.
+Histogramas por etapa (historial, prompt, cada intento al LLM, búsqueda,
+envío de la respuesta) y contadores de saltos de fallback, herramientas y tokens.
+Los histogramas guardan además una muestra acotada para calcular percentiles.
+"""
+import time
+import random
+from contextlib import contextmanager
+
+# Cubos en segundos: desde ms (índices en memoria) hasta decenas de segundos (LLM lentos)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+RESERVOIR_SIZE = 1024
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in pairs) + "}"
+
+
+class _HistogramState:
+    __slots__ = ("counts", "sum", "count", "reservoir")
+
+    def __init__(self, buckets):
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self.reservoir = []
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._states = {}
+
+    def observe(self, value, *label_values):
+        state = self._states.get(label_values)
+        if state is None:
+            state = self._states[label_values] = _HistogramState(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                state.counts[i] += 1
+                break
+        state.sum += value
+        state.count += 1
+        # Muestreo de reservorio: percentiles aproximados sin guardar todas las observaciones
+        if len(state.reservoir) < RESERVOIR_SIZE:
+            state.reservoir.append(value)
+        else:
+            slot = random.randrange(state.count)
+            if slot < RESERVOIR_SIZE:
+                state.reservoir[slot] = value
+
+    @contextmanager
+    def time(self, *label_values):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def quantile(self, q, *label_values):
+        state = self._states.get(label_values)
+        if state is None or not state.reservoir:
+            return None
+        samples = sorted(state.reservoir)
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def summary(self):
+        """{etiquetas: {count, p50, p95, p99}} para /healthz y los benchmarks."""
+        return {
+            ",".join(map(str, labels)) or "all": {
+                "count": state.count,
+                "p50": self.quantile(0.50, *labels),
+                "p95": self.quantile(0.95, *labels),
+                "p99": self.quantile(0.99, *labels),
+            }
+            for labels, state in self._states.items()
+        }
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, state in sorted(self._states.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, state.counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, labels, ('le', bound))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels, labels, ('le', '+Inf'))} {state.count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, labels)} {state.sum:.6f}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, labels)} {state.count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+
+    def inc(self, amount=1, *label_values):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, labels)} {value}")
+        return lines
+
+
+class Gauge:
+    """Valor leído en el momento de exportar (`read()` devuelve un número o {etiqueta: número})."""
+
+    def __init__(self, name, help, read, label=None):
+        self.name = name
+        self.help = help
+        self.read = read
+        self.label = label
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            value = self.read()
+        except Exception:
+            return []
+        if isinstance(value, dict):
+            for key, v in sorted(value.items()):
+                lines.append(f"{self.name}{_format_labels((self.label,), (key,))} {float(v)}")
+        elif value is not None:
+            lines.append(f"{self.name} {float(value)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_LATENCY = REGISTRY.register(Histogram(
+    "mai_stage_seconds", "Latencia por etapa de una mención", labels=("stage",)))
+LLM_ATTEMPT_LATENCY = REGISTRY.register(Histogram(
+    "mai_llm_attempt_seconds", "Latencia de cada intento al LLM", labels=("model", "outcome")))
+FALLBACK_HOPS = REGISTRY.register(Counter(
+    "mai_fallback_hops_total", "Saltos al siguiente modelo de la cadena", labels=("from_model", "reason")))
+TOOL_CALLS = REGISTRY.register(Counter(
+    "mai_tool_calls_total", "Herramientas pedidas por el modelo", labels=("kind",)))
+LLM_TOKENS = REGISTRY.register(Counter(
+    "mai_llm_tokens_total", "Tokens consumidos según el proveedor", labels=("model", "direction")))
+QUERIES = REGISTRY.register(Counter(
+    "mai_queries_total", "Consultas procesadas por process_query", labels=("source",)))
+LOOP_BLOCKS = REGISTRY.register(Counter(
+    "mai_loop_blocks_total", "Veces que algo bloqueó el event loop más del umbral"))
+
+
+def record_usage(model, response):
+    """Suma los tokens de `usage_metadata` (si el proveedor los manda)."""
+    usage = getattr(response, "usage_metadata", None) or {}
+    if usage.get("input_tokens"):
+        LLM_TOKENS.inc(usage["input_tokens"], model, "input")
+    if usage.get("output_tokens"):
+        LLM_TOKENS.inc(usage["output_tokens"], model, "output")
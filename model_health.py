@@ -0,0 +1,237 @@
+# model_health.py
+"""
+Registro de salud de los modelos de la cadena de fallback.
+Apunta los 429, la latencia y las cabeceras de reset de rate limit de Groq
+para saltarse los modelos que sabemos que van a fallar y ordenar el resto.
+"""
+import os
+import re
+import time
+import logging
+from collections import deque
+
+logger = logging.getLogger('ModelHealth')
+
+DEFAULT_COOLDOWN = float(os.getenv('MAI_MODEL_COOLDOWN', 20.0))
+# Cuántos segundos de latencia media "valen" un puesto en la lista de prioridades
+LATENCY_RANK_SECONDS = float(os.getenv('MAI_LATENCY_RANK_SECONDS', 5.0))
+PENALTY_HALF_LIFE = 120.0
+# Latencias recientes por modelo, para los percentiles del hedging
+LATENCY_SAMPLES = 50
+MIN_LATENCY_SAMPLES = 5
+EWMA_ALPHA = 0.3
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_RETRY_IN_RE = re.compile(r"try again in ((?:\d+(?:\.\d+)?(?:ms|h|m|s))+)", re.IGNORECASE)
+
+
+def parse_duration(value):
+    """Convierte '2m59.56s', '7.66s', '250ms' o '12' en segundos. None si no se entiende."""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_RE.findall(value)
+    if not parts:
+        return None
+    factors = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(n) * factors[unit] for n, unit in parts)
+
+
+def is_rate_limit_error(error):
+    if getattr(error, "status_code", None) == 429:
+        return True
+    error_str = str(error)
+    return "429" in error_str or "rate_limit" in error_str.lower()
+
+
+def is_context_length_error(error):
+    """El prompt no cabe en ese modelo (413 / context_length_exceeded): otro modelo puede aceptarlo."""
+    if getattr(error, "status_code", None) == 413:
+        return True
+    error_str = str(error).lower()
+    return "context_length_exceeded" in error_str or "request too large" in error_str or "413" in error_str
+
+
+def error_headers(error):
+    """Cabeceras HTTP de la respuesta asociada a una excepción (SDK de Groq / httpx)."""
+    headers = getattr(error, "headers", None)
+    if headers is None:
+        response = getattr(error, "response", None)
+        headers = getattr(response, "headers", None)
+    return headers or {}
+
+
+def response_headers(response):
+    """Cabeceras de rate limit de una respuesta correcta (solo las trae el cliente nativo)."""
+    metadata = getattr(response, "response_metadata", None) or {}
+    return metadata.get("headers")
+
+
+class ModelsExhaustedError(Exception):
+    """Todos los modelos de la cadena están limitados."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ModelHealth:
+    __slots__ = ("model", "priority", "cooldown_until", "ewma_latency", "penalty", "penalty_at",
+                 "successes", "failures", "rate_limits", "latencies", "first_chunk_latencies", "hedges",
+                 "hedge_wins", "abandoned")
+
+    def __init__(self, model, priority):
+        self.model = model
+        self.priority = priority
+        self.cooldown_until = 0.0
+        self.ewma_latency = None
+        self.penalty = 0.0
+        self.penalty_at = 0.0
+        self.successes = 0
+        self.failures = 0
+        self.rate_limits = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.first_chunk_latencies = deque(maxlen=LATENCY_SAMPLES)  # en streaming, hasta el primer trozo
+        self.hedges = 0      # veces que tardó tanto que lanzamos otro modelo en paralelo
+        self.hedge_wins = 0  # carreras con hedge que ganó este modelo
+        self.abandoned = 0   # llamadas canceladas porque ganó otro modelo
+
+    @property
+    def attempts(self):
+        return self.successes + self.failures + self.rate_limits + self.abandoned
+
+    def current_penalty(self, now):
+        if not self.penalty:
+            return 0.0
+        return self.penalty * 0.5 ** ((now - self.penalty_at) / PENALTY_HALF_LIFE)
+
+    def score(self, now):
+        latency = (self.ewma_latency or 0.0) / LATENCY_RANK_SECONDS
+        return self.priority + latency + self.current_penalty(now)
+
+
+class ModelHealthRegistry:
+    """Estado compartido por todas las llamadas concurrentes a process_query."""
+
+    def __init__(self, models, clock=time.monotonic):
+        self._clock = clock
+        self._models = {m: ModelHealth(m, i) for i, m in enumerate(models)}
+
+    def _get(self, model):
+        health = self._models.get(model)
+        if health is None:
+            health = self._models[model] = ModelHealth(model, len(self._models))
+        return health
+
+    def _cooldown_from_headers(self, headers):
+        if not headers:
+            return None
+        candidates = [
+            parse_duration(headers.get("retry-after")),
+            parse_duration(headers.get("x-ratelimit-reset-requests")) if headers.get("x-ratelimit-remaining-requests") == "0" else None,
+            parse_duration(headers.get("x-ratelimit-reset-tokens")) if headers.get("x-ratelimit-remaining-tokens") == "0" else None,
+        ]
+        candidates = [c for c in candidates if c is not None]
+        return max(candidates) if candidates else None
+
+    def record_success(self, model, latency, headers=None):
+        now = self._clock()
+        health = self._get(model)
+        health.successes += 1
+        health.ewma_latency = latency if health.ewma_latency is None else (
+            EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * health.ewma_latency
+        )
+        health.latencies.append(latency)
+        # Si la respuesta ya avisa de que no quedan peticiones, no esperamos al 429
+        cooldown = self._cooldown_from_headers(headers)
+        if cooldown:
+            health.cooldown_until = max(health.cooldown_until, now + cooldown)
+
+    def record_rate_limit(self, model, error=None, headers=None):
+        now = self._clock()
+        health = self._get(model)
+        health.rate_limits += 1
+        health.penalty = health.current_penalty(now) + 1.0
+        health.penalty_at = now
+        headers = headers or (error_headers(error) if error is not None else {})
+        cooldown = self._cooldown_from_headers(headers)
+        if cooldown is None and error is not None:
+            match = _RETRY_IN_RE.search(str(error))
+            cooldown = parse_duration(match.group(1)) if match else None
+        cooldown = cooldown if cooldown is not None else DEFAULT_COOLDOWN
+        health.cooldown_until = max(health.cooldown_until, now + cooldown)
+        logger.info(f"{model} rate limited, skipping for {cooldown:.1f}s")
+
+    def record_failure(self, model, error=None):
+        self._get(model).failures += 1
+
+    def record_hedge(self, model):
+        self._get(model).hedges += 1
+
+    def record_hedge_win(self, model):
+        self._get(model).hedge_wins += 1
+
+    def record_first_chunk(self, model, latency):
+        self._get(model).first_chunk_latencies.append(latency)
+
+    def record_abandoned(self, model, elapsed, first_chunk=False):
+        """Una llamada cancelada tras `elapsed` segundos: al menos tardaba eso (cuenta para los percentiles).
+        Con `first_chunk` se canceló un stream que aún no había empezado a emitir."""
+        health = self._get(model)
+        health.abandoned += 1
+        (health.first_chunk_latencies if first_chunk else health.latencies).append(elapsed)
+
+    def latency_percentile(self, model, percentile, first_chunk=False):
+        """Percentil de las latencias recientes del modelo (o hasta el primer trozo); None si aún hay pocas muestras."""
+        health = self._get(model)
+        samples = sorted(health.first_chunk_latencies if first_chunk else health.latencies)
+        if len(samples) < MIN_LATENCY_SAMPLES:
+            return None
+        index = min(len(samples) - 1, int(round(percentile / 100.0 * (len(samples) - 1))))
+        return samples[index]
+
+    def is_available(self, model):
+        return self._get(model).cooldown_until <= self._clock()
+
+    def exhausted(self):
+        return not any(self.is_available(m) for m in self._models)
+
+    def retry_after(self):
+        """Segundos hasta que vuelva a haber algún modelo disponible."""
+        now = self._clock()
+        return max(0.0, min(h.cooldown_until for h in self._models.values()) - now)
+
+    def ordered(self, models=None):
+        """
+        Modelos a intentar, del mejor al peor según prioridad, latencia y 429 recientes.
+        Si todos están en cooldown devuelve solo el que antes se libera (un único intento).
+        """
+        now = self._clock()
+        healths = [self._get(m) for m in (models or list(self._models))]
+        available = [h for h in healths if h.cooldown_until <= now]
+        if not available:
+            return [min(healths, key=lambda h: h.cooldown_until).model]
+        available.sort(key=lambda h: h.score(now))
+        return [h.model for h in available]
+
+    def snapshot(self):
+        now = self._clock()
+        return {
+            h.model: {
+                "available": h.cooldown_until <= now,
+                "cooldown_remaining": round(max(0.0, h.cooldown_until - now), 2),
+                "ewma_latency": round(h.ewma_latency, 3) if h.ewma_latency is not None else None,
+                "successes": h.successes,
+                "failures": h.failures,
+                "rate_limits": h.rate_limits,
+                "p95_latency": self.latency_percentile(h.model, 95),
+                "hedges": h.hedges,
+                "hedge_rate": round(h.hedges / h.attempts, 3) if h.attempts else 0.0,
+                "hedge_wins": h.hedge_wins,
+            }
+            for h in self._models.values()
+        }
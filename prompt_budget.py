@@ -0,0 +1,185 @@
+# prompt_budget.py
+"""
+Presupuesto de tokens del prompt.
+Cada parte recortable (historial, conocimiento, resultados de búsqueda) se
+guarda troceada y se ajusta al límite del modelo que se va a probar: las
+búsquedas se recortan por relevancia (se quedan los primeros resultados),
+el historial por antigüedad (se quedan los últimos mensajes).
+"""
+import os
+import re
+import logging
+
+from llm_backend import SystemMessage, HumanMessage
+
+logger = logging.getLogger('PromptBudget')
+
+# Tokens máximos de prompt por petición que aceptamos mandar a cada modelo
+# (ventana de contexto y límite por petición de Groq, lo que sea menor)
+MODEL_PROMPT_LIMITS = {
+    "openai/gpt-oss-120b": 8000,
+    "llama-3.3-70b-versatile": 12000,
+    "mixtral-8x7b-32768": 5000,
+    "qwen/qwen3-32b": 6000,
+    "llama-3.1-8b-instant": 6000,
+}
+DEFAULT_PROMPT_LIMIT = 6000
+# Tope global opcional (prompts largos ralentizan todas las llamadas)
+PROMPT_MAX_TOKENS = int(os.getenv('MAI_PROMPT_MAX_TOKENS', 0)) or None
+# Hueco que dejamos para la respuesta
+RESPONSE_RESERVE = int(os.getenv('MAI_RESPONSE_TOKENS', 1024))
+
+# Reparto de lo que queda tras las partes fijas; lo que un grupo no usa pasa al siguiente
+GROUP_SHARES = (("knowledge", 0.45), ("search", 0.35), ("history", 0.20))
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+TOKENS_PER_PIECE = 1.3
+
+
+def estimate_tokens(text):
+    """Estimación rápida y algo pesimista (palabras y signos x 1.3), sin tokenizador real."""
+    if not text:
+        return 0
+    return int(len(_TOKEN_RE.findall(text)) * TOKENS_PER_PIECE) + 1
+
+
+def prompt_limit(model):
+    limit = MODEL_PROMPT_LIMITS.get(model, DEFAULT_PROMPT_LIMIT)
+    if PROMPT_MAX_TOKENS:
+        limit = min(limit, PROMPT_MAX_TOKENS)
+    return limit - RESPONSE_RESERVE
+
+
+class Section:
+    """Bloque recortable: cabecera fija + unidades (líneas) que se pueden quitar."""
+    __slots__ = ("name", "group", "header", "units", "footer", "keep", "costs", "optional")
+
+    def __init__(self, name, group, units, header="", footer="", keep="head", optional=False):
+        self.name = name
+        self.group = group
+        self.header = header
+        self.units = list(units)
+        self.footer = footer
+        self.keep = keep          # "head": relevancia (los primeros) / "tail": recencia (los últimos)
+        self.optional = optional  # si no cabe nada, desaparece entera (cabecera incluida)
+        self.costs = [estimate_tokens(u) for u in self.units]
+
+    @property
+    def fixed_cost(self):
+        return estimate_tokens(self.header) + estimate_tokens(self.footer)
+
+    @property
+    def full_cost(self):
+        return sum(self.costs)
+
+    def fit(self, budget):
+        """Cuántas unidades caben en `budget` tokens (respetando el orden de preferencia)."""
+        costs = self.costs if self.keep == "head" else reversed(self.costs)
+        used = count = 0
+        for cost in costs:
+            if used + cost > budget:
+                break
+            used += cost
+            count += 1
+        return count, used
+
+    def render(self, count):
+        if not self.units:
+            return ""
+        if count == 0 and self.optional:
+            return ""
+        kept = self.units[:count] if self.keep == "head" else self.units[len(self.units) - count:]
+        omitted = len(self.units) - count
+        body = "\n".join(kept)
+        if omitted:
+            note = f"[... {omitted} línea(s) recortada(s) por longitud]"
+            body = f"{body}\n{note}" if self.keep == "head" else f"{note}\n{body}"
+        return "\n".join(part for part in (self.header, body.strip("\n"), self.footer) if part)
+
+
+class PromptBuilder:
+    """
+    Mensajes del tool loop con las partes recortables separadas.
+    `messages_for(model)` devuelve la conversación ajustada al límite de ese modelo.
+    """
+
+    def __init__(self, system_prompt, user_header, sections=()):
+        self.system_prompt = system_prompt
+        self.user_header = user_header
+        self.user_sections = list(sections)
+        self.rounds = []  # [(secciones, instrucciones)]
+        self._cache = {}
+
+    def add_round(self, sections, instructions):
+        self.rounds.append((list(sections), instructions))
+        self._cache.clear()
+
+    def _all_sections(self):
+        yield from self.user_sections
+        for sections, _ in self.rounds:
+            yield from sections
+
+    def _allocate(self, limit):
+        sections = list(self._all_sections())
+        fixed = estimate_tokens(self.system_prompt) + estimate_tokens(self.user_header)
+        fixed += sum(estimate_tokens(instructions) for _, instructions in self.rounds)
+        fixed += sum(s.fixed_cost for s in sections)
+        available = max(0, limit - fixed)
+
+        demand = {}
+        for s in sections:
+            demand[s.group] = demand.get(s.group, 0) + s.full_cost
+        budgets = {}
+        for group, share in GROUP_SHARES:
+            budgets[group] = min(demand.get(group, 0), int(available * share))
+        spare = available - sum(budgets.values())
+        for group, _ in GROUP_SHARES:
+            extra = min(spare, demand.get(group, 0) - budgets[group])
+            budgets[group] += extra
+            spare -= extra
+
+        counts = {}
+        for group, _ in GROUP_SHARES:
+            members = [s for s in sections if s.group == group]
+            left = budgets[group]
+            # Cada sección recibe su parte proporcional; lo que sobra pasa a las siguientes
+            for i, s in enumerate(members):
+                pending = sum(m.full_cost for m in members[i:]) or 1
+                share = left if i == len(members) - 1 else int(left * s.full_cost / pending)
+                count, used = s.fit(share)
+                counts[id(s)] = count
+                left -= used
+        return counts, fixed
+
+    def messages_for(self, model):
+        cached = self._cache.get(model)
+        if cached is not None:
+            return cached
+        limit = prompt_limit(model)
+        counts, fixed = self._allocate(limit)
+
+        def render(sections):
+            return [s.render(counts[id(s)]) for s in sections]
+
+        user_parts = [self.user_header] + render(self.user_sections)
+        messages = [
+            SystemMessage(content=self.system_prompt),
+            HumanMessage(content="\n".join(p for p in user_parts if p)),
+        ]
+        for sections, instructions in self.rounds:
+            messages.append(SystemMessage(content="\n\n".join(render(sections)) + "\n" + instructions))
+
+        total = sum(estimate_tokens(m.content) for m in messages)
+        per_section = {}
+        trimmed = False
+        for s in self._all_sections():
+            kept, full = per_section.get(s.name, (0, 0))
+            kept_tokens = sum(s.costs[:counts[id(s)]] if s.keep == "head" else s.costs[len(s.costs) - counts[id(s)]:])
+            per_section[s.name] = (kept + kept_tokens, full + s.full_cost)
+            trimmed = trimmed or counts[id(s)] < len(s.units)
+        detail = " ".join(f"{name}={kept}/{full}" for name, (kept, full) in per_section.items())
+        log = logger.warning if trimmed else logger.info
+        log(f"Prompt for {model}: ~{total}/{limit} tokens | fixed={fixed} {detail}{' (trimmed)' if trimmed else ''}")
+
+        self._cache[model] = messages
+        return messages
@@ -1,60 +1,158 @@
 import os
+import time
+import asyncio
 import aiohttp
 import logging
-import requests
 import random
 
 logger = logging.getLogger('ProxyManager')
 
-def get_webshare_proxy_sync():
-    """Synchronous version for bot initialization."""
-    token = os.getenv('WEBSHARE_TOKEN') or os.getenv('PROXY')
-    if not token:
-        return None
-    
-    url = "https://proxy.webshare.io/api/v2/proxy/list/?mode=direct"
-    headers = {"Authorization": f"Token {token}"}
-    
-    try:
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            data = response.json()
-            results = data.get('results', [])
-            if results:
-                random.shuffle(results)
-                p = results[0]
-                return f"http://{p['username']}:{p['password']}@{p['proxy_address']}:{p['port']}"
-    except:
-        pass
-    return None
+# Se puede apuntar a un servidor local en pruebas (benchmarks/proxy_stub.py)
+WEBSHARE_API_URL = os.getenv('WEBSHARE_API_URL', "https://proxy.webshare.io/api/v2/proxy/list/?mode=direct")
+PROXY_CACHE_TTL = float(os.getenv('MAI_PROXY_CACHE_TTL', 600))
+PROXY_API_TIMEOUT = float(os.getenv('MAI_PROXY_API_TIMEOUT', 10))
+# Sondeo de latencia: cuántos proxies se prueban a la vez y contra qué URL
+PROXY_PROBE_URL = os.getenv('MAI_PROXY_PROBE_URL', "https://discord.com/api/v10/gateway")
+PROXY_PROBE_TIMEOUT = float(os.getenv('MAI_PROXY_PROBE_TIMEOUT', 5))
+PROXY_PROBE_COUNT = int(os.getenv('MAI_PROXY_PROBE_COUNT', 8))
+PROXY_QUARANTINE = float(os.getenv('MAI_PROXY_QUARANTINE', 900))
+
+
+def _proxy_url(p):
+    return f"http://{p['username']}:{p['password']}@{p['proxy_address']}:{p['port']}"
+
+
+def _redact(proxy_url):
+    """host:puerto de un proxy, sin credenciales (para los logs)."""
+    return proxy_url.rsplit("@", 1)[-1] if proxy_url else None
+
+
+class ProxyPool:
+    """
+    Proxies de Webshare para conectar con Discord.
+    La lista se descarga sin bloquear el event loop y se cachea `ttl` segundos; cada vez
+    que se pide uno se sondean varios en paralelo y se devuelve el más rápido que responde.
+    Los que fallan (en el sondeo o al conectar el bot) quedan en cuarentena un rato.
+    """
+
+    def __init__(self, token=None, api_url=WEBSHARE_API_URL, ttl=PROXY_CACHE_TTL, probe_url=PROXY_PROBE_URL,
+                 probe_count=PROXY_PROBE_COUNT, clock=time.monotonic):
+        self.token = token or os.getenv('WEBSHARE_TOKEN') or os.getenv('PROXY')
+        self.api_url = api_url
+        self.ttl = ttl
+        self.probe_url = probe_url
+        self.probe_count = probe_count
+        self._clock = clock
+        self._proxies = []
+        self._fetched_at = None
+        self._quarantine = {}  # proxy_url -> hasta cuándo
+        self._latency = {}     # proxy_url -> última latencia medida
+        self._session = None
+        self._fetch_lock = asyncio.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.token)
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession()
+        return self._session
+
+    async def fetch(self, force=False):
+        """Lista de proxies válidos (desde la caché si no ha caducado)."""
+        if not self.enabled:
+            return []
+        async with self._fetch_lock:
+            fresh = self._fetched_at is not None and self._clock() - self._fetched_at < self.ttl
+            if fresh and not force:
+                return self._proxies
+            headers = {"Authorization": f"Token {self.token}"}
+            try:
+                timeout = aiohttp.ClientTimeout(total=PROXY_API_TIMEOUT)
+                async with self._get_session().get(self.api_url, headers=headers, timeout=timeout) as response:
+                    if response.status != 200:
+                        logger.error(f"Webshare API error: {response.status} - {(await response.text())[:200]}")
+                        return self._proxies
+                    data = await response.json()
+            except Exception as e:
+                # Si falla, seguimos con la lista anterior (aunque esté caducada)
+                logger.error(f"Error fetching proxy list from Webshare: {e}")
+                return self._proxies
+            results = [p for p in data.get('results', []) if p.get('valid', True)]
+            self._proxies = [_proxy_url(p) for p in results]
+            self._fetched_at = self._clock()
+            if not self._proxies:
+                logger.warning("No proxies found in Webshare account.")
+            else:
+                logger.info(f"Fetched {len(self._proxies)} proxies from Webshare")
+            return self._proxies
+
+    def quarantine(self, proxy_url, seconds=PROXY_QUARANTINE):
+        """Aparta un proxy que ha fallado (p. ej. al conectar con Discord)."""
+        if proxy_url:
+            self._quarantine[proxy_url] = self._clock() + seconds
+            self._latency.pop(proxy_url, None)
+            logger.warning(f"Proxy {_redact(proxy_url)} quarantined for {seconds:.0f}s")
+
+    def is_quarantined(self, proxy_url):
+        until = self._quarantine.get(proxy_url)
+        if until is None:
+            return False
+        if until <= self._clock():
+            del self._quarantine[proxy_url]
+            return False
+        return True
+
+    async def probe(self, proxy_url):
+        """Latencia (s) de una petición a Discord a través del proxy; None si falla."""
+        start = time.monotonic()
+        try:
+            timeout = aiohttp.ClientTimeout(total=PROXY_PROBE_TIMEOUT)
+            async with self._get_session().get(self.probe_url, proxy=proxy_url, timeout=timeout) as response:
+                # /gateway no pide token: cualquier 4xx (407 del proxy, 429/403 de Cloudflare, 401) es que
+                # por ese proxy no se llega a Discord, que es justo lo que queremos evitar
+                if response.status >= 400:
+                    logger.info(f"Proxy {_redact(proxy_url)} probe failed: HTTP {response.status}")
+                    return None
+                await response.read()
+        except Exception:
+            return None
+        return time.monotonic() - start
+
+    async def best(self):
+        """El proxy sano más rápido entre una muestra de la lista, o None (conexión directa)."""
+        proxies = [p for p in await self.fetch() if not self.is_quarantined(p)]
+        if not proxies:
+            return None
+        candidates = random.sample(proxies, min(self.probe_count, len(proxies)))
+        latencies = await asyncio.gather(*(self.probe(p) for p in candidates))
+        healthy = []
+        for proxy_url, latency in zip(candidates, latencies):
+            if latency is None:
+                self.quarantine(proxy_url)
+            else:
+                self._latency[proxy_url] = latency
+                healthy.append((latency, proxy_url))
+        if not healthy:
+            logger.warning(f"None of {len(candidates)} probed proxies answered")
+            return None
+        latency, proxy_url = min(healthy)
+        logger.info(f"Selected proxy {_redact(proxy_url)} ({latency * 1000:.0f}ms, {len(healthy)}/{len(candidates)} healthy)")
+        return proxy_url
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
 
 async def get_webshare_proxy():
-    """Fetches the first available proxy from Webshare API."""
-    token = os.getenv('WEBSHARE_TOKEN') or os.getenv('PROXY')
-    if not token:
+    """Fetches the fastest healthy proxy from Webshare API (one-off pool)."""
+    pool = ProxyPool()
+    if not pool.enabled:
         logger.error("WEBSHARE_TOKEN or PROXY not found in environment variables.")
         return None
-
-    url = "https://proxy.webshare.io/api/v2/proxy/list/?mode=direct"
-    headers = {"Authorization": f"Token {token}"}
-
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    results = data.get('results', [])
-                    if results:
-                        random.shuffle(results)
-                        p = results[0]  # Take a random one
-                        proxy_url = f"http://{p['username']}:{p['password']}@{p['proxy_address']}:{p['port']}"
-                        logger.info(f"Successfully fetched random proxy: {p['proxy_address']}")
-                        return proxy_url
-                    else:
-                        logger.warning("No proxies found in Webshare account.")
-                else:
-                    logger.error(f"Webshare API error: {response.status} - {await response.text()}")
-    except Exception as e:
-        logger.error(f"Error fetching proxy from Webshare: {e}")
-    
-    return None
+        return await pool.best()
+    finally:
+        await pool.close()
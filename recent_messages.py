@@ -0,0 +1,93 @@
+# recent_messages.py
+"""
+Últimos mensajes de cada canal, para el historial conversacional de una mención.
+Se mantiene con los eventos del gateway (mensaje / edición / borrado), así que
+construir `chat_context` no hace ninguna llamada REST salvo la primera vez
+que se usa un canal del que aún no tenemos nada (arranque en frío).
+"""
+import os
+import logging
+from collections import OrderedDict, deque
+
+from message_index import MessageRecord
+
+logger = logging.getLogger('RecentMessages')
+
+CHAT_CONTEXT_MESSAGES = int(os.getenv('MAI_CHAT_CONTEXT_MESSAGES', 4))
+RECENT_PER_CHANNEL = int(os.getenv('MAI_RECENT_PER_CHANNEL', 20))
+RECENT_MAX_CHANNELS = int(os.getenv('MAI_RECENT_MAX_CHANNELS', 500))
+
+
+class RecentMessages:
+    """Ring buffer por canal (deque con maxlen) y LRU de canales como tope global de memoria."""
+
+    def __init__(self, per_channel=RECENT_PER_CHANNEL, max_channels=RECENT_MAX_CHANNELS):
+        self.per_channel = max(per_channel, CHAT_CONTEXT_MESSAGES + 1)
+        self.max_channels = max_channels
+        self._channels = OrderedDict()  # channel_id -> deque[MessageRecord]
+        self._warm = set()              # canales cuyo buffer refleja de verdad el final del canal
+        self.cold_fetches = 0
+
+    def __len__(self):
+        return sum(len(buffer) for buffer in self._channels.values())
+
+    def _buffer(self, channel_id):
+        buffer = self._channels.get(channel_id)
+        if buffer is None:
+            buffer = self._channels[channel_id] = deque(maxlen=self.per_channel)
+            while len(self._channels) > self.max_channels:
+                old_channel, _ = self._channels.popitem(last=False)
+                self._warm.discard(old_channel)
+        else:
+            self._channels.move_to_end(channel_id)
+        return buffer
+
+    def ingest(self, message):
+        self._buffer(message.channel.id).append(MessageRecord.from_message(message))
+
+    def update(self, message):
+        buffer = self._channels.get(message.channel.id)
+        if not buffer:
+            return
+        for i, record in enumerate(buffer):
+            if record.id == message.id:
+                buffer[i] = MessageRecord.from_message(message)
+                return
+
+    def remove(self, channel_id, message_id):
+        buffer = self._channels.get(channel_id)
+        if not buffer:
+            return
+        for record in buffer:
+            if record.id == message_id:
+                buffer.remove(record)
+                return
+
+    def drop_channel(self, channel_id):
+        self._channels.pop(channel_id, None)
+        self._warm.discard(channel_id)
+
+    def recent(self, channel_id, before_id, limit=CHAT_CONTEXT_MESSAGES):
+        """Hasta `limit` mensajes anteriores a `before_id`, del más antiguo al más nuevo."""
+        buffer = self._channels.get(channel_id) or ()
+        records = [r for r in buffer if r.id < before_id]
+        return records[-limit:] if limit > 0 else []
+
+    async def context_for(self, message, limit=CHAT_CONTEXT_MESSAGES):
+        """Historial previo a `message`. Solo va a la API si el canal está frío (una vez por canal)."""
+        channel_id = message.channel.id
+        if channel_id not in self._warm and limit > 0:
+            try:
+                fetched = [m async for m in message.channel.history(limit=self.per_channel, before=message)]
+                self.cold_fetches += 1
+                buffer = self._buffer(channel_id)
+                live = {r.id: r for r in buffer}
+                merged = {m.id: MessageRecord.from_message(m) for m in fetched}
+                merged.update(live)  # lo que llegó por el gateway puede estar editado
+                buffer.clear()
+                buffer.extend(merged[i] for i in sorted(merged)[-self.per_channel:])
+            except Exception as e:
+                logger.warning(f"Cold history fetch failed for channel {channel_id}: {e}")
+            # Aunque falle, no reintentamos en cada mención: el gateway irá llenando el buffer
+            self._warm.add(channel_id)
+        return self.recent(channel_id, message.id, limit)
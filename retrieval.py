@@ -0,0 +1,284 @@
+# retrieval.py
+"""
+Recuperación local de pasajes (sustituye al RAG con ChromaDB).
+Índice BM25 sobre la base de conocimiento troceada y sobre los mensajes aprendidos con
+learn_from_text. Los textos aprendidos se guardan en un fichero de registros
+con prefijo de longitud y se leen con mmap: en memoria solo quedan los
+postings y los offsets, no el texto.
+Los postings de la base de conocimiento y los de lo aprendido van por separado:
+al recargar el conocimiento solo se rehace su parte (unos pocos pasajes), los
+aprendidos se indexan una vez al abrir el fichero y luego solo crecen.
+"""
+import os
+import math
+import asyncio
+import mmap
+import time
+import struct
+import hashlib
+import logging
+from array import array
+from collections import Counter
+
+from knowledge_base import current_knowledge
+from text_utils import stems, tokenize
+
+logger = logging.getLogger('Retrieval')
+
+RETRIEVAL_PATH = os.getenv('MAI_RETRIEVAL_PATH', 'mai_retrieval.idx')
+RETRIEVAL_TOP_K = int(os.getenv('MAI_RETRIEVAL_TOP_K', 4))
+RETRIEVAL_MIN_SCORE = float(os.getenv('MAI_RETRIEVAL_MIN_SCORE', 2.0))
+# Palabras aproximadas por pasaje al trocear mensajes aprendidos
+CHUNK_WORDS = int(os.getenv('MAI_RETRIEVAL_CHUNK_WORDS', 80))
+# Viñetas de la base de conocimiento por pasaje (cada pasaje lleva el título de su sección)
+KNOWLEDGE_BULLETS = 3
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+MAGIC = b"MAIRET1\n"
+_RECORD = struct.Struct("<II")  # longitud de la fuente, longitud del texto (bytes UTF-8)
+
+KNOWLEDGE_PREFIX = "kb:"
+
+
+class Passage:
+    __slots__ = ("source", "text", "score")
+
+    def __init__(self, source, text, score):
+        self.source = source
+        self.text = text
+        self.score = score
+
+    @property
+    def trusted(self):
+        """Solo la base de conocimiento es fuente de verdad; los mensajes de canales no."""
+        return self.source.startswith(KNOWLEDGE_PREFIX)
+
+    @property
+    def topic(self):
+        return self.source[len(KNOWLEDGE_PREFIX):] if self.trusted else None
+
+    def format(self):
+        if self.trusted:
+            return f"[{self.topic}] {self.text}"
+        return f"[Mensajes de {self.source} — NO FIABLE, solo contexto conversacional]\n{self.text}"
+
+    def __repr__(self):
+        return f"Passage({self.source}, {self.score:.2f})"
+
+
+def chunk_knowledge(name, text):
+    """Trocea una sección en grupos de viñetas, repitiendo la línea de título en cada trozo."""
+    lines = [l.strip() for l in text.strip().splitlines() if l.strip()]
+    if not lines:
+        return []
+    title, bullets = (lines[0], lines[1:]) if len(lines) > 1 else ("", lines)
+    chunks = []
+    for i in range(0, len(bullets), KNOWLEDGE_BULLETS):
+        body = "\n".join(bullets[i:i + KNOWLEDGE_BULLETS])
+        chunks.append(f"{title}\n{body}" if title else body)
+    return chunks
+
+
+def chunk_messages(messages, words=CHUNK_WORDS):
+    """Agrupa mensajes consecutivos en pasajes de unas `words` palabras."""
+    chunks, current, size = [], [], 0
+    for message in messages:
+        message = message.strip()
+        if not message:
+            continue
+        current.append(message)
+        size += len(message.split())
+        if size >= words:
+            chunks.append("\n".join(current))
+            current, size = [], 0
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+class _Postings:
+    """Postings BM25 de un grupo de pasajes (las estadísticas globales se suman al buscar)."""
+
+    def __init__(self):
+        self.sources = []       # doc_id -> fuente ("kb:goats", "channel_general"...)
+        self.locations = []     # doc_id -> str (en memoria) o (offset, longitud) en el fichero
+        self.lengths = array('I')
+        self.postings = {}      # stem -> [(doc_id, tf)]
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.sources)
+
+    def add(self, source, location, text):
+        doc_id = len(self.sources)
+        tokens = stems(tokenize(text))
+        self.sources.append(source)
+        self.locations.append(location)
+        self.lengths.append(len(tokens))
+        self.total_length += len(tokens)
+        for token, tf in Counter(tokens).items():
+            self.postings.setdefault(token, []).append((doc_id, tf))
+        return doc_id
+
+
+class RetrievalIndex:
+    def __init__(self, path=RETRIEVAL_PATH):
+        self.path = path
+        self._knowledge = _Postings()  # se rehace con cada versión de la base de conocimiento
+        self._learned = _Postings()    # solo crece: nunca se reconstruye
+        self._seen = set()      # huellas de los pasajes aprendidos (para no duplicar)
+        self._file_size = 0
+        self._mmap = None
+        self._file = None
+        self._version = None
+        self._write_lock = asyncio.Lock()
+        self._open()
+
+    # --- Fichero de registros ---
+
+    def _open(self):
+        if not os.path.exists(self.path) or os.path.getsize(self.path) < len(MAGIC):
+            with open(self.path, "wb") as f:
+                f.write(MAGIC)
+        self._remap()
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            logger.error(f"{self.path} no es un índice de MAI; se aparta a {self.path}.bad y se empieza de cero")
+            self._mmap.close()
+            self._file.close()
+            self._mmap = self._file = None
+            os.replace(self.path, self.path + ".bad")
+            with open(self.path, "wb") as f:
+                f.write(MAGIC)
+            self._remap()
+        position = len(MAGIC)
+        data = self._mmap
+        while position + _RECORD.size <= len(data):
+            source_len, text_len = _RECORD.unpack_from(data, position)
+            start = position + _RECORD.size
+            end = start + source_len + text_len
+            if end > len(data):
+                logger.warning(f"Registro truncado al final de {self.path}; se ignora")
+                break
+            source = bytes(data[start:start + source_len]).decode("utf-8")
+            text = bytes(data[start + source_len:end])
+            self._learned.add(source, (start + source_len, text_len), text.decode("utf-8"))
+            self._seen.add(self._fingerprint(source, text))
+            position = end
+        self._file_size = position
+        logger.info(f"Retrieval store loaded: {len(self._learned)} learned passages from {self.path}")
+
+    def _remap(self):
+        if self._mmap is not None:
+            self._mmap.close()
+        if self._file is not None:
+            self._file.close()
+        self._file = open(self.path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @staticmethod
+    def _fingerprint(source, data):
+        return hashlib.sha1(source.encode("utf-8") + b"\0" + data).digest()[:12]
+
+    def _write_records(self, records):
+        """Añade registros al fichero (se ejecuta en un hilo). Devuelve sus (offset, longitud)."""
+        locations = []
+        with open(self.path, "r+b") as f:
+            f.seek(self._file_size)
+            f.truncate()  # por si quedó un registro a medias
+            position = self._file_size
+            for source, text in records:
+                source_bytes, text_bytes = source.encode("utf-8"), text.encode("utf-8")
+                f.write(_RECORD.pack(len(source_bytes), len(text_bytes)))
+                f.write(source_bytes)
+                f.write(text_bytes)
+                offset = position + _RECORD.size + len(source_bytes)
+                locations.append((offset, len(text_bytes)))
+                position = offset + len(text_bytes)
+            f.flush()
+            os.fsync(f.fileno())
+        return locations, position
+
+    # --- Índice ---
+
+    def _text(self, part, doc_id):
+        location = part.locations[doc_id]
+        if isinstance(location, str):
+            return location
+        offset, length = location
+        return bytes(self._mmap[offset:offset + length]).decode("utf-8")
+
+    def _ensure_knowledge(self):
+        """Rehace los postings de la base de conocimiento si ha cambiado (o al primer uso)."""
+        knowledge = current_knowledge()
+        version = knowledge.version
+        if version == self._version:
+            return
+        start = time.perf_counter()
+        part = _Postings()
+        for name, text in knowledge.sections.items():
+            for chunk in chunk_knowledge(name, text):
+                part.add(KNOWLEDGE_PREFIX + name, chunk, name.replace("_", " ") + " " + chunk)
+        self._knowledge = part
+        self._version = version
+        logger.info(f"Retrieval knowledge v{version} indexed: {len(part)} passages in {(time.perf_counter() - start) * 1000:.1f}ms")
+
+    def __len__(self):
+        self._ensure_knowledge()
+        return len(self._knowledge) + len(self._learned)
+
+    async def learn(self, messages, source):
+        """Trocea y añade mensajes al índice; se persisten en disco fuera del event loop."""
+        records = []
+        for chunk in chunk_messages(messages):
+            fingerprint = self._fingerprint(source, chunk.encode("utf-8"))
+            if fingerprint in self._seen:
+                continue
+            self._seen.add(fingerprint)
+            records.append((source, chunk))
+        if not records:
+            return 0
+
+        # Buscables ya desde memoria; cuando estén en disco pasan a leerse del mmap
+        doc_ids = [self._learned.add(source_name, text, text) for source_name, text in records]
+        async with self._write_lock:
+            locations, size = await asyncio.to_thread(self._write_records, records)
+            self._file_size = size
+            self._remap()
+        for doc_id, location in zip(doc_ids, locations):
+            self._learned.locations[doc_id] = location
+        logger.info(f"Learned {len(records)} passages from {source}")
+        return len(records)
+
+    def search(self, query, k=RETRIEVAL_TOP_K, min_score=RETRIEVAL_MIN_SCORE):
+        """Los `k` pasajes con mejor puntuación BM25 (por encima de `min_score`)."""
+        self._ensure_knowledge()
+        parts = (self._knowledge, self._learned)
+        query_tokens = set(stems(tokenize(query)))
+        n = sum(len(part) for part in parts)
+        if not query_tokens or not n:
+            return []
+        # Estadísticas de corpus (N, longitud media, df) sobre las dos partes juntas
+        avgdl = sum(part.total_length for part in parts) / n or 1.0
+        scores = {}  # (parte, doc_id) -> puntuación
+        for token in query_tokens:
+            df = sum(len(part.postings.get(token, ())) for part in parts)
+            if not df:
+                continue
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for p, part in enumerate(parts):
+                for doc_id, tf in part.postings.get(token, ()):
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * part.lengths[doc_id] / avgdl)
+                    key = (p, doc_id)
+                    scores[key] = scores.get(key, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+        best = sorted(((s, key) for key, s in scores.items() if s >= min_score), reverse=True)[:k]
+        return [Passage(parts[p].sources[d], self._text(parts[p], d), s) for s, (p, d) in best]
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
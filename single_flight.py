@@ -0,0 +1,49 @@
+# single_flight.py
+"""
+Deduplicación single-flight: si llega la misma pregunta mientras otra igual
+está en curso, se espera a esa misma computación en vez de lanzar otra.
+"""
+import asyncio
+import logging
+
+logger = logging.getLogger('SingleFlight')
+
+
+class SingleFlight:
+    def __init__(self):
+        self._inflight = {}  # clave -> (tarea, dato del líder)
+        self.leaders = 0
+        self.followers = 0
+
+    async def run(self, key, factory, owner=None):
+        """
+        Ejecuta `factory()` una sola vez por clave en vuelo.
+        Devuelve (resultado, dueño_del_líder, compartido). La tarea se protege
+        con shield: si el líder se cancela, los demás siguen esperando su resultado.
+        """
+        entry = self._inflight.get(key)
+        if entry is not None:
+            self.followers += 1
+            stats = self.stats()
+            logger.info(
+                f"Single-flight hit: {stats['followers']}/{stats['requests']} requests deduplicated "
+                f"({stats['dedup_ratio']:.0%})"
+            )
+            task, leader_owner = entry
+            return await asyncio.shield(task), leader_owner, True
+
+        self.leaders += 1
+        task = asyncio.ensure_future(factory())
+        self._inflight[key] = (task, owner)
+        task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task), owner, False
+
+    def stats(self):
+        requests = self.leaders + self.followers
+        return {
+            "requests": requests,
+            "leaders": self.leaders,
+            "followers": self.followers,
+            "in_flight": len(self._inflight),
+            "dedup_ratio": self.followers / requests if requests else 0.0,
+        }
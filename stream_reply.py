@@ -0,0 +1,97 @@
+# stream_reply.py
+"""
+Respuesta de Discord que se va editando mientras el LLM genera texto.
+Las ediciones se agrupan (como mucho una cada STREAM_EDIT_INTERVAL segundos)
+y nunca hay dos en vuelo a la vez, así que respetamos el rate limit de edición.
+"""
+import os
+import time
+import asyncio
+import logging
+
+logger = logging.getLogger('StreamReply')
+
+STREAM_REPLIES = os.getenv('MAI_STREAM_REPLIES', '1') != '0'
+STREAM_EDIT_INTERVAL = float(os.getenv('MAI_STREAM_EDIT_INTERVAL', 1.0))
+DISCORD_LIMIT = 2000
+CURSOR = " ▌"
+
+
+def split_message(text, limit=DISCORD_LIMIT):
+    """Trocea un texto largo en mensajes de Discord, cortando por líneas cuando se puede."""
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = limit
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    if text:
+        chunks.append(text)
+    return chunks
+
+
+class StreamingReply:
+    def __init__(self, message, interval=STREAM_EDIT_INTERVAL):
+        self.message = message
+        self.interval = interval
+        self.reply = None
+        self.first_visible_at = None
+        self._started_at = time.monotonic()
+        self._pending = None
+        self._last_edit = 0.0
+        self._closed = False
+        self._closing = asyncio.Event()
+        self._pump_task = None
+
+    async def update(self, text):
+        """Nuevo texto parcial. Solo se guarda; el envío real lo hace el pump."""
+        if self._closed or (not text and self.reply is None):
+            return
+        self._pending = text
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump())
+
+    async def _render(self, text):
+        shown = (text or "⏳") + CURSOR
+        if len(shown) > DISCORD_LIMIT:
+            shown = shown[:DISCORD_LIMIT - len(CURSOR) - 1] + "…" + CURSOR
+        if self.reply is None:
+            self.reply = await self.message.reply(shown)
+            self.first_visible_at = time.monotonic()
+            logger.info(f"First visible text after {self.first_visible_at - self._started_at:.2f}s")
+        else:
+            await self.reply.edit(content=shown)
+        self._last_edit = time.monotonic()
+
+    async def _pump(self):
+        while not self._closed and self._pending is not None:
+            wait = self._last_edit + self.interval - time.monotonic()
+            if wait > 0 and self.reply is not None:
+                try:
+                    # Se despierta antes solo si se cierra el stream
+                    await asyncio.wait_for(self._closing.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                if self._closed:
+                    return
+            text, self._pending = self._pending, None
+            try:
+                await self._render(text)
+            except Exception as e:
+                logger.warning(f"Streaming edit failed: {e}")
+
+    async def finish(self, text):
+        """Deja la respuesta final (con las partes extra si supera el límite de Discord)."""
+        self._closed = True
+        self._closing.set()
+        if self._pump_task is not None:
+            await asyncio.gather(self._pump_task, return_exceptions=True)
+        chunks = split_message(text) or ["…"]
+        if self.reply is None:
+            self.reply = await self.message.reply(chunks[0])
+        else:
+            await self.reply.edit(content=chunks[0])
+        for chunk in chunks[1:]:
+            await self.message.channel.send(chunk)
+        return self.reply
@@ -0,0 +1,64 @@
+# text_utils.py
+"""
+Utilidades de texto compartidas por los índices y buscadores de MAI.
+"""
+import re
+import unicodedata
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def fold_accents(text: str) -> str:
+    """Pasa a minúsculas y quita tildes ("Canción" -> "cancion")."""
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def tokenize(text: str) -> list:
+    """Divide un texto en tokens normalizados (minúsculas, sin tildes)."""
+    return _TOKEN_RE.findall(fold_accents(text))
+
+
+# Palabras vacías (ES + algo de EN) que no cambian el sentido de una pregunta.
+# Las negaciones y los interrogativos (no, sin, cuándo, dónde...) se conservan a propósito.
+STOPWORDS = frozenset("""
+a al algo alguien con de del el ella ellos en es esa ese eso esta este esto estoy fue ha hay
+la las le les lo los me mi mis muy nos o para pero por que se si sobre son su sus te ti tu tus
+un una uno unos unas y ya yo hola buenas gracias porfa porfavor favor pls oye mai bro
+the is are a an to of in on for and or do does i you it my
+""".split())
+
+
+def normalize_query(text: str) -> tuple:
+    """Forma canónica de una pregunta: tokens sin tildes ni stopwords, sin repetir y ordenados."""
+    return tuple(sorted({t for t in tokenize(text) if t not in STOPWORDS}))
+
+
+# Stemming muy ligero: comparar por prefijo ("importo" ~ "importar", "bloquear" ~ "bloqueo")
+STEM_LENGTH = 5
+
+
+def stems(tokens, length=STEM_LENGTH) -> list:
+    """Prefijos de los tokens que no son stopwords (para los índices BM25)."""
+    return [t[:length] for t in tokens if t not in STOPWORDS]
+
+
+# Las respuestas se generan con este marcador en vez del nombre del usuario: así se pueden
+# cachear y compartir entre usuarios, y el nombre se pone al contestar
+USER_PLACEHOLDER = "{usuario}"
+
+
+def personalize(text: str, user_name: str, partial=False) -> str:
+    """Pone el nombre del usuario en el marcador. Con `partial` (texto a medio generar) oculta un marcador aún incompleto."""
+    if partial:
+        cut = text.rfind("{")
+        if cut != -1 and USER_PLACEHOLDER.startswith(text[cut:]):
+            text = text[:cut]
+    return text.replace(USER_PLACEHOLDER, user_name)
+
+
+def mentions_user(text: str, user_name: str) -> bool:
+    """Si el texto nombra al usuario (palabra completa): entonces no sirve para otros usuarios."""
+    if not user_name:
+        return False
+    return re.search(rf"(?<!\w){re.escape(user_name)}(?!\w)", text, re.IGNORECASE) is not None